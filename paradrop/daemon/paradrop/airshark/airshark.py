@@ -7,6 +7,11 @@ from paradrop.lib.utils import pdos
 from paradrop.core.config.airshark import airshark_interface_manager
 from scanner import Scanner
 from analyzer import AnalyzerProcessProtocol
+from spectrum_reader import SpectrumFrames
+
+
+# Seconds between reads of spectral samples.
+SPECTRUM_INTERVAL = 0.2
 
 
 class AirsharkManager(object):
@@ -57,7 +62,7 @@ class AirsharkManager(object):
                          cmd[0], cmd, env=None, \
                          childFDs={0:"w", 1:"r", 2:2, 3:"w", 4:"r"})
 
-        self.loop.start(0.2)
+        self.loop.start(SPECTRUM_INTERVAL)
         return True
 
     def _stop(self):
@@ -72,23 +77,23 @@ class AirsharkManager(object):
 
     def check_spectrum(self):
         # The bandwidth of the data is about 160k Bytes per second
-        ts, data = self.scanner.spectrum_reader.read_samples()
-        if ((data is not None) and (len(self.spectrum_observers) > 0 or self.analyzer_process.isRunning())):
+        reader = self.scanner.spectrum_reader
+        if reader.fill() > 0 and (len(self.spectrum_observers) > 0 or self.analyzer_process.isRunning()):
             if len(self.spectrum_observers) > 0:
+                data, position, dropped = reader.ring.read(reader.ring.previous_end)
                 #for (tsf, max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, sdata) in SpectrumReader.decode(data):
                 #    for observer in self.spectrum_observers:
                 #        observer.on_spectrum_data(tsf, max_exp, freq, rssi, noise, max_mag, max_index, bitmap_weight, sdata)
 
-                # Due to performance issue, we have to delegate the packet decoding task to clients
-                # for packet in SpectrumReader.decode(data):
-                #    for observer in self.spectrum_observers:
-                #        observer.on_spectrum_data(packet)
+                # Observers choose between the raw samples and a compact
+                # encoding.  Each encoding is computed once and shared.
+                frames = SpectrumFrames(data)
                 for observer in self.spectrum_observers:
-                    observer.on_spectrum_data(data)
+                    observer.on_spectrum_data(frames)
 
             if self.analyzer_process.isRunning():
                 # Forward spectrum data to the airshark analyzer
-                self.analyzer_process.feedSpectrumData(data)
+                self.analyzer_process.feedSpectrumData(reader.ring)
 
     # TODO: Not sure we need it or not
     def read_raw_samples(self):
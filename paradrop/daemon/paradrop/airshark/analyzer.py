@@ -1,10 +1,31 @@
+from twisted.internet import interfaces
 from twisted.internet.protocol import ProcessProtocol
+from zope.interface import implementer
+
 from paradrop.base.output import out
 
+
+# File descriptor on which the analyzer reads spectrum data.
+SPECTRUM_FD = 3
+
+
+@implementer(interfaces.IPushProducer)
 class AnalyzerProcessProtocol(ProcessProtocol):
+    """
+    Runs the Airshark analyzer and feeds it spectrum data.
+
+    The protocol reads spectrum data from the sample ring at its own
+    position.  While the pipe to the analyzer is full, it stops writing and
+    catches up when the pipe drains; if the ring wraps past it in the
+    meantime, the skipped bytes are counted in `dropped`.
+    """
     def __init__(self, airshark_manager):
         self.ready = False
         self.airshark_manager = airshark_manager
+        self.ring = None
+        self.position = None
+        self.paused = False
+        self.dropped = 0
 
     def isRunning(self):
         return self.ready
@@ -12,6 +33,9 @@ class AnalyzerProcessProtocol(ProcessProtocol):
     def connectionMade(self):
         out.info('Airshark analyzer process starts')
         self.ready = True
+        self.position = None
+        self.paused = False
+        self.transport.pipes[SPECTRUM_FD].registerProducer(self, True)
 
     def childDataReceived(self, childFd, data):
         if (childFd == 4):
@@ -26,8 +50,37 @@ class AnalyzerProcessProtocol(ProcessProtocol):
         out.info('Airshark analyzer process exits')
         self.ready = False
 
-    def feedSpectrumData(self, data):
-        self.transport.writeToChild(3, data)
+    def feedSpectrumData(self, ring):
+        self.ring = ring
+
+        # Start with the data from the latest read.
+        if self.position is None:
+            self.position = ring.previous_end
+
+        if self.paused:
+            return
+
+        data, self.position, dropped = ring.read(self.position)
+        if dropped > 0:
+            self.dropped += dropped
+            out.warn('Airshark analyzer fell behind, skipped {} bytes'.format(dropped))
+        if data:
+            self.transport.writeToChild(SPECTRUM_FD, data)
+
+    #
+    # IPushProducer interface, for the pipe to the analyzer.
+    #
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.ready and self.ring is not None:
+            self.feedSpectrumData(self.ring)
+
+    def stopProducing(self):
+        self.paused = True
 
     def stop(self):
         self.transport.signalProcess('KILL')
@@ -1,28 +1,133 @@
+import io
 import struct
 from datetime import datetime
 
 from twisted.internet.fdesc import setNonBlocking
 
+from paradrop.base import settings
+
+
+class SampleRing(object):
+    """
+    Preallocated ring buffer of spectral sample data.
+
+    Positions are absolute byte counts since the ring was created, so each
+    consumer can remember where it stopped reading and find out how much it
+    missed if the ring wrapped past it.  When a consumer is skipped ahead,
+    it lands on a multiple of `align` bytes, i.e. on a packet boundary.
+    """
+    def __init__(self, capacity, align=1):
+        self.align = align
+        self.capacity = max(align, capacity - capacity % align)
+        self.buffer = bytearray(self.capacity)
+        self.view = memoryview(self.buffer)
+
+        # Position after the last byte written, and before the last fill.
+        self.end = 0
+        self.previous_end = 0
+
+    def start(self):
+        """
+        Return the position of the oldest byte still in the ring.
+        """
+        return max(0, self.end - self.capacity)
+
+    def fill(self, readinto):
+        """
+        Read available data into the ring with readinto (e.g. the readinto
+        method of a file), at most one ring's worth per call.
+
+        Returns the number of bytes read.
+        """
+        self.previous_end = self.end
+        total = 0
+        while total < self.capacity:
+            pos = self.end % self.capacity
+            count = readinto(self.view[pos:pos + self.capacity - total])
+            if not count:
+                break
+            self.end += count
+            total += count
+        return total
+
+    def read(self, position, limit=None):
+        """
+        Copy out the data after position.
+
+        Returns (data, new position, number of bytes skipped because the
+        ring wrapped past position).
+        """
+        dropped = 0
+        start = self.start()
+        if position < start:
+            dropped = start - position
+            dropped += -dropped % self.align
+            position += dropped
+
+        end = self.end
+        if limit is not None:
+            end = min(end, position + limit)
+        if position >= end:
+            return '', position, dropped
+
+        first = position % self.capacity
+        length = end - position
+        if first + length <= self.capacity:
+            data = self.view[first:first + length].tobytes()
+        else:
+            data = self.view[first:].tobytes() + \
+                self.view[:length - (self.capacity - first)].tobytes()
+        return data, end, dropped
+
 
 class SpectrumReader(object):
 
     # spectral scan packet format constants
     hdrsize = 3
     pktsize = 17 + 56
+    nbins = 56
+
+    # Header and packet fields up to the samples:
+    # (stype, slen, max_exp, freq, rssi, noise, max_mag, max_index,
+    #  bitmap_weight, tsf)
+    sample_header = struct.Struct(">BHBHbbHBBQ")
+
+    # Compact frame format sent to spectrum clients:
+    # (version, bins per packet, packet count), then for each packet
+    # (tsf, freq, rssi, noise, max_exp) followed by the bins.
+    frame_version = 1
+    frame_header = struct.Struct(">BBI")
+    frame_packet = struct.Struct(">QHbbB")
 
     # ieee 802.11 constants
     sc_wide = 0.3125  # in MHz
 
-    def __init__(self, path):
-        self.fp = file(path)
+    def __init__(self, path, capacity=None):
+        self.fp = io.open(path, 'rb', buffering=0)
         if not self.fp:
             raise Exception("Cant open file '%s'" % path)
 
         setNonBlocking(self.fp.fileno())
 
+        if capacity is None:
+            capacity = settings.AIRSHARK_SPECTRUM_BUFFER_SIZE
+        self.ring = SampleRing(capacity, align=self.hdrsize + self.pktsize)
+
+    def fill(self):
+        """
+        Read the available samples into the ring buffer without allocating.
+
+        Returns the number of bytes read.  Consumers find the new data
+        between ring.previous_end and ring.end.
+        """
+        try:
+            return self.ring.fill(self.fp.readinto)
+        except IOError:
+            return 0
+
     def read_samples(self):
-        data = self.fp.read()
-        if (data):
+        if self.fill() > 0:
+            data, position, dropped = self.ring.read(self.ring.previous_end)
             ts = datetime.now()
             return ts, data
         else:
@@ -30,6 +135,63 @@ class SpectrumReader(object):
 
     def flush(self):
         self.fp.read()
+        self.ring.previous_end = self.ring.end
+
+    @staticmethod
+    def decode_headers(data):
+        """
+        Iterate over the packets in data, yielding (offset of the samples,
+        max_exp, freq, rssi, noise, tsf) for each one.
+
+        Each header is unpacked with one call to a precompiled struct, and the
+        samples are left in place for the caller to slice.
+        """
+        unpack_from = SpectrumReader.sample_header.unpack_from
+        step = SpectrumReader.hdrsize + SpectrumReader.pktsize
+        header_size = SpectrumReader.sample_header.size
+        end = len(data) - step + 1
+
+        pos = 0
+        while pos < end:
+            (stype, slen, max_exp, freq, rssi, noise, max_mag, max_index,
+                bitmap_weight, tsf) = unpack_from(data, pos)
+
+            # Discard the rest of the data if the header is malformed (see
+            # decode).
+            if not (stype == 1 and slen == SpectrumReader.pktsize):
+                break
+
+            yield (pos + header_size, max_exp, freq, rssi, noise, tsf)
+            pos += step
+
+    @staticmethod
+    def encode_frame(data, bins=56):
+        """
+        Encode the packets in data as a compact frame for spectrum clients.
+
+        The 56 samples of each packet are averaged down to `bins` values,
+        which must divide 56 evenly.  All samples in a packet share max_exp,
+        so averaging them is consistent.
+        """
+        if bins <= 0 or SpectrumReader.nbins % bins != 0:
+            raise ValueError("bins must divide {}".format(SpectrumReader.nbins))
+        group = SpectrumReader.nbins // bins
+
+        pack = SpectrumReader.frame_packet.pack
+        parts = []
+        for pos, max_exp, freq, rssi, noise, tsf in SpectrumReader.decode_headers(data):
+            parts.append(pack(tsf, freq, rssi, noise, max_exp))
+            samples = data[pos:pos + SpectrumReader.nbins]
+            if group == 1:
+                parts.append(samples)
+            else:
+                values = bytearray(samples)
+                parts.append(str(bytearray(sum(values[i:i + group]) // group
+                                           for i in range(0, len(values), group))))
+
+        header = SpectrumReader.frame_header.pack(SpectrumReader.frame_version,
+                                                  bins, len(parts) // 2)
+        return header + ''.join(parts)
 
     @staticmethod
     def decode(data):
@@ -105,3 +267,22 @@ class SpectrumReader(object):
 
                 yield (tsf, freq, noise, rssi, pwr)
                 '''
+
+
+class SpectrumFrames(object):
+    """
+    One batch of spectral samples and its encodings.
+
+    Observers that ask for the same encoding share one copy, so each
+    encoding is computed once per batch regardless of the number of clients.
+    """
+    def __init__(self, data):
+        self.raw = data
+        self.frames = dict()
+
+    def encode(self, bins):
+        frame = self.frames.get(bins, None)
+        if frame is None:
+            frame = SpectrumReader.encode_frame(self.raw, bins)
+            self.frames[bins] = frame
+        return frame
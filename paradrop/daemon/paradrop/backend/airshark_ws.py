@@ -1,19 +1,58 @@
 from autobahn.twisted.websocket import WebSocketServerProtocol
 from autobahn.twisted.websocket import WebSocketServerFactory
+from autobahn.websocket.types import ConnectionDeny
 
+from paradrop.airshark.airshark import SPECTRUM_INTERVAL
+from paradrop.airshark.spectrum_reader import SpectrumReader
 from paradrop.base.output import out
 
 class AirsharkSpectrumProtocol(WebSocketServerProtocol):
+    """
+    Streams spectral samples to a client.
+
+    By default the client receives the raw samples read from the radio.
+    Query parameters select a compact encoding instead:
+
+    format=compact: send frames encoded by SpectrumReader.encode_frame
+    bins=N: average the 56 samples of each packet down to N values
+    fps=F: send at most F frames per second
+    """
     def __init__(self, factory):
         WebSocketServerProtocol.__init__(self)
         self.factory = factory
+        self.bins = None
+        self.every = 1
+        self.ticks = 0
+
+    def onConnect(self, request):
+        params = request.params
+        try:
+            if params.get('format', ['raw'])[0] == 'compact':
+                self.bins = int(params.get('bins', [SpectrumReader.nbins])[0])
+                if self.bins <= 0 or SpectrumReader.nbins % self.bins != 0:
+                    raise ValueError("bins must divide {}".format(SpectrumReader.nbins))
+
+            if 'fps' in params:
+                fps = float(params['fps'][0])
+                if fps <= 0:
+                    raise ValueError("fps must be positive")
+                self.every = max(1, int(round(1.0 / (fps * SPECTRUM_INTERVAL))))
+        except ValueError as error:
+            raise ConnectionDeny(ConnectionDeny.BAD_REQUEST, str(error))
 
     def onOpen(self):
         out.info('ws /airshark/spectrum connected')
         self.factory.airshark_manager.add_spectrum_observer(self)
 
-    def on_spectrum_data(self, data):
-        self.sendMessage(data, True)
+    def on_spectrum_data(self, frames):
+        self.ticks += 1
+        if self.ticks % self.every != 0:
+            return
+
+        if self.bins is None:
+            self.sendMessage(frames.raw, True)
+        else:
+            self.sendMessage(frames.encode(self.bins), True)
 
     def onClose(self, wasClean, code, reason):
         out.info('ws /airshark/spectrum disconnected: {}'.format(reason))
@@ -45,16 +45,7 @@ def get_allowed_bearer():
     """
     Return set of allowed bearer tokens.
     """
-    allowed = set()
-
-    chuteStore = ChuteStorage()
-    chutes = chuteStore.getChuteList()
-    for chute in chutes:
-        token = chute.getCache('apiToken')
-        if token is not None:
-            allowed.add(token)
-
-    return allowed
+    return set(ChuteStorage.getTokenIndex().keys())
 
 
 def check_auth(request, password_manager, token_manager):
@@ -73,8 +64,7 @@ def check_auth(request, password_manager, token_manager):
         # Chutes use non-expiring random tokens that are generated at container
         # creation. This works well because we do not want to deal with
         # expiration or revocation.
-        allowed_tokens = get_allowed_bearer()
-        if token in allowed_tokens:
+        if ChuteStorage.lookupToken(token) is not None:
             return True
 
         # Users (through the local portal or pdtools) can acquire expiring
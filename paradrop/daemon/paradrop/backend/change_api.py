@@ -43,11 +43,67 @@ class ChangeApi(object):
         for update in self.update_manager.active_changes.values():
             changes.append(dump_update(update, 'processing'))
 
-        for update in self.update_manager.updateQueue:
+        for update in self.update_manager.get_queued_changes():
             changes.append(dump_update(update, 'queued'))
 
         return json.dumps(changes)
 
+    @routes.route('/timing', methods=['GET'])
+    def get_timing(self, request):
+        """
+        Get plan timing aggregated across recently completed changes.
+
+        The optional "limit" query parameter restricts the summary to the
+        last N changes.  Functions are listed in order of total wall time.
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        limit = None
+        if 'limit' in request.args:
+            try:
+                limit = int(request.args['limit'][0])
+            except ValueError:
+                request.setResponseCode(400)
+                return "{}"
+
+        return json.dumps(self.update_manager.get_timing_summary(limit))
+
+    @routes.route('/latency', methods=['GET'])
+    def get_latency(self, request):
+        """
+        Get how long recently completed changes waited in the queue.
+
+        Returns the number of changes and the mean and maximum seconds
+        between a change being queued and starting.
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+        return json.dumps(self.update_manager.get_latency_summary())
+
+    @routes.route('/<int:change_id>/timeline', methods=['GET'])
+    def get_change_timeline(self, request, change_id):
+        """
+        Get the time spent in each step of an active or recent change.
+
+        Each entry has the plan function name and module, the phase
+        ("execute" or "abort"), start time, and wall and CPU seconds.
+        """
+        cors.config_cors(request)
+        request.setHeader('Content-Type', 'application/json')
+
+        update = self.update_manager.find_change(change_id)
+        if update is None:
+            request.setResponseCode(404)
+            return "{}"
+
+        result = {
+            'id': update.change_id,
+            'completed': update.completed,
+            'timeline': update.timeline
+        }
+        return json.dumps(result)
+
     @routes.route('/', methods=['POST'])
     def create_change(self, request):
         """
@@ -15,12 +15,14 @@ import yaml
 
 from autobahn.twisted.resource import WebSocketResource
 from klein import Klein
+from twisted.web import http
 
 from paradrop.base import pdutils, settings
 from paradrop.base.output import out
 from paradrop.core.chute.chute_storage import ChuteStorage
 from paradrop.core.config import resource
 from paradrop.core.container.chutecontainer import ChuteContainer
+from paradrop.core.system.dhcp_leases import leaseIndex
 
 from . import cors
 from . import hostapd_control
@@ -769,24 +771,19 @@ class ChuteApi(object):
         leasefile = 'dnsmasq-{}.leases'.format(network)
         path = os.path.join(externalSystemDir, leasefile)
 
-        # The format of the dnsmasq leases file is one entry per line with
-        # space-separated fields.
-        keys = ['expires', 'mac_addr', 'ip_addr', 'hostname', 'client_id']
-
         try:
-            leases = []
-            with open(path, 'r') as source:
-                for line in source:
-                    parts = line.strip().split()
-                    leases.append(dict(zip(keys, parts)))
-            return json.dumps(leases)
-
-        except IOError:
+            leases = leaseIndex.getFile(path)
+        except (IOError, OSError):
             # During chute uninstallation, there is a small window where the
             # chute still exists but the leases file has been removed.
             request.setResponseCode(404)
             return "[]"
 
+        if request.setETag(leases.etag) == http.CACHED:
+            return ""
+
+        return leases.body
+
     @routes.route('/<chute>/networks/<network>/ssid', methods=['GET'])
     def get_ssid(self, request, chute, network):
         """
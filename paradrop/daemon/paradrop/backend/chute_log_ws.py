@@ -1,33 +1,35 @@
-from autobahn.twisted.websocket import WebSocketServerProtocol
 from autobahn.twisted.websocket import WebSocketServerFactory
-from twisted.internet.task import LoopingCall
 
 from paradrop.base.output import out
-from paradrop.core.container.log_provider import LogProvider
+from paradrop.core.container import log_provider
 
-class ChuteLogWsProtocol(WebSocketServerProtocol):
+from .generic_ws import ProducerConsumerWsProtocol
+
+
+class ChuteLogWsProtocol(ProducerConsumerWsProtocol):
     def __init__(self, factory):
-        WebSocketServerProtocol.__init__(self)
+        ProducerConsumerWsProtocol.__init__(self)
         self.factory = factory
-        self.loop = LoopingCall(self.check_log)
-        self.log_provider = None
 
     def onOpen(self):
         out.info('ws /chute_logs connected')
-        self.log_provider = LogProvider(self.factory.chute)
-        self.log_provider.attach()
-        self.loop.start(0.5)
+        ProducerConsumerWsProtocol.onOpen(self)
+
+        subscription = log_provider.subscribe(self.factory.chute, self)
+
+        # Let the transport pause the subscription while its send buffer is
+        # full.  If the transport already has a producer, the subscription's
+        # bounded buffer still limits how far behind this client can fall.
+        try:
+            self.transport.registerProducer(subscription, True)
+        except RuntimeError:
+            pass
 
-    def check_log(self):
-        logs = self.log_provider.get_logs()
-        for log in logs:
-            self.sendMessage(log)
+        self.registerProducer(subscription, True)
 
     def onClose(self, wasClean, code, reason):
         out.info('ws /chute_logs disconnected: {}'.format(reason))
-        self.loop.stop()
-        self.log_provider.detach()
-        self.log_provider = None
+        ProducerConsumerWsProtocol.onClose(self, wasClean, code, reason)
 
 
 class ChuteLogWsFactory(WebSocketServerFactory):
@@ -13,8 +13,9 @@ class ParadropLogWsProtocol(WebSocketServerProtocol):
         out.info('ws /paradrop_logs connected')
         self.factory.addParadropLogObserver(self)
 
-    def onParadropLog(self, logDict):
-        self.sendMessage(logDict['message'])
+    def onParadropLogs(self, logs):
+        for logDict in logs:
+            self.sendMessage(logDict['message'])
 
     def onClose(self, wasClean, code, reason):
         out.info('ws /paradrop_logs disconnected: {}'.format(reason))
@@ -33,14 +34,14 @@ class ParadropLogWsFactory(WebSocketServerFactory):
         if (self.observers.count(observer) == 0):
             self.observers.append(observer)
             if len(self.observers) == 1:
-                smokesignal.on('logs', self.onParadropLog)
+                smokesignal.on('log_batch', self.onParadropLogs)
 
     def removeParadropLogObserver(self, observer):
         if (self.observers.count(observer) == 1):
             self.observers.remove(observer)
             if len(self.observers) == 0:
-                smokesignal.disconnect(self.onParadropLog)
+                smokesignal.disconnect(self.onParadropLogs)
 
-    def onParadropLog(self, logDict):
+    def onParadropLogs(self, logs):
         for observer in self.observers:
-            observer.onParadropLog(logDict)
+            observer.onParadropLogs(logs)
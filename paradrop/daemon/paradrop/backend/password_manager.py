@@ -1,6 +1,9 @@
 import os
 import crypt
+import hashlib
+import hmac
 import random
+import time
 
 from paradrop.base import settings
 from paradrop.lib.utils import pdos
@@ -9,9 +12,19 @@ class PasswordManager(object):
     DEFAULT_USER_NAME = 'paradrop'
     DEFAULT_PASSWORD = ''
 
+    # Maximum number of verified credentials to remember.
+    MAX_CACHED_CREDENTIALS = 64
+
     def __init__(self):
         self.password_file = os.path.join(settings.CONFIG_HOME_DIR, 'password')
 
+        # Checking a password hash is deliberately slow, and API clients send
+        # the same credentials with every request.  Remember credentials that
+        # passed verification, identified by a keyed hash so that the
+        # passwords themselves are not kept in memory.
+        self.cache_key = os.urandom(32)
+        self.verified = dict()
+
         # Try to parse the password file
         # self.records will have the pairs of user name and password hash
         parsed = False
@@ -60,11 +73,19 @@ class PasswordManager(object):
             # Use SHA512
             return '$6$' + elements[2]
 
+    def _credential_digest(self, user_name, password):
+        message = "{}:{}".format(user_name, password)
+        return hmac.new(self.cache_key, message, hashlib.sha256).digest()
+
+    def _clear_verified(self):
+        self.verified.clear()
+
     def _hash_password(self, password):
         salt = self._generate_salt()
         return crypt.crypt(password, salt)
 
     def reset(self):
+        self._clear_verified()
         self.records = []
         self.records.append({
             'user_name': PasswordManager.DEFAULT_USER_NAME,
@@ -92,16 +113,27 @@ class PasswordManager(object):
         self.records = [x for x in self.records if x['user_name'] != user_name]
 
         if len(self.records) != origin_len:
+            self._clear_verified()
             self._sync_password_file()
 
     def verify_password(self, user_name, password):
+        digest = self._credential_digest(user_name, password)
+        expires = self.verified.get(digest, None)
+        if expires is not None and time.time() < expires:
+            return True
+
         found_records = filter(lambda x: x['user_name'] == user_name, self.records)
         count = len(found_records)
         if count == 0:
             return False
         elif count == 1:
             password_hash = found_records[0]['password_hash']
-            return crypt.crypt(password, self._retrieve_salt(password_hash)) == password_hash
+            valid = crypt.crypt(password, self._retrieve_salt(password_hash)) == password_hash
+            if valid and settings.LOCAL_AUTH_CACHE_TTL > 0:
+                if len(self.verified) >= self.MAX_CACHED_CREDENTIALS:
+                    self._clear_verified()
+                self.verified[digest] = time.time() + settings.LOCAL_AUTH_CACHE_TTL
+            return valid
         elif count > 1:
             # Should not be here
             raise Exception('Faint! Is there something wrong?')
@@ -114,6 +146,7 @@ class PasswordManager(object):
         for i in self.records:
             if i['user_name'] == user_name:
                 i['password_hash'] = self._hash_password(newPassword)
+                self._clear_verified()
                 self._sync_password_file()
                 return True
 
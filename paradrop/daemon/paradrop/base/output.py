@@ -10,11 +10,15 @@ Some of the methods and choice here may seem strange -- they are meant to
 keep this file in
 """
 
+import bisect
+import collections
 import colorama
+import gzip
 import json
 import os
 import Queue
 import sys
+import shutil
 import threading
 import time
 import traceback
@@ -22,16 +26,31 @@ import traceback
 import smokesignal
 
 from enum import Enum
-from twisted.python.logfile import DailyLogFile
+from twisted.internet import reactor
 from twisted.python import log
 
-from . import pdutils
+from . import pdutils, settings
 
 
 # colorama package does colors but doesn't do style, so keeping this for now
 BOLD = '\033[1m'
 LOG_NAME = 'log'
 
+# Every log file has a sparse index mapping timestamps to file offsets, which
+# lets readers skip to the records they want.  An index entry is written every
+# INDEX_INTERVAL records.
+INDEX_SUFFIX = '.index'
+INDEX_INTERVAL = 64
+
+# Rotated log files are named by the local time they were rotated.  Older
+# versions rotated daily and named files by date only.
+SEGMENT_FORMAT = '%Y_%m_%d_%H_%M_%S'
+DAILY_FORMAT = '%Y_%m_%d'
+
+# Log records waiting to be delivered to 'log_batch' listeners, e.g. log
+# websockets.  If the reactor falls behind, the oldest records are dropped.
+BROADCAST_BUFFER_SIZE = 1000
+
 Level = Enum('Level', 'HEADER, VERBOSE, INFO, PERF, WARN, ERR, SECURITY, FATAL, USAGE')
 
 # Represents formatting information for the specified log type
@@ -66,15 +85,25 @@ def silentLogPrefix(stepsUp):
     '''
 
     try:
-        trace = sys._getframe(stepsUp).f_code.co_filename
-        line = sys._getframe(stepsUp).f_lineno
-        module, package = parseLogPrefix(trace)
+        frame = sys._getframe(stepsUp)
+        trace = frame.f_code.co_filename
+        line = frame.f_lineno
+
+        prefix = prefixCache.get(trace, None)
+        if prefix is None:
+            prefix = parseLogPrefix(trace)
+            prefixCache[trace] = prefix
+        module, package = prefix
     except:
         return 'unknown', 'unknown', '??'
 
     return package, module, line
 
 
+# Map source filename -> (module, package) for silentLogPrefix.
+prefixCache = dict()
+
+
 def parseLogPrefix(tb):
     '''
     Takes a traceback returned by 'extract_tb' and returns the package, module,
@@ -87,6 +116,266 @@ def parseLogPrefix(tb):
     return module, package
 
 
+def readIndex(path):
+    '''
+    Read the index for the log file at path.
+
+    Returns a list of (timestamp, offset) pairs, where timestamp is the latest
+    timestamp of any record before offset.  The timestamps never decrease,
+    even if records were written slightly out of order.
+    '''
+    entries = []
+    try:
+        with open(path + INDEX_SUFFIX, 'r') as source:
+            for line in source:
+                parts = line.split()
+                if len(parts) == 2:
+                    entries.append((float(parts[0]), int(parts[1])))
+    except (IOError, ValueError):
+        pass
+    return entries
+
+
+def readLogFile(path, target, types=None):
+    '''
+    Iterate over records in a log file with timestamps later than target.
+
+    Reading starts at the last indexed offset before which no record is later
+    than target.  Damaged lines, e.g. one that is still being written, are
+    skipped.
+
+    :param types: if given, only return records with these type values
+    :type types: set.
+    '''
+    entries = readIndex(path)
+    i = bisect.bisect_right([e[0] for e in entries], target)
+    offset = entries[i - 1][1] if i > 0 else 0
+
+    with openSegment(path) as source:
+        source.seek(offset)
+        for line in source:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if record['timestamp'] > target and \
+                    (types is None or record['type'] in types):
+                yield record
+
+
+class LogIndexer(object):
+
+    '''
+    Maintains the index for a log file as records are appended to it.
+
+    Records written after the last index entry (or the whole file if it has
+    no index yet) are scanned when the indexer is created.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+
+        entries = readIndex(path)
+        if len(entries) > 0:
+            self.latest, self.offset = entries[-1]
+        else:
+            self.latest, self.offset = 0, 0
+        self.count = 0
+
+        self.index = open(path + INDEX_SUFFIX, 'a')
+
+        if os.path.exists(path):
+            with open(path, 'r') as source:
+                source.seek(self.offset)
+                for line in source:
+                    try:
+                        timestamp = json.loads(line)['timestamp']
+                    except Exception:
+                        timestamp = self.latest
+                    self.add(timestamp, len(line))
+
+    def add(self, timestamp, length):
+        '''
+        Account for a record of the given length appended to the file.
+        '''
+        if self.count > 0 and self.count % INDEX_INTERVAL == 0:
+            self.index.write('%r %d\n' % (self.latest, self.offset))
+
+        self.latest = max(self.latest, timestamp)
+        self.offset += length
+        self.count += 1
+
+    def flush(self):
+        self.index.flush()
+
+    def close(self):
+        self.index.close()
+
+
+def openSegment(path):
+    '''
+    Open a log segment for reading, whether or not it has been compressed.
+    '''
+    try:
+        return open(path, 'r')
+    except IOError:
+        return gzip.open(path + '.gz', 'rb')
+
+
+def removeSegment(path):
+    '''
+    Remove a rotated log segment and its index.
+    '''
+    for name in [path, path + '.gz', path + INDEX_SUFFIX]:
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def segmentSize(path):
+    size = 0
+    for name in [path, path + '.gz', path + INDEX_SUFFIX]:
+        if os.path.exists(name):
+            size += os.path.getsize(name)
+    return size
+
+
+def listSegments(directory, name=LOG_NAME):
+    '''
+    List the rotated segments of a log, oldest first.
+
+    Returns a list of (end, path) pairs, where end is a time after the last
+    record in the segment and path is the segment's uncompressed name.
+    '''
+    segments = set()
+    for f in os.listdir(directory):
+        parts = f.split('.')
+        if parts[0] != name or len(parts) < 2:
+            continue
+        if len(parts) == 3 and parts[2] == 'gz':
+            parts = parts[:2]
+        if len(parts) != 2:
+            continue
+
+        try:
+            end = time.mktime(time.strptime(parts[1], SEGMENT_FORMAT))
+        except ValueError:
+            try:
+                # Allow a day for clock and timezone changes.
+                end = time.mktime(time.strptime(parts[1], DAILY_FORMAT)) + \
+                    2 * 24 * 60 * 60
+            except ValueError:
+                continue
+
+        segments.add((end, os.path.join(directory, '.'.join(parts))))
+
+    return sorted(segments)
+
+
+def compressSegment(path):
+    '''
+    Replace a rotated log segment with a gzip compressed copy.
+    '''
+    temp = path + '.gz.tmp'
+    with open(path, 'rb') as source:
+        with gzip.open(temp, 'wb') as dest:
+            shutil.copyfileobj(source, dest)
+    os.rename(temp, path + '.gz')
+    os.remove(path)
+
+
+class LogStore(object):
+
+    '''
+    Append-only store for log records, kept as a series of segments.
+
+    Records are appended to the live segment.  When it grows past
+    LOG_ROTATE_SIZE bytes or LOG_ROTATE_INTERVAL seconds, it is renamed
+    with the time of rotation (e.g. log.2017_06_01_12_00_00), compressed
+    if LOG_COMPRESS is set, and the oldest segments are deleted to stay
+    within LOG_MAX_TOTAL_SIZE bytes and LOG_MAX_AGE seconds.
+
+    Writes are buffered until flush is called.
+    '''
+
+    def __init__(self, directory, name=LOG_NAME):
+        self.directory = directory
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.openFile()
+        self.prune()
+
+    def openFile(self):
+        self.file = open(self.path, 'a')
+        self.size = os.path.getsize(self.path)
+        self.indexer = LogIndexer(self.path)
+
+        # Age the live segment from its first record.
+        self.created = time.time()
+        if self.size > 0:
+            try:
+                with open(self.path, 'r') as source:
+                    self.created = json.loads(source.readline())['timestamp']
+            except Exception:
+                pass
+
+    def shouldRotate(self):
+        return self.size >= settings.LOG_ROTATE_SIZE or \
+            time.time() - self.created >= settings.LOG_ROTATE_INTERVAL
+
+    def write(self, record):
+        if self.size > 0 and self.shouldRotate():
+            self.rotate()
+
+        data = json.dumps(record) + '\n'
+        self.file.write(data)
+        self.size += len(data)
+        self.indexer.add(record.get('timestamp', 0), len(data))
+
+    def flush(self):
+        # Write the data before the index entries that point into it.
+        self.file.flush()
+        self.indexer.flush()
+
+    def rotate(self):
+        stamp = time.strftime(SEGMENT_FORMAT, time.localtime())
+        rotated = '%s.%s' % (self.path, stamp)
+
+        # Only possible if we rotate twice in one second; try again later.
+        if os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            return
+
+        self.close()
+        os.rename(self.path, rotated)
+        if os.path.exists(self.path + INDEX_SUFFIX):
+            os.rename(self.path + INDEX_SUFFIX, rotated + INDEX_SUFFIX)
+
+        if settings.LOG_COMPRESS:
+            compressSegment(rotated)
+
+        self.openFile()
+        self.prune()
+
+    def prune(self):
+        '''
+        Delete the oldest segments until the log is within its limits.
+        '''
+        segments = listSegments(self.directory, self.name)
+        sizes = [segmentSize(path) for end, path in segments]
+
+        total = self.size + sum(sizes)
+        oldest = time.time() - settings.LOG_MAX_AGE
+        for (end, path), size in zip(segments, sizes):
+            if total <= settings.LOG_MAX_TOTAL_SIZE and end >= oldest:
+                break
+            removeSegment(path)
+            total -= size
+
+    def close(self):
+        self.file.close()
+        self.indexer.close()
+
+
 class PrintLogThread(threading.Thread):
 
     '''
@@ -99,29 +388,53 @@ class PrintLogThread(threading.Thread):
     simplifies the operation of this class, since it only has to concern
     itself with the queue.
 
-    The path must exist before DailyLog runs for the first time.
+    Records are flushed to disk every LOG_FLUSH_RECORDS records or
+    LOG_FLUSH_INTERVAL seconds after the first unflushed record.
+
+    The path must exist before the thread is created.
     '''
 
     def __init__(self, path, queue, name):
         threading.Thread.__init__(self)
         self.queue = queue
-        self.writer = DailyLogFile(name, path)
+        self.writer = LogStore(path, name)
 
         # Don't want this to float around if the rest of the system goes down
         self.setDaemon(True)
 
     def run(self):
-        while True:
-            result = self.queue.get(block=True)
+        pending = 0
+        deadline = None
 
+        while True:
             try:
-                writable = json.dumps(result)
-                self.writer.write(writable + '\n')
-                self.writer.flush()
-            except:
+                if pending == 0:
+                    result = self.queue.get(block=True)
+                else:
+                    result = self.queue.get(timeout=max(0, deadline - time.time()))
+            except Queue.Empty:
                 pass
+            else:
+                try:
+                    self.writer.write(result)
+                except:
+                    pass
 
-            self.queue.task_done()
+                if pending == 0:
+                    deadline = time.time() + settings.LOG_FLUSH_INTERVAL
+                pending += 1
+
+                self.queue.task_done()
+
+            if pending >= settings.LOG_FLUSH_RECORDS or time.time() >= deadline:
+                try:
+                    self.writer.flush()
+                except:
+                    pass
+                pending = 0
+
+    def close(self):
+        self.writer.close()
 
 
 class OutputRedirect(object):
@@ -412,6 +725,15 @@ class Output():
         # Begins intercepting output and converting ANSI characters to win32 as applicable
         colorama.init()
 
+        # Names of output streams that are turned off.  Calls to them return
+        # before looking up the caller or building a log dict.
+        self.__dict__['disabled'] = set()
+
+        # Records waiting to be delivered to 'log_batch' listeners.
+        self.__dict__['broadcast'] = collections.deque(maxlen=BROADCAST_BUFFER_SIZE)
+        self.__dict__['broadcastScheduled'] = False
+        self.__dict__['broadcastLock'] = threading.Lock()
+
         # Refactor this as an Output class
         self.__dict__['redirectErr'] = OutputRedirect(sys.stderr, self.handlePrint, LOG_TYPES[Level.VERBOSE])
         self.__dict__['redirectOut'] = OutputRedirect(sys.stdout, self.handlePrint, LOG_TYPES[Level.VERBOSE])
@@ -437,6 +759,8 @@ class Output():
 
     def __setattr__(self, name, val):
         def inner(*args, **kwargs):
+            if name in self.disabled:
+                return None
             result = val(*args, **kwargs)
             self.handlePrint(result)
             return result
@@ -496,7 +820,7 @@ class Output():
         self.queue.join()
 
         # Because the print thread can't tell when it goes down as currently designed
-        self.printer.writer.close()
+        self.printer.close()
 
     def handlePrint(self, logDict):
         '''
@@ -519,15 +843,35 @@ class Output():
         if self.queue is not None:
             self.queue.put(logDict)
 
-        res = self.messageToString(logDict)
-
         # Write out the human-readable version to out if needed (but always print out
         # exceptions for testing purposes)
         if self.printLogs or logDict['type'] == 'ERR':
+            res = self.messageToString(logDict)
             self.redirectOut.trueWrite(res)
 
-        # Broadcast the log to interested parties
-        smokesignal.emit('logs', logDict)
+        # Broadcast the log to interested parties.  Messages are logged from
+        # any thread, so they are delivered in batches from the reactor.
+        if smokesignal.receivers.get('log_batch'):
+            with self.broadcastLock:
+                self.broadcast.append(logDict)
+                if self.broadcastScheduled:
+                    return
+                self.__dict__['broadcastScheduled'] = True
+            reactor.callFromThread(self.deliverLogs)
+
+    def deliverLogs(self):
+        '''
+        Deliver queued log records to 'log_batch' listeners.
+
+        Listeners receive a list of log dicts, oldest first.
+        '''
+        with self.broadcastLock:
+            batch = list(self.broadcast)
+            self.broadcast.clear()
+            self.__dict__['broadcastScheduled'] = False
+
+        if len(batch) > 0:
+            smokesignal.emit('log_batch', batch)
 
     def messageToString(self, message):
         '''
@@ -543,56 +887,78 @@ class Output():
         outputObject = self.outputMappings[level.name.lower()]
         return outputObject.formatOutput(message)
 
-    def getLogsSince(self, target, purge=False):
+    def getLogsSince(self, target, purge=False, limit=None, levels=None):
         '''
-        Reads all logs and returns their contents. The current log file is not touched.
-        Removes old log files if 'purge' is set (though this is a topic for debate...)
+        Reads logs and returns their contents.  See iterLogsSince for the
+        parameters.
 
         The server will be most interested in this call, but it needs to register for
         new logs first, else there's a good chance to see duplicates.
 
-        NOTE: don't open all log files, check to open only the ones that might be relevant.
-        This is certainly a bug and can cause memory issues.
-
-        :param target: seconds since the GMT epoch. Method returns logs that have timestamps later than this.
-        :type target: float.
-        :param purge: deletes the old log files (except today's) if set
-        :type purge: bool.
-        :returns: a list of dictionaries containing log information. Not ordered.
+        :returns: a list of dictionaries containing log information, oldest first.
         '''
-
         if not self.logpath:
             out.warn('Asked for log files, but this instance of the output class '
                      'is not currently configured for file logging. '
                      'Call startLogging with a directory first! ')
             return
 
-        ret = []
-
-        for f in os.listdir(self.logpath):
-            path = self.logpath + '/' + f
-
-            # the current log file is treated differently (no date, no delete)
-            if f != LOG_NAME:
-                t = time.strptime(f.split('.')[1], '%Y_%m_%d')
+        return list(self.iterLogsSince(target, purge=purge, limit=limit,
+                                       levels=levels))
 
-                # dont load those with times earlier than target
-                if t >= target:
-                    with open(path, 'r') as x:
-                        ret += [json.loads(y) for y in x.readlines()]
+    def iterLogsSince(self, target, purge=False, limit=None, levels=None):
+        '''
+        Iterate over logs with timestamps later than target, oldest file first.
 
-                # delete all files except log once read
-                if purge:
-                    os.remove(path)
+        Segments, compressed or not, that were rotated before target are not
+        opened, and within a segment the index is used to seek to the first
+        record that may be later than target, so only the records returned
+        are read and parsed.
 
-            # current log file is always loaded
-            else:
-                with open(path, 'r') as f:
-                    ret += [json.loads(y) for y in f.readlines()]
+        Removes old log files if 'purge' is set (though this is a topic for debate...)
 
-        ret = filter(lambda x: x['timestamp'] > target, ret)
+        :param target: seconds since the GMT epoch. Method returns logs that have timestamps later than this.
+        :type target: float.
+        :param purge: deletes the old log files (except today's) if set
+        :type purge: bool.
+        :param limit: stop after returning this many records
+        :type limit: int.
+        :param levels: only return records of these levels (Level members or names)
+        :type levels: list.
+        '''
+        if not self.logpath:
+            return
 
-        return ret
+        types = None
+        if levels is not None:
+            types = set()
+            for level in levels:
+                if not isinstance(level, Level):
+                    level = Level[level.upper()]
+                types.add(level.value)
+
+        files = listSegments(self.logpath) + \
+            [(None, os.path.join(self.logpath, LOG_NAME))]
+
+        count = 0
+        for end, path in files:
+            # Skip segments that end before target.
+            if end is None or end > target:
+                try:
+                    source = readLogFile(path, target, types)
+                    for record in source:
+                        yield record
+
+                        count += 1
+                        if limit is not None and count >= limit:
+                            return
+                except IOError:
+                    # The segment may have been removed by rotation.
+                    pass
+
+            # delete all files except log once read
+            if purge and end is not None:
+                removeSegment(path)
 
 
     ###############################################################################
@@ -614,6 +980,15 @@ class Output():
     def logToConsole(self, newStatus):
         self.__dict__['printLogs'] = newStatus
 
+    def setEnabled(self, name, enabled):
+        '''
+        Turn an output stream (e.g. 'verbose') on or off.
+        '''
+        if enabled:
+            self.disabled.discard(name)
+        else:
+            self.disabled.add(name)
+
 
 out = Output(
     header=BaseOutput(LOG_TYPES[Level.HEADER]),
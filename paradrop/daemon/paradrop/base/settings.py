@@ -43,6 +43,25 @@ KEY_DIR = CONFIG_HOME_DIR + 'keys/'
 MISC_DIR = CONFIG_HOME_DIR + 'misc/'
 CONFIG_FILE = CONFIG_HOME_DIR + 'config'
 
+#
+# daemon log files
+#
+# The live log file is rotated when it reaches LOG_ROTATE_SIZE bytes or
+# LOG_ROTATE_INTERVAL seconds of age.  Rotated segments are gzip compressed if
+# LOG_COMPRESS is set, and the oldest segments are deleted to keep the log
+# files under LOG_MAX_TOTAL_SIZE bytes and LOG_MAX_AGE seconds old.
+#
+LOG_ROTATE_SIZE = 4 * 1024 * 1024
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+LOG_COMPRESS = True
+LOG_MAX_TOTAL_SIZE = 32 * 1024 * 1024
+LOG_MAX_AGE = 30 * 24 * 60 * 60
+
+# Log records are written to disk in batches, every LOG_FLUSH_RECORDS records
+# or LOG_FLUSH_INTERVAL seconds, whichever comes first.
+LOG_FLUSH_RECORDS = 64
+LOG_FLUSH_INTERVAL = 1.0
+
 #
 # pdserver
 #
@@ -56,11 +75,47 @@ WAMP_ROUTER = "ws://paradrop.org:9086/ws"
 PDCONFD_WRITE_DIR = RUNTIME_HOME_DIR + 'pdconfd/'
 PDCONFD_ENABLED = True
 
+# Apply the iptables rules generated by pdconfd with one iptables-restore
+# transaction per table instead of running iptables once per rule.  If a
+# transaction fails, the rules are retried one at a time.
+PDCONFD_BATCH_IPTABLES = False
+
+# Number of threads pdconfd uses to run commands at the same priority level
+# concurrently, e.g. bringing up interfaces or daemons for different radios.
+# Commands from the same configuration section still run in order.  The
+# default of 1 runs all commands sequentially.
+PDCONFD_WORKERS = 1
+
 #
 # fc
 #
 FC_CHUTESTORAGE_FILE = CONFIG_HOME_DIR + "chutes"
 FC_CHUTESTORAGE_SAVE_TIMER = 0
+
+# Keep a human-readable YAML copy of the chute storage file.  It is only
+# rewritten when the chute list changes.
+FC_CHUTESTORAGE_YAML_MIRROR = True
+
+# Append each chute change to a journal instead of rewriting the whole chute
+# storage file.  The journal is folded into the storage file on the save
+# timer or after FC_CHUTESTORAGE_JOURNAL_LIMIT changes.
+FC_CHUTESTORAGE_JOURNAL = False
+FC_CHUTESTORAGE_JOURNAL_LIMIT = 100
+
+# Number of completed updates to remember for the change API, e.g. to report
+# plan timing aggregated across recent updates.
+FC_UPDATE_HISTORY = 20
+
+# Number of worker threads performing updates.  Updates to different chutes
+# run in parallel (e.g. Docker builds and pulls), while plans that change
+# shared state are serialized.  The default performs one update at a time.
+FC_UPDATE_WORKERS = 1
+
+# Combine an update with a queued update for the same chute when one of them
+# makes the other unnecessary, e.g. repeated configuration changes.  The
+# combined change IDs complete with the same result.  Disabled by default.
+FC_UPDATE_COALESCE = False
+
 FC_BOUNCE_UPDATE = None
 DYNAMIC_NETWORK_POOL = "10.128.0.0/9"
 
@@ -78,6 +133,12 @@ UCI_BACKUP_DIR = CONFIG_HOME_DIR + "uci/config-backup.d/"
 #
 PORTAL_SERVER_PORT = 8080
 
+# Number of seconds to remember local username and password combinations
+# that passed verification, so that API clients polling with basic auth do
+# not pay for a password hash on every request.  Changing a password clears
+# the cache.  Set to 0 to disable.
+LOCAL_AUTH_CACHE_TTL = 300
+
 #
 # Local domain - this domain and subdomains will be resolved to the router so
 # that chutes and their users can access it by name.
@@ -132,6 +193,22 @@ REJECT_DOWNGRADE = False
 
 DOCKER_BIN_DIR = "/usr/bin"
 
+# Docker API version for the daemon's shared Docker clients.  With "auto",
+# each shared client negotiates the version once.  Setting a fixed version
+# (e.g. "1.35") avoids even that request.
+DOCKER_API_VERSION = "auto"
+
+# Number of seconds to reuse container inspection results.  Cached results are
+# also dropped when Docker reports an event for the container.
+DOCKER_INSPECT_CACHE_TTL = 2.0
+
+# Number of lines of history to read from each chute service when the first
+# client starts watching the chute's logs, and the number of recent log
+# messages kept per chute for clients that connect later.  A client that
+# falls further behind than the buffer skips the oldest messages.
+CHUTE_LOG_HISTORY = 200
+CHUTE_LOG_BUFFER_SIZE = 1000
+
 # Interface (e.g. Unix socket) to use to access snapd API.
 SNAPD_INTERFACE = "/run/snapd.socket"
 
@@ -147,6 +224,11 @@ CONTAINER_UID = 999
 # 'run_airshark.sh' script).
 AIRSHARK_INSTALL_DIR = "/snap/airshark/current"
 
+# Size in bytes of the buffer holding spectral samples read from the radio
+# (about 160 KB per second while scanning).  If the Airshark analyzer falls
+# further behind than this, it skips the oldest samples.
+AIRSHARK_SPECTRUM_BUFFER_SIZE = 1024 * 1024
+
 # Boolean flag to enable/disable concurrent builds for Docker images.  If
 # enabled, the update pipeline will yield during a build to allow another
 # update to make progress. This should improve the experience for multi-user
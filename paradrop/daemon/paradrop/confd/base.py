@@ -203,6 +203,22 @@ class ConfigObject(object):
                     continue
                 yield allConfigs[key]
 
+    def getContentKey(self):
+        """
+        Return a hashable key built from the section type and option values.
+
+        Two sections of the same class have equal keys exactly when
+        optionsMatch would consider them equal, so the key can be used to
+        look up sections by content in a dictionary.
+        """
+        values = list()
+        for opdef in self.options:
+            value = getattr(self, opdef.name)
+            if isinstance(value, list):
+                value = tuple(value)
+            values.append(value)
+        return (self.__class__, tuple(values))
+
     def optionsMatch(self, other):
         """
         Test equality of config sections by comparing option values.
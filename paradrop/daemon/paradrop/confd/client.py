@@ -25,6 +25,21 @@ def reload(path):
     return main.configManager.loadConfig(path)
 
 
+def getLeaseFiles():
+    """
+    Return the leases files of the configured dnsmasq instances.
+
+    Returns a list of (comment, path) tuples, where the comment is usually the
+    name of the chute that owns the configuration section.
+    """
+    manager = main.configManager
+    if manager is None:
+        return []
+
+    return [(config.comment, config.getLeaseFile()) for config in
+            manager.currentConfig.values() if config.typename == "dnsmasq"]
+
+
 def systemStatus():
     """
     Return system status string from pdconf.
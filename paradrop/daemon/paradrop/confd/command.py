@@ -1,13 +1,25 @@
+import collections
 import errno
+import itertools
 import os
 import signal
 import six
 import subprocess
 import time
 
+from multiprocessing.pool import ThreadPool
+
 from paradrop.base.output import out
 
 
+# Map iptables binaries to the restore programs that accept batches of rules
+# for them.
+IPTABLES_RESTORE = {
+    "iptables": "iptables-restore",
+    "ip6tables": "ip6tables-restore"
+}
+
+
 def kill(pid, kill_signal=4, timeout=8):
     """
     Kill a child process and wait with timeout.
@@ -95,6 +107,216 @@ class CommandList(list):
         for prio, i, cmd in result:
             yield cmd
 
+    def prioritized(self):
+        """
+        Iterate over (priority, command) tuples in order by priority.
+
+        This follows the same order as the commands method.
+        """
+        order = sorted(range(len(self)), key=lambda i: (self[i][0], i))
+        for i in order:
+            yield self[i]
+
+    def bands(self):
+        """
+        Iterate over (priority, list of commands) for each priority level.
+
+        Priority levels are visited in increasing order, and commands within
+        a level are in the order they were added.
+        """
+        for prio, group in itertools.groupby(self.prioritized(),
+                                             key=lambda x: x[0]):
+            yield prio, [cmd for _, cmd in group]
+
+
+def parseIptablesCommand(command):
+    """
+    Split an iptables command into (binary, table, rule arguments).
+
+    The --wait and --table options are removed from the rule arguments
+    because they do not belong in iptables-restore input.  Returns None if
+    the command is not an iptables or ip6tables command.
+    """
+    if len(command) == 0 or command[0] not in IPTABLES_RESTORE:
+        return None
+
+    table = "filter"
+    args = list()
+
+    i = 1
+    while i < len(command):
+        arg = command[i]
+        if arg in ["--wait", "-w"]:
+            # The wait option may or may not be followed by a number.
+            if i + 1 < len(command) and command[i+1].isdigit():
+                i += 1
+        elif arg in ["--table", "-t"] and i + 1 < len(command):
+            table = command[i+1]
+            i += 1
+        else:
+            args.append(arg)
+        i += 1
+
+    return (command[0], table, args)
+
+
+def quoteRestoreArg(arg):
+    """
+    Quote an argument for an iptables-restore input line if needed.
+    """
+    if arg == "" or any(c.isspace() or c in "\"'" for c in arg):
+        return '"{}"'.format(arg.replace('"', '\\"'))
+    else:
+        return arg
+
+
+def batchIptablesCommands(commands):
+    """
+    Combine iptables commands into iptables-restore transactions.
+
+    Takes a CommandList and returns a new CommandList with the same
+    priorities in which runs of consecutive iptables commands at the same
+    priority are replaced by one IptablesRestoreCommand per (binary, table)
+    pair.  Any other command ends the current run, so the order relative to
+    non-iptables commands is preserved.  Commands for different binaries or
+    tables are independent, so it is safe to group them separately.
+    """
+    result = CommandList()
+
+    # Map (binary, table) -> list of commands in the current run.
+    groups = collections.OrderedDict()
+    groupPrio = None
+
+    for prio, cmd in commands.prioritized():
+        parsed = None
+        if type(cmd) == Command and not cmd.ignoreFailure:
+            parsed = parseIptablesCommand(cmd.command)
+
+        if prio != groupPrio or parsed is None:
+            _appendBatches(result, groupPrio, groups)
+            groups = collections.OrderedDict()
+
+        if parsed is None:
+            result.append(prio, cmd)
+        else:
+            groups.setdefault(parsed[0:2], []).append(cmd)
+            groupPrio = prio
+
+    _appendBatches(result, groupPrio, groups)
+    return result
+
+
+def getCommandKeys(cmd):
+    """
+    Return the set of keys that a command depends on.
+
+    Commands that share a key must run one after another.  Each command
+    depends on its configuration section, so a section's commands stay in
+    order, and each iptables command depends on its (binary, table) pair
+    because the order of rules within a chain matters.  An iptables-restore
+    batch depends on the keys of all the commands in it.  Commands without a
+    parent share a single key.
+    """
+    if isinstance(cmd, IptablesRestoreCommand):
+        cmds = cmd.commands
+    else:
+        cmds = [cmd]
+
+    keys = set()
+    for c in cmds:
+        parsed = parseIptablesCommand(c.command)
+        if parsed is not None:
+            keys.add(parsed[0:2])
+
+        if c.parent is not None:
+            keys.add(c.parent.getTypeAndName())
+        else:
+            keys.add(None)
+
+    return keys
+
+
+def getCommandLanes(cmds):
+    """
+    Divide a list of commands into lanes that can run concurrently.
+
+    Commands that share a key (see getCommandKeys) end up in the same lane,
+    in their original order.  Returns a list of command lists.
+    """
+    # List of (keys, commands) pairs.
+    lanes = []
+    for cmd in cmds:
+        keys = getCommandKeys(cmd)
+        laneKeys = set(keys)
+        laneCmds = []
+
+        # Merge every lane that the command depends on into one.
+        remaining = []
+        for lane in lanes:
+            if lane[0] & keys:
+                laneKeys.update(lane[0])
+                laneCmds.extend(lane[1])
+            else:
+                remaining.append(lane)
+
+        laneCmds.append(cmd)
+        remaining.append((laneKeys, laneCmds))
+        lanes = remaining
+
+    return [lane[1] for lane in lanes]
+
+
+def executeCommand(cmd):
+    """
+    Execute a command and record when it started and how long it took.
+    """
+    cmd.started = time.time()
+    try:
+        return cmd.execute()
+    finally:
+        cmd.duration = time.time() - cmd.started
+
+
+def executeCommands(cmds):
+    """
+    Execute a list of commands in order.
+    """
+    for cmd in cmds:
+        executeCommand(cmd)
+
+
+class ParallelExecutor(object):
+    """
+    Execute a CommandList with concurrency within each priority level.
+
+    Commands at the same priority are divided into lanes (see
+    getCommandLanes).  The lanes run concurrently on a bounded pool of worker
+    threads, and all of them must finish before we move on to the next
+    priority level.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.pool = None
+
+    def execute(self, commands):
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+
+        for prio, cmds in commands.bands():
+            lanes = getCommandLanes(cmds)
+            if len(lanes) == 1:
+                executeCommands(cmds)
+            else:
+                self.pool.map(executeCommands, lanes)
+
+
+def _appendBatches(result, prio, groups):
+    for (binary, table), group in groups.iteritems():
+        if len(group) == 1:
+            result.append(prio, group[0])
+        else:
+            result.append(prio, IptablesRestoreCommand(binary, table, group))
+
 
 class Command(object):
     def __init__(self, command, parent=None, ignoreFailure=False):
@@ -118,6 +340,11 @@ class Command(object):
         self.pid = None
         self.result = None
 
+        # Wall clock start time and duration in seconds, recorded by
+        # executeCommand.
+        self.started = None
+        self.duration = None
+
     def __contains__(self, s):
         """
         Test if command contains given string.
@@ -253,3 +480,75 @@ class KillCommand(Command):
             self.result = e
 
         return (self.result == 0)
+
+
+class IptablesRestoreCommand(Command):
+    """
+    Run a batch of iptables commands as one iptables-restore transaction.
+
+    All of the commands must use the same iptables binary and table.  The
+    restore program applies the whole batch or nothing, so if it fails, we
+    fall back to running the commands one at a time.  Either way, each
+    command records its own result and is added to its parent's executed
+    list, so status reporting works the same as without batching.
+    """
+    def __init__(self, binary, table, commands):
+        command = [IPTABLES_RESTORE[binary], "--noflush"]
+        super(IptablesRestoreCommand, self).__init__(command)
+
+        self.table = table
+        self.commands = commands
+
+    def __contains__(self, s):
+        return any(s in cmd for cmd in self.commands)
+
+    def __str__(self):
+        return "{} ({} rules in table {})".format(" ".join(self.command),
+                len(self.commands), self.table)
+
+    def getInput(self):
+        """
+        Return the iptables-restore input for this batch.
+        """
+        lines = ["*{}".format(self.table)]
+        for cmd in self.commands:
+            binary, table, args = parseIptablesCommand(cmd.command)
+            lines.append(" ".join(quoteRestoreArg(arg) for arg in args))
+        lines.append("COMMIT")
+        return "\n".join(lines) + "\n"
+
+    def execute(self):
+        try:
+            proc = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            self.pid = proc.pid
+            stdout, stderr = proc.communicate(self.getInput())
+            for line in (stdout + stderr).splitlines():
+                out.verbose("{} {}: {}\n".format(self.command[0], self.pid, line))
+            self.result = proc.returncode
+            out.info('Command "{}" returned {}\n'.format(self, self.result))
+        except Exception as e:
+            out.info('Command "{}" raised exception {}\n'.format(self, e))
+            self.result = e
+
+        if self.result == 0:
+            for cmd in self.commands:
+                cmd.result = 0
+                if cmd.parent is not None:
+                    cmd.parent.executed.append(cmd)
+            return True
+
+        # Nothing was applied, so it is safe to run the commands individually.
+        out.warn("Batch failed, running {} commands individually\n".format(
+                 len(self.commands)))
+        success = True
+        for cmd in self.commands:
+            if not executeCommand(cmd):
+                success = False
+        return success
+
+    def success(self):
+        """
+        Returns True if all of the commands in the batch succeeded.
+        """
+        return all(cmd.success() for cmd in self.commands)
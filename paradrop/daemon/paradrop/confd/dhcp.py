@@ -56,6 +56,16 @@ class ConfigDnsmasq(ConfigObject):
         ConfigOption(name="tftp_root")
     ]
 
+    def getLeaseFile(self):
+        """
+        Return the path of the leases file for this dnsmasq instance.
+        """
+        if self.leasefile is not None:
+            return self.leasefile
+
+        return "{}/dnsmasq-{}.leases".format(self.manager.writeDir,
+                                             self.internalName)
+
     def apply(self, allConfigs):
         commands = list()
 
@@ -70,10 +80,7 @@ class ConfigDnsmasq(ConfigObject):
         else:
             interfaces = self.interface
 
-        self.__leasefile = self.leasefile
-        if self.__leasefile is None:
-            self.__leasefile = "{}/dnsmasq-{}.leases".format(
-                self.manager.writeDir, visibleName)
+        self.__leasefile = self.getLeaseFile()
         pdosq.makedirs(os.path.dirname(self.__leasefile))
 
         pidFile = "{}/dnsmasq-{}.pid".format(
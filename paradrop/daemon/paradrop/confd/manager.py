@@ -1,11 +1,13 @@
+import hashlib
 import heapq
 import json
 import os
 import threading
+import time
 
 from paradrop.base.output import out
 from paradrop.lib.utils import pdosq
-from paradrop.lib.utils.uci import UCIConfig, getSystemConfigDir
+from paradrop.lib.utils.uci import getSystemConfigDir, iterConfigFile
 
 # Import all of the modules defining section types, so that all subclasses of
 # ConfigObject are known. These are imported only for their side effects.
@@ -17,7 +19,8 @@ from . import qos
 from . import wireless
 
 from .base import ConfigObject
-from .command import CommandList, ErrorCommand
+from .command import (CommandList, ErrorCommand, ParallelExecutor,
+        batchIptablesCommands, executeCommands)
 
 
 # Silence pyflakes warning about unused imports.
@@ -29,6 +32,11 @@ assert qos
 assert wireless
 
 
+# Files modified less than this many seconds before we fingerprint them are
+# always checked by content on the next reload.
+RACY_MTIME_WINDOW = 2
+
+
 # Map of type names to the classes that handle them.  We now prefer the
 # extended type name, e.g. "network:interface", because there can be
 # conflicting types, e.g. "qos:interface".
@@ -73,23 +81,69 @@ def findConfigFiles(search=None):
     return files
 
 
+def getFileFingerprint(path):
+    """
+    Return a fingerprint for a configuration file or None if it is missing.
+
+    The fingerprint is a tuple ((mtime, size, inode), digest).  The stat
+    fields are cheap to check on every reload, and the content digest lets us
+    recognize files that were rewritten without changing.
+
+    If the file was modified very recently, another write could follow with
+    the same mtime, so we leave out the stat fields and force the content to
+    be checked next time.
+    """
+    try:
+        st = os.stat(path)
+        with open(path, "rb") as source:
+            digest = hashlib.sha1(source.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+    if time.time() - st.st_mtime < RACY_MTIME_WINDOW:
+        return (None, digest)
+    else:
+        return ((st.st_mtime, st.st_size, st.st_ino), digest)
+
+
 class ConfigManager(object):
 
-    def __init__(self, writeDir, execCommands=True):
+    def __init__(self, writeDir, execCommands=True, batchIptables=False,
+                 workers=1):
         """
         writeDir: directory to use for generated config files (e.g. hostapd.conf).
         execCommands: whether or not to run commands (set to False for testing).
+        batchIptables: whether to apply iptables rules in batches with
+        iptables-restore instead of running iptables once per rule.
+        workers: number of threads for running independent commands at the
+        same priority concurrently (1 runs everything sequentially).
         """
         self.writeDir = writeDir
         self.execCommands = execCommands
+        self.batchIptables = batchIptables
+
+        if workers > 1:
+            self.executor = ParallelExecutor(workers)
+        else:
+            self.executor = None
 
         # Make sure directory exists.
         pdosq.makedirs(writeDir)
 
         self.previousCommands = list()
-        self.currentConfig = dict()
         self.nextSectionId = 0
 
+        # Map (module, type, name) -> config for the active sections, and an
+        # index of the same sections by content key so that we can find a
+        # section with identical options without scanning all of them.
+        self._currentConfig = dict()
+        self.contentIndex = dict()
+        self.contentKeys = dict()
+
+        # Map file path -> fingerprint from the last time the file was loaded.
+        # Files with unchanged fingerprints are not parsed again on reload.
+        self.fileFingerprints = dict()
+
         # Number of objects requiring IP forwarding.
         # If >0, we need to enable system-wide.
         # If ==0, we can probably disable.
@@ -108,6 +162,42 @@ class ConfigManager(object):
         # were applied in the most recent epoch.
         self.epoch = 0
 
+    @property
+    def currentConfig(self):
+        return self._currentConfig
+
+    @currentConfig.setter
+    def currentConfig(self, configs):
+        self._currentConfig = configs
+        self.contentIndex = dict()
+        self.contentKeys = dict()
+        for config in configs.values():
+            self.addToIndex(config)
+
+    def addToIndex(self, config):
+        """
+        Add a section to the content index.
+        """
+        key = config.getContentKey()
+        self.contentKeys[config] = key
+        self.contentIndex.setdefault(key, set()).add(config)
+
+    def removeFromIndex(self, config):
+        """
+        Remove a section from the content index.
+
+        The key recorded when the section was added is used, so this works
+        even if the section's options were modified in the meantime.
+        """
+        key = self.contentKeys.pop(config, None)
+        if key is None:
+            return
+        matches = self.contentIndex.get(key)
+        if matches is not None:
+            matches.discard(config)
+            if not matches:
+                del self.contentIndex[key]
+
     def changingSet(self, files):
         """
         Return the sections from the current configuration that may have
@@ -124,6 +214,35 @@ class ConfigManager(object):
                 out.add(config)
         return out
 
+    def findDirtyFiles(self, files):
+        """
+        Return the files that have changed since they were last loaded.
+
+        Returns a tuple (dirty, fingerprints), where dirty is the list of
+        files that need to be parsed again and fingerprints maps files to
+        their updated fingerprints.  A file whose stat fields match the
+        recorded values is skipped without reading it.
+        """
+        dirty = list()
+        fingerprints = dict()
+        for fn in files:
+            old = self.fileFingerprints.get(fn, None)
+            if old is not None:
+                try:
+                    st = os.stat(fn)
+                    if old[0] == (st.st_mtime, st.st_size, st.st_ino):
+                        continue
+                except OSError:
+                    pass
+
+            new = getFileFingerprint(fn)
+            if new is not None:
+                fingerprints[fn] = new
+            if old is None or new is None or old[1] != new[1]:
+                dirty.append(fn)
+
+        return dirty, fingerprints
+
     def getPreviousCommands(self):
         """
         Get the most recent command list.
@@ -136,8 +255,13 @@ class ConfigManager(object):
 
         Takes a CommandList object.
         """
-        for cmd in commands.commands():
-            cmd.execute()
+        if self.batchIptables:
+            commands = batchIptablesCommands(commands)
+
+        if self.executor is not None:
+            self.executor.execute(commands)
+        else:
+            executeCommands(commands.commands())
 
     def findMatchingConfig(self, config, byName=False):
         """
@@ -155,10 +279,10 @@ class ConfigManager(object):
             if config.optionsMatch(oldConfig):
                 return oldConfig
 
-        # Loop over them and check by content.
-        for oldConfig in self.currentConfig.values():
-            if config.optionsMatch(oldConfig):
-                return oldConfig
+        # Otherwise, look for any section with identical content.
+        matches = self.contentIndex.get(config.getContentKey())
+        if matches:
+            return next(iter(matches))
 
         return None
 
@@ -185,6 +309,9 @@ class ConfigManager(object):
          - No -> Stop.
          - Yes -> Revert current section, mark any affected dependents,
                   add new section, apply changes, and stop.
+
+        Files that have not changed since they were last loaded are not
+        parsed again, and their sections are kept as they are.
         """
         self.epoch += 1
 
@@ -200,10 +327,17 @@ class ConfigManager(object):
         updatedConfigs = set()
         undoConfigs = set()
 
+        # Sections that replaced or removed entries from the current
+        # configuration, as (old, new) pairs.  These are applied to the content
+        # index after we are done matching against the old configuration.
+        indexChanges = list()
+
         # Final list of commands to execute.
         commands = CommandList()
 
-        files = findConfigFiles(search)
+        # Only parse files that changed since the last load.  Sections from
+        # unchanged files remain in allConfigs as they are.
+        files, fingerprints = self.findDirtyFiles(findConfigFiles(search))
 
         # We will remove things from this set as we find them in the new
         # configuration files.  Anything that remains at the end must have been
@@ -252,7 +386,9 @@ class ConfigManager(object):
                 # Mark that the config section was applied in this epoch.
                 config.epoch = self.epoch
 
-                allConfigs[config.getTypeAndName()] = config
+                key = config.getTypeAndName()
+                indexChanges.append((allConfigs.get(key, None), config))
+                allConfigs[key] = config
 
         # Items from the deletion set should be deleted from memory as well as
         # have their changes undone.
@@ -260,6 +396,7 @@ class ConfigManager(object):
             del allConfigs[config.getTypeAndName()]
             config.removeFromParents()
             undoConfigs.add(config)
+            indexChanges.append((config, None))
 
         # Remove configs that are in both sets---we should not try to reload
         # updated configs that are supposed to be removed.
@@ -304,8 +441,15 @@ class ConfigManager(object):
         if execute and self.execCommands:
             self.execute(commands)
 
+        for old, new in indexChanges:
+            if old is not None:
+                self.removeFromIndex(old)
+            if new is not None:
+                self.addToIndex(new)
+
         self.previousCommands = commands
-        self.currentConfig = allConfigs
+        self._currentConfig = allConfigs
+        self.fileFingerprints.update(fingerprints)
 
         # Wake up anything that was waiting for the first load to complete.
         self.systemUp.set()
@@ -330,10 +474,12 @@ class ConfigManager(object):
             # Extract just the filename (e.g. wireless, network, qos).
             basename = os.path.basename(fn)
 
-            uci = UCIConfig(fn)
-            config = uci.readConfig()
+            # The file may have been removed since we listed it.  That is the
+            # same as an empty file, so all of its sections will be removed.
+            if not os.path.isfile(fn):
+                continue
 
-            for section, options in config:
+            for section, options in iterConfigFile(fn):
                 # Sections differ in where they put the name, if they have one.
                 if "name" in section:
                     name = section['name']
@@ -418,6 +564,7 @@ class ConfigManager(object):
 
         self.previousCommands = commands
         self.currentConfig = dict()
+        self.fileFingerprints = dict()
         return True
 
     def waitSystemUp(self):
@@ -23,11 +23,18 @@ class ChuteStorage(PDStorage):
     # Class variable of chute list so all instances see the same thing
     chuteList = dict()
 
+    # Map API token -> chute name, kept up to date as chutes are saved and
+    # deleted.  None means the index needs to be rebuilt from chuteList.
+    chuteTokens = None
+
     def __init__(self, filename=None, save_timer=settings.FC_CHUTESTORAGE_SAVE_TIMER):
         if(not filename):
             filename = settings.FC_CHUTESTORAGE_FILE
 
-        PDStorage.__init__(self, filename, save_timer)
+        PDStorage.__init__(self, filename, save_timer,
+                mirrorYaml=settings.FC_CHUTESTORAGE_YAML_MIRROR,
+                journal=settings.FC_CHUTESTORAGE_JOURNAL,
+                journalLimit=settings.FC_CHUTESTORAGE_JOURNAL_LIMIT)
 
         # Has it been loaded?
         if(len(ChuteStorage.chuteList) == 0):
@@ -36,6 +43,7 @@ class ChuteStorage(PDStorage):
     def setAttr(self, attr):
         """Save our attr however we want (as class variable for all to see)"""
         ChuteStorage.chuteList = attr
+        ChuteStorage.chuteTokens = None
 
     def getAttr(self):
         """Get our attr (as class variable for all to see)"""
@@ -52,10 +60,12 @@ class ChuteStorage(PDStorage):
     def deleteChute(self, ch):
         """Deletes a chute from the chute storage. Can be sent the chute object, or the chute name."""
         if (isinstance(ch, Chute)):
-            del ChuteStorage.chuteList[ch.name]
+            name = ch.name
         else:
-            del ChuteStorage.chuteList[ch]
-        self.saveToDisk()
+            name = ch
+        del ChuteStorage.chuteList[name]
+        ChuteStorage.indexToken(name)
+        self.recordChange(("delete", name))
 
     def saveChute(self, ch):
         """
@@ -71,11 +81,13 @@ class ChuteStorage(PDStorage):
         else:
             ChuteStorage.chuteList[ch.name] = ch
 
-        self.saveToDisk()
+        ChuteStorage.indexToken(ch.name)
+        self.recordChange(("save", ch.name, ChuteStorage.chuteList[ch.name]))
 
     def clearChuteStorage(self):
         ChuteStorage.chuteList.clear()
-        self.saveToDisk()
+        ChuteStorage.chuteTokens = None
+        self.recordChange(("clear", ))
 
     #
     # Functions we override to implement PDStorage Properly
@@ -84,10 +96,54 @@ class ChuteStorage(PDStorage):
         """Returns True if we should save the ChuteList, otherwise False."""
         return (type(ChuteStorage.chuteList) == dict)
 
+    def applyRecord(self, record):
+        """Replay a change recorded by saveChute, deleteChute, or clearChuteStorage."""
+        if record[0] == "save":
+            ChuteStorage.chuteList[record[1]] = record[2]
+        elif record[0] == "delete":
+            ChuteStorage.chuteList.pop(record[1], None)
+        elif record[0] == "clear":
+            ChuteStorage.chuteList.clear()
+        ChuteStorage.chuteTokens = None
+
     @classmethod
     def get_chute(cls, name):
         return cls.chuteList[name]
 
+    @classmethod
+    def indexToken(cls, name):
+        """Update the API token index after a chute is saved or deleted."""
+        if cls.chuteTokens is None:
+            return
+
+        for token, owner in list(cls.chuteTokens.items()):
+            if owner == name:
+                del cls.chuteTokens[token]
+
+        chute = cls.chuteList.get(name, None)
+        if chute is not None:
+            token = chute.getCache('apiToken')
+            if token is not None:
+                cls.chuteTokens[token] = name
+
+    @classmethod
+    def getTokenIndex(cls):
+        """Return a dictionary mapping API tokens to chute names."""
+        if cls.chuteTokens is None:
+            tokens = dict()
+            for chute in cls.chuteList.values():
+                token = chute.getCache('apiToken')
+                if token is not None:
+                    tokens[token] = chute.name
+            cls.chuteTokens = tokens
+
+        return cls.chuteTokens
+
+    @classmethod
+    def lookupToken(cls, token):
+        """Return the name of the chute that owns an API token, or None."""
+        return cls.getTokenIndex().get(token, None)
+
 
 if(__name__ == '__main__'): # pragma: no cover
     def usage():
@@ -7,8 +7,23 @@
 
 import json
 
+from twisted.internet import defer
+
 from paradrop.confd import client
 from paradrop.base.output import out
+from paradrop.core.plan import executionplan, plangraph
+
+
+# Number of successful reloads and the status returned by the latest one.  An
+# update that waited for other updates to write their configuration files uses
+# the status of a reload that happened in the meantime instead of reloading
+# again.
+reloadCount = 0
+reloadStatus = None
+
+# Updates that are waiting in reloadAll for the next reload, as (update,
+# Deferred) pairs.  The next reload resumes all of them.
+reloadWaiters = []
 
 
 def reload_placeholder(update):
@@ -24,18 +39,111 @@ def reload_placeholder(update):
 def reloadAll(update):
     """
     Reload pdconf configuration files.
+
+    When several updates are changing configuration files at the same time,
+    the first ones to get here wait for the others, and a single reload
+    applies the changes from all of them.  Each update then checks the status
+    of its own configuration sections.
+
+    If the update manager has more updates queued behind this one
+    (update.batchReload), the update does not reload yet.  It returns a
+    Deferred, and the update resumes after the next reload, which also
+    applies the changes of the queued updates.  The update manager calls
+    flushReloads when no more queued updates can start.
+    """
+    if update.batchReload:
+        d = defer.Deferred()
+        reloadWaiters.append((update, d))
+        update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG,
+                              (checkBatchReload, ))
+        update.progress("Waiting to reload configuration together with queued changes")
+        return d
+
+    count = reloadCount
+    if executionplan.sharedStateLock.yieldToWaiters() and reloadCount > count:
+        statusString = reloadStatus
+        update.progress("Configuration was reloaded together with other changes")
+    else:
+        statusString = reloadNow()
+
+    checkReloadStatus(update, statusString)
+
+
+def reloadAllAbort(update):
+    """
+    Reload pdconf configuration files when aborting an update.
+
+    Abort functions run while holding the shared state lock for the whole
+    rollback, so this reloads immediately instead of waiting for other
+    updates.
+    """
+    checkReloadStatus(update, reloadNow())
+
+
+def checkBatchReload(update):
+    """
+    Check the status of the reload that the update waited for in reloadAll.
+    """
+    statusString = update.cache_get('reloadStatus')
+    if statusString is None:
+        raise Exception("Failed to reload configuration")
+    checkReloadStatus(update, statusString)
+
+
+def flushReloads():
+    """
+    Reload pdconf configuration files if any updates are waiting in reloadAll.
+    """
+    with executionplan.sharedStateLock:
+        if len(reloadWaiters) == 0:
+            return
+
+        try:
+            reloadNow()
+        except Exception as e:
+            out.exception(e, True)
+
+
+def reloadNow():
+    """
+    Reload pdconf configuration files and return the status string.
+
+    This resumes the updates waiting in reloadAll.  The caller must hold the
+    shared state lock.
+    """
+    global reloadCount
+    global reloadStatus
+
+    # The reload applies the changes of every update that is waiting.  If it
+    # fails, they resume without a status and fail in checkBatchReload.
+    waiters = list(reloadWaiters)
+    del reloadWaiters[:]
+
+    statusString = None
+    try:
+        # Note: reloading all config files at once seems safer than
+        # individual files because of cross-dependencies.
+        statusString = client.reloadAll()
+        reloadStatus = statusString
+        reloadCount += 1
+    finally:
+        for update, d in waiters:
+            update.cache_set('reloadStatus', statusString)
+            d.callback(statusString)
+
+    return statusString
+
+
+def checkReloadStatus(update, statusString):
+    """
+    Check the status to make sure all configuration sections related to this
+    chute were successfully loaded.
+
+    We should only abort if there were problems related to this chute.
+    Example: a WiFi card was removed, so we fail to bring up old WiFi
+    interfaces; however, installing a new chute that does not depend on WiFi
+    should still succeed.
     """
-    # Note: reloading all config files at once seems safer than individual
-    # files because of cross-dependencies.
-    statusString = client.reloadAll()
-
-    # Check the status to make sure all configuration sections
-    # related to this chute were successfully loaded.
-    #
-    # We should only abort if there were problems related to this chute.
-    # Example: a WiFi card was removed, so we fail to bring up old WiFi
-    # interfaces; however, installing a new chute that does not depend on WiFi
-    # should still succeed.
     status = json.loads(statusString)
     for section in status:
         # Checking age > 0 filters out errors that occurred in the past.
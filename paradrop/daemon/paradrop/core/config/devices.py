@@ -367,7 +367,9 @@ def setConfig(chuteName, sections, filepath):
         config['comment'] = chuteName
 
     oldSections = cfgFile.getChuteConfigs(chuteName)
-    if not uci.chuteConfigsMatch(oldSections, sections):
+    diff = uci.diffConfigs(oldSections, sections)
+    if not diff.isEmpty():
+        out.info("Updating {} for {}: {}\n".format(filepath, chuteName, diff))
         cfgFile.delConfigs(oldSections)
         cfgFile.addConfigs(sections)
         cfgFile.save(backupToken="paradrop", internalid=chuteName)
@@ -7,6 +7,7 @@ from paradrop.base import constants, pdutils, settings
 from paradrop.lib.utils import datastruct, uci
 
 from . import uciutils
+from .reservations import SubnetReservationSet
 
 # TODO: Instead of being a constant, look at device capabilities.
 MAX_AP_INTERFACES = 8
@@ -119,11 +120,17 @@ def chooseSubnet(update, cfg, iface):
             "Router misconfigured: prefix size {} is invalid for network {}".
             format(prefix_size, network))
 
-    subnets = network.subnets(new_prefix=prefix_size)
-    for subnet in subnets:
-        if subnet not in reservations:
+    if isinstance(reservations, SubnetReservationSet):
+        subnet = reservations.findFree(network, prefix_size)
+        if subnet is not None:
             reservations.add(subnet)
             return subnet
+    else:
+        subnets = network.subnets(new_prefix=prefix_size)
+        for subnet in subnets:
+            if subnet not in reservations:
+                reservations.add(subnet)
+                return subnet
 
     raise Exception("Could not find an available subnet")
 
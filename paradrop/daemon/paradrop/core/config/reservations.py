@@ -1,17 +1,21 @@
 """
 Module for checking resource reservations by chutes.
 
-One idea motivating this design is to reduce the amount of state
-in memory for resource reservations.  We have the chute list, which
-contains information about what devices the chute is using.  If we also
-maintain a separate list of devices used by chutes, we need to keep
-them synchronized.  This becomes messy when a chute fails to install
-or uninstall correctly.  The getDeviceReservations function iterates
-over the chute list and returns an up-to-date view of device usage.
-This can be called as needed.
+Resources claimed by chutes (devices, interface names, and subnets) are kept
+in one ReservationIndex shared by all updates.  The claims of installed
+chutes are loaded from the chute list the first time the index is used and
+replaced whenever a chute is saved or deleted.  An update records its claims
+in the index as soon as it allocates a resource, so updates that run at the
+same time see each other's allocations before either chute is saved.  Those
+claims are dropped when the update saves its chute, aborts, or finishes.
+
+The get*Reservations functions return views of the index for one update.
+Adding to a view claims the resource in the index.
 """
+import bisect
 import collections
 import ipaddress
+import threading
 
 
 from paradrop.base import constants
@@ -21,11 +25,134 @@ from paradrop.core.chute.chute_storage import ChuteStorage
 from paradrop.lib.utils import datastruct
 
 
-class DeviceReservations(object):
+class Claims(object):
+    """
+    Resources claimed by one chute.
+
+    devices: list of (device, type, mode) tuples.
+    interfaces: set of interface names.
+    subnets: list of ip_network objects.
+    """
     def __init__(self):
+        self.devices = []
+        self.interfaces = set()
+        self.subnets = []
+
+    @classmethod
+    def fromChute(cls, chute):
+        """
+        Collect the resources used by an installed chute.
+        """
+        claims = cls()
+        for iface in chute.getCache('networkInterfaces'):
+            # Device is not set in cases such as vlan interfaces.
+            dev = iface.get('device', None)
+            if dev is not None:
+                claims.devices.append((dev, iface['type'],
+                                       iface.get('mode', None)))
+
+            if 'externalIntf' in iface:
+                claims.interfaces.add(iface['externalIntf'])
+
+            if 'subnet' in iface:
+                claims.subnets.append(iface['subnet'])
+
+        return claims
+
+
+class ReservationIndex(object):
+    """
+    Resources claimed by installed chutes and by updates in progress.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+
+        # Map chute name -> Claims of the installed chute, or None if the
+        # index needs to be loaded from the chute list.
+        self.installed = None
+
+        # Map chute name -> Claims made by an update that has not finished.
+        self.pending = dict()
+
+    def _load(self):
+        if self.installed is None:
+            self.installed = dict()
+            for chute in ChuteStorage.chuteList.values():
+                self.installed[chute.name] = Claims.fromChute(chute)
+
+    def getClaims(self, exclude=None):
+        """
+        Return a list of (chute name, Claims) for every chute except exclude.
+        """
+        with self.lock:
+            self._load()
+            result = []
+            for claims in [self.installed, self.pending]:
+                for name, claim in claims.iteritems():
+                    if name != exclude:
+                        result.append((name, claim))
+            return result
+
+    def claim(self, chute, kind, value):
+        """
+        Record a resource allocated by an update to a chute.
+
+        kind: "devices", "interfaces", or "subnets".
+        """
+        with self.lock:
+            claims = self.pending.get(chute, None)
+            if claims is None:
+                claims = Claims()
+                self.pending[chute] = claims
+
+            resources = getattr(claims, kind)
+            if isinstance(resources, set):
+                resources.add(value)
+            else:
+                resources.append(value)
+
+    def release(self, chute):
+        """
+        Drop the claims of an update to a chute that did not save it.
+        """
+        with self.lock:
+            self.pending.pop(chute, None)
+
+    def chuteChanged(self, chute):
+        """
+        Replace the claims of a chute after it is saved or deleted.
+        """
+        with self.lock:
+            self.pending.pop(chute, None)
+            if self.installed is None:
+                return
+
+            saved = ChuteStorage.chuteList.get(chute, None)
+            if saved is None:
+                self.installed.pop(chute, None)
+            else:
+                self.installed[chute] = Claims.fromChute(saved)
+
+    def reset(self):
+        """
+        Reload the index from the chute list the next time it is used.
+        """
+        with self.lock:
+            self.installed = None
+            self.pending.clear()
+
+
+# Index shared by all updates.
+index = ReservationIndex()
+
+
+class DeviceReservations(object):
+    def __init__(self, device=None, index=None):
+        self.device = device
+        self.index = index
         self.reservations = []
 
-    def add(self, chute, dtype, mode=None):
+    def add(self, chute, dtype, mode=None, claim=True):
         r = {
             'chute': chute,
             'type': dtype,
@@ -33,6 +160,8 @@ class DeviceReservations(object):
         }
 
         self.reservations.append(r)
+        if claim and self.index is not None:
+            self.index.claim(chute, 'devices', (self.device, dtype, mode))
 
     def count(self, dtype=None, mode=None):
         """
@@ -51,17 +180,33 @@ class DeviceReservations(object):
         return count
 
 
-def getDeviceReservations(exclude=None):
+class DeviceReservationTable(collections.defaultdict):
+    """
+    Map device name -> DeviceReservations that claims new reservations in a
+    ReservationIndex.
+    """
+    def __init__(self, index=None):
+        collections.defaultdict.__init__(self)
+        self.index = index
+
+    def __missing__(self, device):
+        reservations = DeviceReservations(device, self.index)
+        self[device] = reservations
+        return reservations
+
+
+def getDeviceReservations(exclude=None, index=index):
     """
     Produce a dictionary mapping device names to DeviceReservations objects
     that describe the current usage of the device.
 
     The returned type is a defaultdict, so there is no need to check if a key
-    exists before accessing it.
+    exists before accessing it.  Reservations added to it are claimed in the
+    index.
 
     exclude: name of chute whose device reservations should be excluded
     """
-    reservations = collections.defaultdict(DeviceReservations)
+    reservations = DeviceReservationTable(index)
 
     if exclude != constants.RESERVED_CHUTE_NAME:
         hostConfig = prepareHostConfig()
@@ -80,35 +225,30 @@ def getDeviceReservations(exclude=None):
                 dev = phy
 
             reservations[dev].add(constants.RESERVED_CHUTE_NAME, 'wifi',
-                    iface.get('mode', 'ap'))
+                    iface.get('mode', 'ap'), claim=False)
 
         lanInterfaces = datastruct.getValue(hostConfig, 'lan.interfaces', [])
         for iface in lanInterfaces:
-            reservations[iface].add(constants.RESERVED_CHUTE_NAME, 'lan', None)
-
-    for chute in ChuteStorage.chuteList.values():
-        if chute.name == exclude:
-            continue
-
-        for iface in chute.getCache('networkInterfaces'):
-            dev = iface.get('device', None)
-
-            # Device is not set in cases such as vlan interfaces.
-            if dev is None:
-                continue
+            reservations[iface].add(constants.RESERVED_CHUTE_NAME, 'lan', None,
+                    claim=False)
 
-            reservations[dev].add(chute.name, iface['type'],
-                    iface.get('mode', None))
+    for name, claims in index.getClaims(exclude):
+        for dev, dtype, mode in claims.devices:
+            reservations[dev].add(name, dtype, mode, claim=False)
 
     return reservations
 
 
 class InterfaceReservationSet(object):
-    def __init__(self):
+    def __init__(self, index=None, owner=None):
+        self.index = index
+        self.owner = owner
         self.reservations = set()
 
-    def add(self, interface):
+    def add(self, interface, claim=True):
         self.reservations.add(interface)
+        if claim and self.index is not None:
+            self.index.claim(self.owner, 'interfaces', interface)
 
     def __contains__(self, x):
         return x in self.reservations
@@ -117,15 +257,16 @@ class InterfaceReservationSet(object):
         return len(self.reservations)
 
 
-def getInterfaceReservations(exclude=None):
+def getInterfaceReservations(exclude=None, index=index):
     """
     Get current set of interface reservations.
 
-    Returns an instance of InterfaceReservationSet.
+    Returns an instance of InterfaceReservationSet.  Interfaces added to it
+    are claimed in the index for the excluded chute.
 
     exclude: name of chute whose interfaces should be excluded
     """
-    reservations = InterfaceReservationSet()
+    reservations = InterfaceReservationSet(index, exclude)
 
     if exclude != constants.RESERVED_CHUTE_NAME:
         hostConfig = prepareHostConfig()
@@ -135,48 +276,102 @@ def getInterfaceReservations(exclude=None):
                 continue
 
             ifname = iface['ifname']
-            reservations.add(ifname)
-
-    for chute in ChuteStorage.chuteList.values():
-        if chute.name == exclude:
-            continue
-
-        for iface in chute.getCache('networkInterfaces'):
-            if 'externalIntf' not in iface:
-                continue
+            reservations.add(ifname, claim=False)
 
-            ifname = iface['externalIntf']
-            reservations.add(ifname)
+    for name, claims in index.getClaims(exclude):
+        for ifname in claims.interfaces:
+            reservations.add(ifname, claim=False)
 
     return reservations
 
 
 class SubnetReservationSet(object):
-    def __init__(self):
+    """
+    Set of reserved subnets with fast overlap checks.
+
+    Reserved address ranges are kept as sorted, disjoint intervals of
+    integer addresses for each IP version.  Overlapping and adjacent
+    reservations are merged, so membership tests and searches for a free
+    subnet use binary search instead of scanning every reservation.
+    """
+    def __init__(self, index=None, owner=None):
+        self.index = index
+        self.owner = owner
         self.reservations = []
 
-    def add(self, subnet):
+        # Map IP version -> (sorted interval starts, matching interval ends).
+        self.intervals = collections.defaultdict(lambda: ([], []))
+
+    def add(self, subnet, claim=True):
         self.reservations.append(subnet)
+        if claim and self.index is not None:
+            self.index.claim(self.owner, 'subnets', subnet)
+
+        starts, ends = self.intervals[subnet.version]
+        first = int(subnet.network_address)
+        last = int(subnet.broadcast_address)
+
+        # Find every interval that overlaps or touches the new one and
+        # replace them with a single merged interval.
+        lo = bisect.bisect_left(ends, first - 1)
+        hi = bisect.bisect_right(starts, last + 1)
+        if lo < hi:
+            first = min(first, starts[lo])
+            last = max(last, ends[hi - 1])
+        starts[lo:hi] = [first]
+        ends[lo:hi] = [last]
+
+    def _findOverlap(self, version, first, last):
+        """
+        Return the index of an interval overlapping [first, last] or None.
+        """
+        starts, ends = self.intervals[version]
+        i = bisect.bisect_left(ends, first)
+        if i < len(starts) and starts[i] <= last:
+            return i
+        return None
+
+    def findFree(self, network, prefixlen):
+        """
+        Find the first subnet of the given prefix length inside network that
+        does not overlap any reservation.
+
+        Returns an ip_network object or None if network is full.
+        """
+        size = 1 << (network.max_prefixlen - prefixlen)
+        candidate = int(network.network_address)
+        last = int(network.broadcast_address)
+
+        ends = self.intervals[network.version][1]
+        while candidate + size - 1 <= last:
+            i = self._findOverlap(network.version, candidate, candidate + size - 1)
+            if i is None:
+                address = ipaddress.ip_address(candidate)
+                return ipaddress.ip_network(u'{}/{}'.format(address, prefixlen))
+
+            # Skip past the reserved interval to the next aligned subnet.
+            candidate = (ends[i] // size + 1) * size
+
+        return None
 
     def __contains__(self, subnet):
-        for res in self.reservations:
-            if res.overlaps(subnet):
-                return True
-        return False
+        return self._findOverlap(subnet.version, int(subnet.network_address),
+                int(subnet.broadcast_address)) is not None
 
     def __len__(self):
         return len(self.reservations)
 
 
-def getSubnetReservations(exclude=None):
+def getSubnetReservations(exclude=None, index=index):
     """
     Get current set of subnet reservations.
 
-    Returns an instance of SubnetReservationSet.
+    Returns an instance of SubnetReservationSet.  Subnets added to it are
+    claimed in the index for the excluded chute.
 
     exclude: name of chute whose reservations should be excluded
     """
-    reservations = SubnetReservationSet()
+    reservations = SubnetReservationSet(index, exclude)
 
     if exclude != constants.RESERVED_CHUTE_NAME:
         hostConfig = prepareHostConfig()
@@ -185,18 +380,11 @@ def getSubnetReservations(exclude=None):
         if ipaddr is not None and netmask is not None:
             network = ipaddress.ip_network(u'{}/{}'.format(ipaddr, netmask),
                     strict=False)
-            reservations.add(network)
+            reservations.add(network, claim=False)
 
-    for chute in ChuteStorage.chuteList.values():
-        if chute.name == exclude:
-            continue
-
-        for iface in chute.getCache('networkInterfaces'):
-            if 'subnet' not in iface:
-                continue
-
-            subnet = iface['subnet']
-            reservations.add(subnet)
+    for name, claims in index.getClaims(exclude):
+        for subnet in claims.subnets:
+            reservations.add(subnet, claim=False)
 
     return reservations
 
@@ -204,7 +392,14 @@ def getSubnetReservations(exclude=None):
 def getReservations(update):
     """
     Get device and resource reservations claimed by other users.
+
+    Resources that the update allocates from these reservations are claimed
+    in the shared index until the update saves the chute or is aborted.
     """
+    # Start from a clean slate if an earlier update to this chute did not
+    # release its claims.
+    index.release(update.new.name)
+
     devices = getDeviceReservations(exclude=update.new.name)
     interfaces = getInterfaceReservations(exclude=update.new.name)
     subnets = getSubnetReservations(exclude=update.new.name)
@@ -212,3 +407,10 @@ def getReservations(update):
     update.cache_set('deviceReservations', devices)
     update.cache_set('interfaceReservations', interfaces)
     update.cache_set('subnetReservations', subnets)
+
+
+def releaseReservations(update):
+    """
+    Drop the resources claimed by an update that did not save the chute.
+    """
+    index.release(update.new.name)
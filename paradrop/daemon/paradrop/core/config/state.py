@@ -1,4 +1,5 @@
 from paradrop.core.chute.chute_storage import ChuteStorage
+from paradrop.core.config import reservations
 
 
 def saveChute(update):
@@ -10,6 +11,7 @@ def saveChute(update):
         chuteStore.deleteChute(update.old)
     else:
         chuteStore.saveChute(update.new)
+    reservations.index.chuteChanged(update.new.name)
 
 
 def revertChute(update):
@@ -20,8 +22,10 @@ def revertChute(update):
         chuteStore.saveChute(update.old)
     else:
         chuteStore.deleteChute(update.new)
+    reservations.index.chuteChanged(update.new.name)
 
 
 def removeAllChutes(update):
     chuteStore = ChuteStorage()
     chuteStore.clearChuteStorage()
+    reservations.index.reset()
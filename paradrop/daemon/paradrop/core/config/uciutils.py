@@ -1,3 +1,4 @@
+from paradrop.base.output import out
 from paradrop.lib.utils import uci
 
 
@@ -39,7 +40,8 @@ def setConfig(update, cacheKeys, filepath):
     # the new/old chuteobjects are identical.
     oldconfigs = cfgFile.getChuteConfigs(chute_name)
 
-    if (uci.chuteConfigsMatch(oldconfigs, newconfigs)):
+    diff = uci.diffConfigs(oldconfigs, newconfigs)
+    if diff.isEmpty():
         # configs match, skipping reloading
         # Save a backup in case we need to restore.
         cfgFile.backup(backupToken="paradrop")
@@ -47,6 +49,7 @@ def setConfig(update, cacheKeys, filepath):
     else:
         # We need to make changes so delete old configs, load new configs
         # configs don't match, changing chutes and reloading
+        out.info("Updating {} for {}: {}\n".format(filepath, chute_name, diff))
         cfgFile.delConfigs(oldconfigs)
         cfgFile.addConfigs(newconfigs)
         cfgFile.save(backupToken="paradrop", internalid=chute_name)
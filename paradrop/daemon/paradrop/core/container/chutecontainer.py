@@ -1,13 +1,243 @@
+import threading
+import time
+
 import docker
+import requests
 
+from paradrop.base import settings
 from paradrop.base.exceptions import ChuteNotFound, ChuteNotRunning
+from paradrop.base.output import out
+
+from .dockerclient import DOCKER_URL, getAPIClient, resetClients
+
+
+# Seconds to wait before reconnecting to the Docker event stream.  The delay
+# doubles after each failed attempt, up to EVENT_RETRY_MAX_DELAY.
+EVENT_RETRY_DELAY = 5
+EVENT_RETRY_MAX_DELAY = 300
+
+
+class ContainerStateCache(object):
+    """
+    Table of container name -> inspection results from Docker.
+
+    While run() is connected to the Docker event stream, the table is seeded
+    with every container on the system and each container event triggers a
+    refresh of that container, so lookups of known containers do not need to
+    call Docker.  A container that is not in the table is always looked up,
+    because its create event may not have been handled yet.  When the event
+    stream is not connected, entries are only trusted for
+    DOCKER_INSPECT_CACHE_TTL seconds.
+    """
+    def __init__(self, docker_url=DOCKER_URL):
+        self.docker_url = docker_url
+        self.lock = threading.Lock()
+
+        # Map container name -> (time, info).
+        self.containers = dict()
+
+        # Map container ID -> container name, for network events.
+        self.names = dict()
+
+        # Containers that changed since they were last inspected.
+        self.stale = set()
+
+        # True when the table is kept current by the event stream.
+        self.live = False
+
+        # Functions called with (container name, event) for each event.
+        self.listeners = set()
+
+    def get(self, name):
+        """
+        Get inspection results for a container.
+
+        Raises ChuteNotFound if the container does not exist.
+        """
+        with self.lock:
+            entry = self.containers.get(name, None)
+            if entry is None or name in self.stale:
+                fresh = False
+            elif self.live:
+                fresh = True
+            else:
+                fresh = time.time() - entry[0] < settings.DOCKER_INSPECT_CACHE_TTL
+
+        if fresh:
+            return entry[1]
+        else:
+            return self.refresh(name)
+
+    def refresh(self, name):
+        """
+        Inspect a container and update the table.
+        """
+        # Clear the stale flag first, so that a change reported while we are
+        # waiting for Docker marks the result stale again.
+        with self.lock:
+            self.stale.discard(name)
+
+        client = getAPIClient(self.docker_url)
+        try:
+            info = client.inspect_container(name)
+        except docker.errors.NotFound:
+            with self.lock:
+                entry = self.containers.pop(name, None)
+                if entry is not None:
+                    self.names.pop(entry[1].get('Id'), None)
+            raise ChuteNotFound("The chute could not be found.")
+
+        with self.lock:
+            self.containers[name] = (time.time(), info)
+            self.names[info.get('Id')] = name
+        return info
+
+    def invalidate(self, name=None):
+        """
+        Mark a container, or all containers, as changed.
+        """
+        with self.lock:
+            if name is None:
+                self.stale.update(self.containers.keys())
+                if not self.live:
+                    self.containers.clear()
+            else:
+                self.stale.add(name)
+
+    def addListener(self, listener):
+        """
+        Call listener(name, event) for each container event.
+
+        Listeners are called from the event watcher thread.
+        """
+        with self.lock:
+            self.listeners.add(listener)
+
+    def removeListener(self, listener):
+        with self.lock:
+            self.listeners.discard(listener)
+
+    def handleEvent(self, event):
+        """
+        Update the table in response to a Docker event.
+        """
+        attributes = event.get('Actor', {}).get('Attributes', {})
+        if event.get('Type') == 'network':
+            # Connecting a container to a network changes its addresses.
+            name = self.names.get(attributes.get('container', None), None)
+        else:
+            name = attributes.get('name', None)
+
+        if name is None:
+            return
+
+        try:
+            self.refresh(name)
+        except ChuteNotFound:
+            pass
+
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(name, event)
+            except Exception as error:
+                out.warn("Error handling Docker event: {}\n".format(error))
+
+    def seed(self, client):
+        """
+        Load every container on the system into the table.
+        """
+        for summary in client.containers(all=True):
+            for name in summary.get('Names', []):
+                try:
+                    self.refresh(name.lstrip('/'))
+                except ChuteNotFound:
+                    pass
+
+    def run(self):
+        """
+        Follow the Docker event stream and keep the table current.
+
+        This blocks forever, so it should run in its own thread.
+        """
+        delay = EVENT_RETRY_DELAY
+
+        # True while we are failing to connect, so that an outage is only
+        # reported once.
+        outage = False
+
+        while True:
+            try:
+                client = getAPIClient(self.docker_url)
+
+                # Subscribe before seeding so that no change is missed.
+                events = client.events(decode=True,
+                        filters={'type': ['container', 'network']})
+                self.seed(client)
+                self.live = True
+
+                if outage:
+                    out.info("Reconnected to Docker events\n")
+                    outage = False
+                    delay = EVENT_RETRY_DELAY
+
+                for event in events:
+                    self.handleEvent(event)
+            except requests.exceptions.ConnectionError as error:
+                # The Docker daemon may have restarted, possibly with a
+                # different API version, so start over with new clients.
+                if not outage:
+                    out.warn("Lost connection to Docker: {}\n".format(error))
+                    outage = True
+                resetClients()
+            except Exception as error:
+                if not outage:
+                    out.warn("Error reading Docker events: {}\n".format(error))
+                    outage = True
+
+            # We may miss events while disconnected, so fall back to
+            # inspecting containers as needed.
+            self.live = False
+            time.sleep(delay)
+            if outage:
+                delay = min(delay * 2, EVENT_RETRY_MAX_DELAY)
+
+
+# Map Docker URL -> ContainerStateCache.
+stateCaches = dict()
+
+
+def getStateCache(docker_url=DOCKER_URL):
+    if docker_url not in stateCaches:
+        stateCaches[docker_url] = ContainerStateCache(docker_url)
+    return stateCaches[docker_url]
+
+
+def invalidateInspectCache(name=None):
+    """
+    Mark cached information about a container, or all containers, as changed.
+    """
+    for cache in stateCaches.values():
+        cache.invalidate(name)
+
+
+def startEventWatcher(docker_url=DOCKER_URL):
+    """
+    Start a daemon thread that keeps the container state table current.
+    """
+    thread = threading.Thread(target=getStateCache(docker_url).run,
+                              name="docker-events")
+    thread.daemon = True
+    thread.start()
+    return thread
 
 
 class ChuteContainer(object):
     """
     Class for accessing information about a chute's container.
     """
-    def __init__(self, name, docker_url="unix://var/run/docker.sock"):
+    def __init__(self, name, docker_url=DOCKER_URL):
         self.name = name
         self.docker_url = docker_url
 
@@ -77,13 +307,11 @@ class ChuteContainer(object):
     def inspect(self):
         """
         Return the full container status from Docker.
+
+        Results come from the container state table, which is kept current
+        by Docker events, so this usually does not make a request.
         """
-        client = docker.APIClient(base_url=self.docker_url, version='auto')
-        try:
-            info = client.inspect_container(self.name)
-            return info
-        except docker.errors.NotFound:
-            raise ChuteNotFound("The chute could not be found.")
+        return getStateCache(self.docker_url).get(self.name)
 
     def isRunning(self):
         """
@@ -23,7 +23,8 @@ from paradrop.base.output import out
 from paradrop.base import constants, nexus, settings
 from paradrop.core.config.devices import resetWirelessDevice
 
-from .chutecontainer import ChuteContainer
+from .chutecontainer import ChuteContainer, invalidateInspectCache
+from .dockerclient import getAPIClient, getDockerClient
 from .dockerfile import Dockerfile
 
 
@@ -124,7 +125,7 @@ def prepare_image(update, service):
     thread and return a Deferred. This will suspend processing of the current
     update until the worker thread finishes.
     """
-    client = docker.APIClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getAPIClient()
 
     image_name = service.get_image_name()
 
@@ -154,8 +155,7 @@ def check_image(update, service):
     """
     image_name = service.get_image_name()
 
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-            version='auto')
+    client = getDockerClient()
 
     # Raises an exception if the image does not exist.
     client.images.get(image_name)
@@ -165,14 +165,11 @@ def remove_image(update, service):
     """
     Remove a Docker image.
     """
-    client = docker.APIClient(base_url="unix://var/run/docker.sock", version='auto')
-
     image_name = service.get_image_name()
     out.info("Removing image {}\n".format(image_name))
 
     try:
-        client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-                version='auto')
+        client = getDockerClient()
         client.images.remove(image=image_name)
     except Exception as error:
         out.warn("Error removing image: {}".format(error))
@@ -182,7 +179,7 @@ def create_bridge(update):
     """
     Create a user-defined bridge network for the chute.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getDockerClient()
     client.networks.create(update.new.name, driver="bridge")
 
 
@@ -190,7 +187,7 @@ def remove_bridge(update):
     """
     Remove the bridge network associated with the chute.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getDockerClient()
     try:
         network = client.networks.get(update.new.name)
         network.remove()
@@ -202,7 +199,7 @@ def start_container(update, service):
     """
     Start running a service in a new container.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getDockerClient()
 
     container_name = service.get_container_name()
     image_name = service.get_image_name()
@@ -223,6 +220,8 @@ def start_container(update, service):
         out.info("Successfully started chute with Id: %s\n" % (str(container.id)))
     except Exception as e:
         raise e
+    finally:
+        invalidateInspectCache(container_name)
 
     try:
         network = client.networks.get(update.new.name)
@@ -239,8 +238,7 @@ def remove_container(update, service):
     out.info("Removing container {}\n".format(container_name))
 
     try:
-        client = docker.DockerClient(base_url="unix://var/run/docker.sock",
-                version='auto')
+        client = getDockerClient()
 
         # Grab the last 40 log messages to help with debugging.
         container = client.containers.get(container_name)
@@ -251,6 +249,8 @@ def remove_container(update, service):
     except Exception as error:
         out.warn("Error removing container: {}".format(error))
 
+    invalidateInspectCache(container_name)
+
 
 def _build_image(update, service, client, inline, **buildArgs):
     """
@@ -347,9 +347,10 @@ def stopChute(update):
     """
     out.info('Attempting to stop chute %s\n' % (update.name))
 
-    c = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    c = getDockerClient()
     container = c.containers.get(update.name)
     container.stop()
+    invalidateInspectCache(update.name)
 
 
 def restartChute(update):
@@ -361,9 +362,10 @@ def restartChute(update):
     :returns: None
     """
     out.info('Attempting to restart chute %s\n' % (update.name))
-    c = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    c = getDockerClient()
     container = c.containers.get(update.name)
     container.start()
+    invalidateInspectCache(update.name)
 
 
 def getBridgeGateway():
@@ -373,7 +375,7 @@ def getBridgeGateway():
     This is the docker0 IP address; it is the IP address of the host from the
     chute's perspective.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getDockerClient()
 
     network = client.networks.get("bridge")
     for config in network.attrs['IPAM']['Config']:
@@ -679,7 +681,7 @@ def call_in_netns(service, env, command, onerror="raise", pid=None):
         out.warn("nsenter command failed, resorting to docker exec\n")
 
         try:
-            client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+            client = getDockerClient()
             container = client.containers.get(container_name)
             container.exec_run(command, user='root')
         except Exception:
@@ -715,7 +717,7 @@ def prepare_environment(update, service):
 
 
 def _setResourceAllocation(allocation):
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
+    client = getDockerClient()
     for container_name, resources in six.iteritems(allocation):
         out.info("Update chute {} set cpu_shares={}\n".format(
             container_name, resources['cpu_shares']))
@@ -761,10 +763,12 @@ def removeAllContainers(update):
 
     :returns: None
     """
-    client = docker.DockerClient(base_url='unix://var/run/docker.sock', version='auto')
+    client = getDockerClient()
 
     for container in client.containers.list(all=True):
         try:
             container.remove(force=True)
         except Exception as e:
             update.progress(str(e))
+
+    invalidateInspectCache()
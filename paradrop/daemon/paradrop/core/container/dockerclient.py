@@ -0,0 +1,57 @@
+"""
+Shared Docker clients.
+
+Creating a Docker client is not free: with version="auto", every new client
+makes a request to the daemon to negotiate the API version, and each client
+keeps its own connection pool.  The functions in this module return clients
+that are created once per process and reused by all callers, so requests go
+over kept-alive connections to the Docker socket.
+
+Docker clients are safe to share between the reactor thread and the update
+thread as long as the calls themselves are independent.
+"""
+
+import threading
+
+import docker
+
+from paradrop.base import settings
+
+
+DOCKER_URL = "unix://var/run/docker.sock"
+
+# Map (client class, base URL) -> client instance.
+_clients = dict()
+_lock = threading.Lock()
+
+
+def _getClient(cls, base_url):
+    key = (cls, base_url)
+    with _lock:
+        client = _clients.get(key, None)
+        if client is None:
+            client = cls(base_url=base_url, version=settings.DOCKER_API_VERSION)
+            _clients[key] = client
+        return client
+
+
+def getDockerClient(base_url=DOCKER_URL):
+    """
+    Get a shared high-level docker.DockerClient.
+    """
+    return _getClient(docker.DockerClient, base_url)
+
+
+def getAPIClient(base_url=DOCKER_URL):
+    """
+    Get a shared low-level docker.APIClient.
+    """
+    return _getClient(docker.APIClient, base_url)
+
+
+def resetClients():
+    """
+    Discard shared clients, e.g. after the Docker daemon restarts.
+    """
+    with _lock:
+        _clients.clear()
@@ -1,93 +1,291 @@
 '''
 Provides messages from container logs (STDOUT and STDERR).
+
+All clients watching the logs of a chute share one LogBroker.  The broker
+follows each service's container once, keeps recent messages in a bounded
+ring buffer, and pushes them to every subscriber, so the cost of following
+the logs does not grow with the number of clients.
 '''
-import os
-import signal
-import docker
-from multiprocessing import Process, Queue
+import json
+import socket
+import threading
+from collections import deque
+
+from twisted.internet import interfaces, reactor
+from zope.interface import implementer
+
+from paradrop.base import settings
+from paradrop.base.output import out
+
+from .chutecontainer import getStateCache
+from .dockerclient import DOCKER_URL, getAPIClient
 
 
-def monitor_logs(service_name, container_name, queue, tail=200):
+class LogStream(object):
     """
-    Iterate over log messages from a container and add them to the queue
-    for consumption.  This function will block and wait for new messages
-    from the container.  Use the queue to interface with async code.
+    Followed log stream of one container.
+
+    Unlike the generator returned by docker-py, the stream keeps the
+    underlying response, so another thread can close it and wake up a reader
+    that is blocked waiting for the container to write something.
+    """
+    def __init__(self, container_name, tail=200, since=None,
+                 docker_url=DOCKER_URL):
+        client = getAPIClient(docker_url)
+        params = {
+            'stdout': 1,
+            'stderr': 1,
+            'timestamps': 1,
+            'follow': 1,
+            'tail': tail
+        }
+        if since is not None:
+            params['since'] = since
 
-    tail: number of lines to retrieve from log history; the string "all"
-    is also valid, but highly discouraged for performance reasons.
+        url = client._url("/containers/{0}/logs", container_name)
+        self.response = client._get(url, params=params, stream=True)
+        self.socket = client._get_raw_response_socket(self.response)
+        self.lines = client._get_result(container_name, True, self.response)
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        # Closing the response alone does not interrupt a blocking read.
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+        self.response.close()
+
+
+def iter_logs(service_name, lines):
+    """
+    Iterate over log messages from a stream of log lines, such as a
+    LogStream.  This function will block and wait for new messages from the
+    container.
     """
-    client = docker.DockerClient(base_url="unix://var/run/docker.sock", version='auto')
-    container = client.containers.get(container_name)
-    output = container.logs(stdout=True, stderr=True,
-                            stream=True, timestamps=True, follow=True,
-                            tail=tail)
-    for line in output:
+    for line in lines:
         # I have grown to distrust Docker streaming functions.  It may
         # return a string; it may return an object.  If it is a string,
         # separate the timestamp portion from the rest of the message.
         if isinstance(line, basestring):
             parts = line.split(" ", 1)
             if len(parts) > 1:
-                queue.put({
+                yield {
                     'service': service_name,
                     'timestamp': parts[0],
                     'message': parts[1].rstrip()
-                })
+                }
 
             else:
-                queue.put({
+                yield {
                     'service': service_name,
                     'message': line.rstrip()
-                })
+                }
         elif isinstance(line, dict):
             line['service'] = service_name
-            queue.put(line)
+            yield line
+
+
+@implementer(interfaces.IPushProducer)
+class LogSubscription(object):
+    """
+    Delivers messages from a LogBroker to one consumer.
+
+    The subscription starts paused at the oldest message in the broker's
+    buffer, so the consumer receives recent history as soon as it resumes.
+    While paused, the subscription only remembers its position; if the
+    consumer falls further behind than the buffer, the messages it missed
+    are counted in `dropped`.
+    """
+    def __init__(self, broker, consumer):
+        self.broker = broker
+        self.consumer = consumer
+        self.position = broker.oldest()
+        self.paused = True
+        self.dropped = 0
+
+    def deliver(self):
+        broker = self.broker
+        oldest = broker.oldest()
+        if self.position < oldest:
+            self.dropped += oldest - self.position
+            self.position = oldest
+
+        while not self.paused and self.position < broker.next_seq:
+            message = broker.messages[self.position - oldest]
+            self.position += 1
+            self.consumer.write(message)
+
+    #
+    # IPushProducer interface
+    #
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.deliver()
+
+    def stopProducing(self):
+        self.paused = True
+        self.broker.unsubscribe(self)
+
+
+class LogBroker(object):
+    """
+    Follows the logs of a chute's services and fans them out to subscribers.
+
+    Each service's container is followed by a daemon thread, which hands
+    messages to the reactor thread.  Messages are encoded as JSON once and
+    kept in a ring buffer of `capacity` messages.  When a container starts
+    again, e.g. because the chute was updated, the broker follows the new
+    container.
+    """
+    def __init__(self, chute_name, capacity=settings.CHUTE_LOG_BUFFER_SIZE):
+        self.chute_name = chute_name
+        self.messages = deque(maxlen=capacity)
+        self.next_seq = 0
+        self.subscribers = set()
+        self.stopped = False
+
+        # Map container name -> service name.
+        self.containers = dict()
 
-class LogProvider(object):
-    def __init__(self, chute):
-        self.chute = chute
-        self.queue = Queue()
-        self.listening = False
-        self.processes = []
+        # Map container name -> open LogStream.
+        self.streams = dict()
+        self.lock = threading.Lock()
 
-    def attach(self):
+    def oldest(self):
         """
-        Start listening for log messages.
+        Return the sequence number of the oldest buffered message.
+        """
+        return self.next_seq - len(self.messages)
 
-        Log messages in the queue will appear like the following:
-        {
-            'service': 'main',
-            'timestamp': '2017-01-30T15:46:23.009397536Z',
-            'message': 'Something happened'
-        }
+    def start(self, services, tail=settings.CHUTE_LOG_HISTORY):
+        for service in services:
+            self.containers[service.get_container_name()] = service.name
+
+        getStateCache().addListener(self.containerChanged)
+        for container_name, service_name in self.containers.iteritems():
+            self.startFollower(service_name, container_name, tail)
+
+    def stop(self):
+        """
+        Stop publishing messages and close the log streams.
         """
-        if not self.listening:
-            for service in self.chute.get_services():
-                process = Process(target=monitor_logs,
-                        args=(service.name, service.get_container_name(), self.queue))
-                process.start()
-                self.processes.append(process)
-            self.listening = True
-
-    def get_logs(self):
-        logs = []
-        while not self.queue.empty():
-            msg = self.queue.get()
-            logs.append(msg)
-        return logs
-
-    def detach(self):
+        with self.lock:
+            self.stopped = True
+            streams = self.streams.values()
+            self.streams.clear()
+
+        getStateCache().removeListener(self.containerChanged)
+        for stream in streams:
+            stream.close()
+
+        if brokers.get(self.chute_name) is self:
+            del brokers[self.chute_name]
+
+    def containerChanged(self, name, event):
         """
-        Stop listening for log messages.
+        Follow a service's container again when it starts.
 
-        After this is called, no additional messages will be added to the
-        queue.
+        This is called from the Docker event watcher thread.
         """
-        if self.listening:
-            # We have to kill the process explicitly with SIGKILL,
-            # terminate() function does not work here.
-            for process in self.processes:
-                os.kill(process.pid, signal.SIGKILL)
-
-            self.processes = []
-            self.listening = False
+        if name not in self.containers or self.stopped:
+            return
+        if event.get('Action', event.get('status')) != 'start':
+            return
+
+        # Only read messages written since the container started, so that
+        # restarting a container does not repeat its old messages.
+        self.startFollower(self.containers[name], name, "all",
+                           since=event.get('time', None))
+
+    def startFollower(self, service_name, container_name, tail, since=None):
+        thread = threading.Thread(target=self.follow,
+                args=(service_name, container_name, tail, since),
+                name="logs-{}-{}".format(self.chute_name, service_name))
+        thread.daemon = True
+        thread.start()
+
+    def follow(self, service_name, container_name, tail, since=None):
+        try:
+            stream = LogStream(container_name, tail=tail, since=since)
+        except Exception as error:
+            out.warn("Error reading logs from {}: {}\n".format(container_name, error))
+            return
+
+        with self.lock:
+            if self.stopped:
+                previous = stream
+            else:
+                previous = self.streams.get(container_name, None)
+                self.streams[container_name] = stream
+        if previous is not None:
+            previous.close()
+
+        try:
+            for message in iter_logs(service_name, stream):
+                reactor.callFromThread(self.publish, message)
+        except Exception as error:
+            if not stream.closed:
+                out.warn("Error reading logs from {}: {}\n".format(container_name, error))
+        finally:
+            with self.lock:
+                if self.streams.get(container_name) is stream:
+                    del self.streams[container_name]
+            stream.close()
+
+    def publish(self, message):
+        if self.stopped:
+            return
+
+        self.messages.append(json.dumps(message))
+        self.next_seq += 1
+        for subscriber in list(self.subscribers):
+            subscriber.deliver()
+
+    def subscribe(self, consumer):
+        subscription = LogSubscription(self, consumer)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.discard(subscription)
+        if len(self.subscribers) == 0:
+            self.stop()
+
+
+# Map chute name -> LogBroker for chutes that have subscribers.
+brokers = dict()
+
+
+def subscribe(chute, consumer):
+    """
+    Subscribe a consumer to a chute's logs.
+
+    The consumer's write method will be called with JSON-encoded messages
+    like the following:
+    {
+        'service': 'main',
+        'timestamp': '2017-01-30T15:46:23.009397536Z',
+        'message': 'Something happened'
+    }
+
+    Returns a paused LogSubscription.  Call resumeProducing to start
+    delivery and stopProducing when the consumer goes away.
+    """
+    broker = brokers.get(chute.name, None)
+    if broker is None:
+        broker = LogBroker(chute.name, settings.CHUTE_LOG_BUFFER_SIZE)
+        brokers[chute.name] = broker
+        broker.start(chute.get_services(), settings.CHUTE_LOG_HISTORY)
+    return broker.subscribe(consumer)
@@ -14,12 +14,115 @@
     operations are performed during the generation process.
 '''
 
+import os
+import threading
+import time
 import traceback
 
 from twisted.internet.defer import Deferred
 
 from paradrop.base.output import out
 
+from . import plangraph
+
+
+class SharedStateLock(object):
+    """
+    First-come, first-served lock for state shared between chutes.
+
+    Besides acquire and release, the holder can let threads that are already
+    waiting for the lock go first (see yieldToWaiters), e.g. so that one
+    configuration reload serves several updates.
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.nextTicket = 0
+        self.serving = 0
+        self.owner = None
+
+        # Number of waiting threads that yielded the lock to others.
+        self.yielded = 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def _wait(self):
+        # Take a ticket and wait for our turn.  The caller must hold the
+        # condition.
+        ticket = self.nextTicket
+        self.nextTicket += 1
+        while self.serving != ticket:
+            self.condition.wait()
+        self.owner = threading.current_thread()
+
+    def _next(self):
+        # Pass the lock to the next ticket.  The caller must hold the
+        # condition.
+        self.owner = None
+        self.serving += 1
+        self.condition.notify_all()
+
+    def acquire(self):
+        with self.condition:
+            self._wait()
+
+    def release(self):
+        with self.condition:
+            self._next()
+
+    def locked(self):
+        return self.owner is not None
+
+    def heldByCurrentThread(self):
+        return self.owner is threading.current_thread()
+
+    def yieldToWaiters(self):
+        """
+        Let threads that are waiting for the lock, and did not yield it
+        themselves, run before the caller.
+
+        Does nothing unless the current thread holds the lock.  The caller
+        holds the lock again when this returns.
+
+        Returns True if other threads ran in the meantime.
+        """
+        with self.condition:
+            if not self.heldByCurrentThread():
+                return False
+
+            waiting = self.nextTicket - self.serving - 1
+            if waiting <= self.yielded:
+                return False
+
+            self.yielded += 1
+            self._next()
+            self._wait()
+            self.yielded -= 1
+            return True
+
+
+# Updates to different chutes may execute at the same time.  Plans outside of
+# plangraph.CONCURRENT_STAGES change state that is shared between chutes, so
+# they run while holding this lock.  The lock is held across consecutive
+# shared stages, e.g. from writing UCI files through reloading them, so that
+# another update does not see the configuration half-written.
+sharedStateLock = SharedStateLock()
+
+
+def getCpuTime():
+    """
+    Get the user and system CPU time used by this process so far.
+
+    Other threads are included, so this is only an approximation of the CPU
+    time spent in a single plan function.
+    """
+    times = os.times()
+    return times[0] + times[1]
+
 
 def generatePlans(update):
     """
@@ -63,59 +166,82 @@ def executePlans(update):
             False otherwise : everything is OK
     """
     out.header('Executing plans %r\n' % (update))
-    # Finding the functions to call is actually done by a 'iterator' like function in the plangraph module
-    while(True):
-        # This function either returns None or a tuple just like generate added to it
-        p = update.plans.getNextTodo()
-
-        # No more to do?
-        if(not p):
-            break
-
-        # Explode tuple otherwise
-        func, args = p
-
-        # We are in a try-except block so if func isn't callable that will catch it
-        try:
-            out.verbose('Calling %s\n' % (func))
-            update.progress("Calling {}".format(func.__name__))
-            #
-            # Call the function from the execution plan
-            #
-            # args may be empty, but we don't want to pass in a tuple if we don't need to.
-            # This below explodes the args so if @args is (), then what is passed is @update
-            skipme = func(*((update, ) + args))
-
-        except Exception as e:
-            out.exception(e, True)
-            # plans = str(update.plans)) # Removed because breaks new out.exception call
-            out.warn("Failed to execute plan %s%s" % (func.__name__, args))
-            update.responses.append({'exception': str(e), 'traceback': traceback.format_exc()})
-            update.failure = str(e)
-            return True
+    locked = False
+    try:
+        # Finding the functions to call is actually done by a 'iterator' like function in the plangraph module
+        while(True):
+            # This function either returns None or a tuple just like generate added to it
+            p = update.plans.getNextTodo()
+
+            # No more to do?
+            if(not p):
+                break
+
+            # Explode tuple otherwise
+            func, args = p
+
+            # Hold the shared state lock while running plans that touch
+            # state shared with other chutes.
+            shared = update.plans.maxPriorityReturned not in plangraph.CONCURRENT_STAGES
+            if shared and not locked:
+                sharedStateLock.acquire()
+                locked = True
+            elif locked and not shared:
+                sharedStateLock.release()
+                locked = False
+
+            start = time.time()
+            cpuStart = getCpuTime()
+
+            # We are in a try-except block so if func isn't callable that will catch it
+            try:
+                out.verbose('Calling %s\n' % (func))
+                update.progress("Calling {}".format(func.__name__))
+                #
+                # Call the function from the execution plan
+                #
+                # args may be empty, but we don't want to pass in a tuple if we don't need to.
+                # This below explodes the args so if @args is (), then what is passed is @update
+                skipme = func(*((update, ) + args))
+
+            except Exception as e:
+                update.record_timing("execute", func, start, time.time() - start,
+                                     getCpuTime() - cpuStart, success=False)
+                out.exception(e, True)
+                # plans = str(update.plans)) # Removed because breaks new out.exception call
+                out.warn("Failed to execute plan %s%s" % (func.__name__, args))
+                update.responses.append({'exception': str(e), 'traceback': traceback.format_exc()})
+                update.failure = str(e)
+                return True
 
-        # The functions we call here can return other functions, if they do
-        # these are functions that should be skipped later on (for instance a
-        # set* function discovering it didn't change anything, later on we
-        # shouldn't call the corresponding reload function)
-        if skipme is not None:
-            # If the function returned a Deferred, we will drop out of the
-            # execution pipeline and resume later.
-            if isinstance(skipme, Deferred):
-                out.verbose('Function {} returned a Deferred'.format(func))
-                return skipme
+            update.record_timing("execute", func, start, time.time() - start,
+                                 getCpuTime() - cpuStart, deferred=skipme)
 
-            # These functions can return individual functions to skip, or a
-            # list of multiple functions
-            elif callable(skipme):
-                skipme = [skipme]
+            # The functions we call here can return other functions, if they do
+            # these are functions that should be skipped later on (for instance a
+            # set* function discovering it didn't change anything, later on we
+            # shouldn't call the corresponding reload function)
+            if skipme is not None:
+                # If the function returned a Deferred, we will drop out of the
+                # execution pipeline and resume later.
+                if isinstance(skipme, Deferred):
+                    out.verbose('Function {} returned a Deferred'.format(func))
+                    return skipme
 
-            for skip in skipme:
-                out.warn('Identified a skipped function: %r\n' % (skip))
-                update.plans.registerSkip(skip)
+                # These functions can return individual functions to skip, or a
+                # list of multiple functions
+                elif callable(skipme):
+                    skipme = [skipme]
 
-    # Now we are done
-    return False
+                for skip in skipme:
+                    out.warn('Identified a skipped function: %r\n' % (skip))
+                    update.plans.registerSkip(skip)
+
+        # Now we are done
+        return False
+    finally:
+        if locked:
+            sharedStateLock.release()
 
 
 def abortPlans(update):
@@ -128,36 +254,45 @@ def abortPlans(update):
             False otherwise : we were able to restore system state back to before the executeplans function was called
     """
     out.header('Aborting plans %r\n' % (update.plans))
-    sameError = False
-    while(True):
-        # This function either returns None or a tuple just like generate added to it
-        p = update.plans.getNextAbort()
-
-        # No more to do?
-        if(not p):
-            break
-
-        # Explode tuple otherwise
-        func, args = p
-
-        # We are in a try-except block so if func isn't callable that will catch it
-        try:
-            out.verbose('Calling {}\n'.format(func))
-            update.progress('Calling {}'.format(func.__name__))
-
-            func(*((update, ) + args))
-
-            # If the func is called without exception then clear the @sameError flag for the next function call
-            sameError = False
-
-        except Exception as e:
-            # Since we are running this in an infinite loop if a major function throws an error
-            # we could loop forever, so check for the error, which is only reset at the end of the loop
-            if(sameError):
-                return True
-            update.responses.append({'exception': str(e), 'traceback': traceback.format_exc()})
-            out.fatal('An abort function raised an exception!!! %r: %s\n%s\n' % (update.plans, str(e), traceback.format_exc()))
-            sameError = True
-
-    # Getting here we assume the system state has been restored using our abort plan
-    return False
+    with sharedStateLock:
+        sameError = False
+        while(True):
+            # This function either returns None or a tuple just like generate added to it
+            p = update.plans.getNextAbort()
+
+            # No more to do?
+            if(not p):
+                break
+
+            # Explode tuple otherwise
+            func, args = p
+
+            start = time.time()
+            cpuStart = getCpuTime()
+
+            # We are in a try-except block so if func isn't callable that will catch it
+            try:
+                out.verbose('Calling {}\n'.format(func))
+                update.progress('Calling {}'.format(func.__name__))
+
+                func(*((update, ) + args))
+
+                update.record_timing("abort", func, start, time.time() - start,
+                                     getCpuTime() - cpuStart)
+
+                # If the func is called without exception then clear the @sameError flag for the next function call
+                sameError = False
+
+            except Exception as e:
+                update.record_timing("abort", func, start, time.time() - start,
+                                     getCpuTime() - cpuStart, success=False)
+                # Since we are running this in an infinite loop if a major function throws an error
+                # we could loop forever, so check for the error, which is only reset at the end of the loop
+                if(sameError):
+                    return True
+                update.responses.append({'exception': str(e), 'traceback': traceback.format_exc()})
+                out.fatal('An abort function raised an exception!!! %r: %s\n%s\n' % (update.plans, str(e), traceback.format_exc()))
+                sameError = True
+
+        # Getting here we assume the system state has been restored using our abort plan
+        return False
@@ -45,7 +45,14 @@ def generatePlans(update):
                           (devices.checkSystemDevices, ))
 
     update.plans.addPlans(plangraph.STRUCT_GET_RESERVATIONS,
-                          (reservations.getReservations, ))
+                          (reservations.getReservations, ),
+                          (reservations.releaseReservations, ))
+
+    # There is no chute to save at the end of a host configuration update, so
+    # drop the resources claimed by the update at the same stage instead.
+    # Resources in the saved host configuration are still reserved.
+    update.plans.addPlans(plangraph.STATE_SAVE_CHUTE,
+                          (reservations.releaseReservations, ))
 
     update.plans.addPlans(plangraph.STRUCT_GET_HOST_CONFIG,
                           (hostconfig.getHostConfig, ))
@@ -68,7 +75,7 @@ def generatePlans(update):
         # Apply host configuration to system configuration.
         update.plans.addPlans(plangraph.STRUCT_SET_SYSTEM_DEVICES,
                               (devices.setSystemDevices, ),
-                              (configservice.reloadAll, ))
+                              (configservice.reloadAllAbort, ))
 
         # Apply zerotier configuration.
         update.plans.addPlans(plangraph.ZEROTIER_CONFIGURE,
@@ -94,5 +101,5 @@ def generatePlans(update):
         # right place in the update pipeline such that UCI files have been
         # restored to their previous contents.
         todoPlan = (configservice.reload_placeholder, )
-        abtPlan = (configservice.reloadAll, )
+        abtPlan = (configservice.reloadAllAbort, )
         update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG_BACKOUT, todoPlan, abtPlan)
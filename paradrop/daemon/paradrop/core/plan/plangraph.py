@@ -4,6 +4,8 @@
 ###################################################################
 
 import heapq
+import itertools
+from collections import deque
 
 ###############################################################################
 # PRIORITYFLAGS: Define the priority numbers as constants here
@@ -101,6 +103,24 @@ RECONFIGURE_PROXY               = 98
 SNAP_INSTALL                    = 99
 COAP_CHANGE_PROCESSES           = 100
 
+###############################################################################
+# Stages that only affect the chute being updated.  The update manager runs
+# updates for different chutes in parallel, and plans in these stages may run
+# at the same time as plans from other updates.  All other stages read or write
+# state shared between chutes (UCI files, configuration reloads, resource
+# allocation, the proxy), so executionplan runs them while holding the shared
+# state lock.  The lock is released between stages, so resources allocated by
+# an update are claimed in reservations.index until its chute is saved.
+CONCURRENT_STAGES = frozenset([
+    DOWNLOAD_CHUTE_FILES,
+    LOAD_CHUTE_CONFIGURATION,
+    STATE_BUILD_IMAGE,
+    STATE_CHECK_IMAGE,
+    STATE_CALL_STOP,
+    STATE_CALL_START,
+    STATE_CALL_CLEANUP
+])
+
 
 class Plan:
     """
@@ -138,14 +158,16 @@ class PlanMap:
         self.plans = []
         self.abortPlans = []
 
-        # workingPlans is implemented as a heapq. All of the other plan lists
-        # are plain lists.
+        # workingPlans is implemented as a heapq of (priority, sequence, todo,
+        # abort) tuples.  The sequence number keeps plans with equal priority
+        # in the order they were added.  workingAbortPlans is a deque.
         self.maxPriorityReturned = 0
         self.startedAbort = False
         self.workingPlans = []
-        self.workingAbortPlans = []
+        self.workingAbortPlans = deque()
+        self.sequence = itertools.count()
 
-        self.skipFunctions = []
+        self.skipFunctions = set()
 
     def addPlans(self, priority, todoPlan, abortPlan=[]):
         """
@@ -184,7 +206,8 @@ class PlanMap:
 
         # Now add into the set
         self.plans.append((priority, todoP, abortP))
-        heapq.heappush(self.workingPlans, (priority, todoP, abortP))
+        heapq.heappush(self.workingPlans,
+                       (priority, next(self.sequence), todoP, abortP))
 
     def addMap(self, other):
         """
@@ -193,8 +216,9 @@ class PlanMap:
         # Make sure to extend NOT append these new plans!
         self.plans.extend(other.plans)
 
-        for item in other.plans:
-            heapq.heappush(self.workingPlans, item)
+        for priority, todoP, abortP in other.plans:
+            heapq.heappush(self.workingPlans,
+                           (priority, next(self.sequence), todoP, abortP))
 
     def sort(self):
         """
@@ -208,7 +232,7 @@ class PlanMap:
             Register this function as one to skip execution on, if provided it shouldn't return
             the (func, args) tuple as a result from the getNextTodo function.
         """
-        self.skipFunctions.append(func)
+        self.skipFunctions.add(func)
 
     def getNextTodo(self):
         """
@@ -218,20 +242,18 @@ class PlanMap:
             (function, args) : Each todo is returned just how the user first added it
             None             : None is returned when there are no more todo's
         """
-        if len(self.workingPlans) == 0:
-            return None
-        else:
-            prio, todo, abt = heapq.heappop(self.workingPlans)
+        while len(self.workingPlans) > 0:
+            prio, seq, todo, abt = heapq.heappop(self.workingPlans)
             self.maxPriorityReturned = prio
 
             # After popping the next plan, check if this is a skipped function.
             # If so, then get the next plan.
-            if todo.func in self.skipFunctions:
-                return self.getNextTodo()
-            else:
+            if todo.func not in self.skipFunctions:
                 self.abortPlans.append(abt)
                 return (todo.func, todo.args)
 
+        return None
+
     def getNextAbort(self):
         """
         Like an iterator function, it returns each element in the list of abort plans in order.
@@ -249,6 +271,11 @@ class PlanMap:
             # so we need to call stuff in the proper order
             ###################################################################################
 
+            # Plans we are already going to do, by (function, args) where
+            # args are hashable, otherwise by function.
+            seen = set()
+            unhashable = dict()
+
             # Skip the last stage and iterate in reverse order.
             for stage in reversed(self.abortPlans[:-1]):
                 # If nothing keep looking
@@ -258,8 +285,18 @@ class PlanMap:
                 # This should be a list of Plan() objects
                 for a in stage:
                     # See if we are already going to do this Plan()
-                    if a not in self.workingAbortPlans:
-                        self.workingAbortPlans.append(a)
+                    try:
+                        key = (id(a.func), a.args)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                    except TypeError:
+                        same = unhashable.setdefault(id(a.func), [])
+                        if a in same:
+                            continue
+                        same.append(a)
+
+                    self.workingAbortPlans.append(a)
 
             # Lastly, set the started flag, so we don't initialize the list again.
             self.startedAbort = True
@@ -267,7 +304,7 @@ class PlanMap:
         if len(self.workingAbortPlans) == 0:
             return None
         else:
-            abt = self.workingAbortPlans.pop(0)
+            abt = self.workingAbortPlans.popleft()
             return (abt.func, abt.args)
 
     def __repr__(self):
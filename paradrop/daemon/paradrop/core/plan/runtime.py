@@ -41,7 +41,7 @@ def generatePlans(update):
     # right place in the update pipeline such that UCI files have been
     # restored to their previous contents.
     todoPlan = (configservice.reload_placeholder, )
-    abtPlan = (configservice.reloadAll, )
+    abtPlan = (configservice.reloadAllAbort, )
     update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG_BACKOUT, todoPlan, abtPlan)
 
     return None
@@ -37,7 +37,8 @@ def generatePlans(update):
                           (network.abortNetworkConfig, ))
 
     update.plans.addPlans(plangraph.STRUCT_GET_RESERVATIONS,
-                          (reservations.getReservations, ))
+                          (reservations.getReservations, ),
+                          (reservations.releaseReservations, ))
 
     update.plans.addPlans(plangraph.STRUCT_GET_HOST_CONFIG,
                           (hostconfig.getHostConfig, ))
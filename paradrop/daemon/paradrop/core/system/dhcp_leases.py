@@ -0,0 +1,179 @@
+'''
+Index of DHCP leases handed out by the dnsmasq instances that pdconfd runs.
+
+The paths of the leases files come from the dnsmasq sections loaded by
+pdconfd.  A file is parsed again only when its modification time, size, or
+inode changes, so API requests that poll the leases are served from memory.
+The index is meant to be used from the reactor thread.
+'''
+import hashlib
+import json
+import os
+
+from paradrop.confd import client
+from paradrop.lib.utils import parsing
+
+
+# The format of the dnsmasq leases file is one entry per line with
+# space-separated fields.
+LEASE_KEYS = ['expires', 'mac_addr', 'ip_addr', 'hostname', 'client_id']
+
+
+def read_lease_records(path):
+    """
+    Read the entries of a dnsmasq leases file as dictionaries of strings.
+    """
+    records = []
+    with open(path, "r") as source:
+        for line in source:
+            parts = line.strip().split()
+            records.append(dict(zip(LEASE_KEYS, parts)))
+    return records
+
+
+def make_lease(record, as_of):
+    """
+    Convert a lease record to the format reported for network devices.
+    """
+    entry = dict(record)
+    entry['as_of'] = as_of
+    entry['expires'] = parsing.str_to_numeric(entry['expires'])
+
+    # Note: I considered filtering out expired leases based on the
+    # expiration time, but apparently dnsmasq leaves old expiration
+    # times in this file even for active devices.
+    return entry
+
+
+def read_leases(path):
+    """
+    Read leases from a dnsmasq leases file.
+
+    Returns a list of leases, each a dictionary containing the following fields.
+    as_of: Time that lease information was last updated (seconds since Unix epoch).
+    expires: DHCP expiration time (seconds since Unix epoch).
+    mac_addr: MAC address of the device.
+    ip_addr: IP address assigned to the device.
+    hostname: Device hostname if reported.
+    client_id: A client-specified identifier, which varies between devices.
+    """
+    # Get mtime of the leases file, which gives a sense of the age.
+    as_of = os.path.getmtime(path)
+    return [make_lease(record, as_of) for record in read_lease_records(path)]
+
+
+def update_lease(leases, entry):
+    """
+    Update a dictionary of DHCP leases with a new entry.
+
+    The dictionary should be indexed by MAC address. The new entry will be
+    added to the dictionary unless it would replace an entry for the same MAC
+    address from a more recent lease file.
+    """
+    mac_addr = entry['mac_addr']
+    if mac_addr in leases:
+        existing = leases[mac_addr]
+
+        if existing['as_of'] >= entry['as_of']:
+            return existing
+
+    leases[mac_addr] = entry
+    return entry
+
+
+def makeETag(*parts):
+    return '"{}"'.format(hashlib.sha1(repr(parts)).hexdigest()[:20])
+
+
+class LeaseFile(object):
+    """
+    Parsed contents of one leases file.
+
+    records: entries as strings, in file order.
+    leases: entries with the as_of field and numeric expiration time.
+    body: JSON encoding of records.
+    etag: entity tag that changes when the file changes.
+    """
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.etag = makeETag(path, fingerprint)
+
+        as_of = fingerprint[0]
+        self.records = read_lease_records(path)
+        self.leases = [make_lease(record, as_of) for record in self.records]
+        self.body = json.dumps(self.records)
+
+
+class LeaseIndex(object):
+    def __init__(self):
+        # Map path -> LeaseFile.
+        self.files = dict()
+
+        # Map MAC address -> lease across all leases files, along with the
+        # fingerprints it was built from and its JSON encoding.
+        self.devices = dict()
+        self.devicesKey = None
+        self.devicesBody = "[]"
+        self.devicesETag = makeETag(None)
+
+    def getFile(self, path):
+        """
+        Get the parsed contents of a leases file, reading it again only if it
+        changed.
+
+        Raises OSError if the file does not exist.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.files.pop(path, None)
+            raise
+
+        fingerprint = (st.st_mtime, st.st_size, st.st_ino)
+
+        leaseFile = self.files.get(path, None)
+        if leaseFile is None or leaseFile.fingerprint != fingerprint:
+            leaseFile = LeaseFile(path, fingerprint)
+            self.files[path] = leaseFile
+
+        return leaseFile
+
+    def getDevices(self):
+        """
+        Get the leases of devices on all networks with a DHCP server.
+
+        Returns a tuple (etag, body), where body is a JSON list of leases with
+        one entry per MAC address.
+        """
+        leaseFiles = []
+        for comment, path in client.getLeaseFiles():
+            try:
+                leaseFiles.append(self.getFile(path))
+            except (IOError, OSError):
+                # dnsmasq creates the file when it starts.
+                continue
+
+        # Forget files that are no longer configured.
+        paths = set(leaseFile.path for leaseFile in leaseFiles)
+        for path in list(self.files):
+            if path not in paths:
+                del self.files[path]
+
+        key = sorted((f.path, f.fingerprint) for f in leaseFiles)
+        if key != self.devicesKey:
+            devices = dict()
+            for leaseFile in leaseFiles:
+                for entry in leaseFile.leases:
+                    update_lease(devices, entry)
+
+            self.devices = devices
+            self.devicesKey = key
+            self.devicesBody = json.dumps(devices.values())
+            self.devicesETag = makeETag(key)
+
+        return self.devicesETag, self.devicesBody
+
+
+# Index shared by the API handlers.
+leaseIndex = LeaseIndex()
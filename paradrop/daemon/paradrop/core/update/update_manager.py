@@ -3,20 +3,34 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import heapq
+import itertools
 import time
 import threading
+from collections import deque
 from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
 
 from paradrop.base.output import out
 from paradrop.base.pdutils import timeint
 from paradrop.base import constants, nexus, settings
 from paradrop.core.agent import reporting
+from paradrop.core.config import configservice
 from paradrop.lib.misc.procmon import dockerMonitor, containerdMonitor
 from paradrop.core.chute.restart import reloadChutes
 
 from . import update_object
 
 
+# Priorities for queued updates; lower values run first, and updates with the
+# same priority run in the order they were queued.  Updates resuming after a
+# Deferred (e.g. a Docker build) finish before new work starts, and router
+# updates run before chute updates.
+PRIORITY_RESUME = 0
+PRIORITY_ROUTER = 1
+PRIORITY_CHUTE = 2
+
+
 class UpdateManager:
 
     """
@@ -24,55 +38,215 @@ class UpdateManager:
         It utilizes the ChuteStorage class to hold onto the chute data.
 
         Use @updateChutes to make the configuration changes on the AP.
-            This function is thread-safe, this class will only call one update set at a time.
-            All others are held in a queue until the last update is complete.
+            This function is thread-safe.  Updates are held in a queue and
+            performed by up to settings.FC_UPDATE_WORKERS worker threads.
+            Updates to different chutes may run at the same time, but only
+            one update runs at a time for any chute, and router updates run
+            alone.
     """
 
     def __init__(self, reactor):
         self.reactor = reactor
 
+        # The worker thread waits on updateCondition for updates to be added
+        # to updateQueue, a heap of (priority, sequence, update) tuples.
         self.updateLock = threading.Lock()
+        self.updateCondition = threading.Condition(self.updateLock)
         self.updateQueue = []
+        self.updateSequence = itertools.count()
+        self.running = True
+
+        # Map chute name -> update currently held by a worker thread.
+        self.running_updates = {}
 
         # Map update_id -> update object.
         self.active_changes = {}
 
+        # Recently completed update objects, oldest first.
+        self.recent_changes = deque(maxlen=settings.FC_UPDATE_HISTORY)
+
         # TODO: Ideally, load this from file so that change IDs are unique
         # across system reboots.
         self.next_change_id = 1
 
+        # The workers run in their own thread pool, so that long updates do
+        # not tie up the reactor thread pool, which also serves deferToThread
+        # calls from the API.
+        self.workerPool = ThreadPool(minthreads=0,
+                maxthreads=settings.FC_UPDATE_WORKERS, name="update-workers")
+
         ###########################################################################################
-        # Launch the first update call, NOTE that you have to use callInThread!!
+        # Launch the first update call, NOTE that you have to run it in a thread!!
         # This happens because the perform_updates should run in its own thread,
-        # it makes blocking calls and such... so if we *don't* use callInThread
+        # it makes blocking calls and such... so if we *don't* use a thread
         # then this function WILL BLOCK THE MAIN EVENT LOOP (ie. you cannot send any data)
         #
-        # FIXME: It should be noted that calling updateLock.acquire(), e.g.
-        # from add_update, also blocks the main thread.  Synchronizing access
-        # to the work queue should be reworked.
+        # The worker only holds updateLock briefly to take an update from the
+        # queue, so add_update does not block the main thread for long.  The
+        # first worker starts the others after it has queued the startup
+        # updates.
         ###########################################################################################
-        self.reactor.callInThread(self._perform_updates)
+        self.reactor.callWhenRunning(self._start_workers)
+        self.reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+        self.reactor.addSystemEventTrigger('during', 'shutdown', self.workerPool.stop)
 
-    def _get_next_update(self):
+    def _start_workers(self):
+        self.workerPool.start()
+        self.workerPool.callInThread(self._perform_updates)
+
+    def stop(self):
         """MUTEX: updateLock
-            Returns the size of the local update queue.
+            Wake up the worker thread and tell it to exit.
         """
-        self.updateLock.acquire()
-        if(len(self.updateQueue) > 0):
-            # Get first available
-            a = self.updateQueue.pop(0)
+        with self.updateCondition:
+            self.running = False
+            self.updateCondition.notify_all()
+
+    def _enqueue(self, update, priority=None, coalesce=False):
+        """MUTEX: updateLock
+            Add an update to the queue and wake up the worker thread.
+
+            If coalesce is True, the update may be combined with a queued
+            update for the same chute instead (see _coalesce).
+        """
+        if priority is None:
+            if update.updateClass == 'ROUTER':
+                priority = PRIORITY_ROUTER
+            else:
+                priority = PRIORITY_CHUTE
+
+        # Remember when the update was first queued to measure how long it
+        # waits before starting.
+        if getattr(update, 'queuedTime', None) is None:
+            update.queuedTime = time.time()
+
+        with self.updateCondition:
+            if coalesce and self._coalesce(update):
+                return
+
+            heapq.heappush(self.updateQueue,
+                    (priority, next(self.updateSequence), update))
+            self.updateCondition.notify()
+
+    def _coalesce(self, update):
+        """
+            Try to combine a new update with the last queued update for the
+            same chute, so that a burst of changes to a chute runs the update
+            pipeline once.  The caller must hold updateLock.
+
+            Returns True if the update was combined and should not be queued.
+        """
+        pending = None
+        for entry in self.updateQueue:
+            if entry[2].name == update.name and \
+                    (pending is None or entry[1] > pending[1]):
+                pending = entry
+
+        if pending is None:
+            return False
+
+        keep = update_object.coalesce(pending[2], update)
+        if keep is None:
+            return False
+
+        elif keep is update:
+            # The new update takes the place of the queued one and inherits
+            # its queue time.
+            update.queuedTime = pending[2].queuedTime
+            update.supersede(pending[2])
+            index = self.updateQueue.index(pending)
+            self.updateQueue[index] = (pending[0], pending[1], update)
+
         else:
-            a = None
-        self.updateLock.release()
-        return a
+            keep.supersede(update)
+
+        out.info('Combined {} with {}\n'.format(update, pending[2]))
+        return True
+
+    def _is_runnable(self, update):
+        """
+            Check whether an update can start without conflicting with
+            updates that are running or suspended (e.g. waiting for a Docker
+            build).  The caller must hold updateLock.
+        """
+        if update.updateClass == 'ROUTER':
+            # Router updates change the configuration of the whole system.
+            return len(self.running_updates) == 0
+
+        for other in self.running_updates.values():
+            if other.updateClass == 'ROUTER' or other.name == update.name:
+                return False
+
+        for other in self.active_changes.values():
+            if other is not update and other.name == update.name:
+                return False
+
+        return True
+
+    def _take_next_update(self):
+        """
+            Remove and return the first queued update that can start, or
+            None.  The caller must hold updateLock.
+        """
+        for entry in sorted(self.updateQueue):
+            update = entry[2]
+            if self._is_runnable(update):
+                self.updateQueue.remove(entry)
+                heapq.heapify(self.updateQueue)
+                self.running_updates[update.name] = update
+
+                # Chute updates with more updates queued behind them wait for
+                # one configuration reload that applies all of their changes.
+                # Router updates run alone and reload right away.
+                update.batchReload = (update.updateClass != 'ROUTER' and
+                        len(self.updateQueue) > 0)
+                return update
+
+            # Do not let chute updates overtake a waiting router update.
+            if update.updateClass == 'ROUTER':
+                break
+
+        return None
+
+    def _get_next_update(self, block=False):
+        """MUTEX: updateLock
+            Returns the next update to perform, or None if no queued update
+            can start.  The caller must pass the update to _release_update
+            when it is done with it.
+
+            If block is True, wait until an update is available or the
+            manager is stopped.
+        """
+        with self.updateCondition:
+            update = self._take_next_update()
+            while block and self.running and update is None:
+                self.updateCondition.wait()
+                update = self._take_next_update()
+            return update
+
+    def _release_update(self, update):
+        """MUTEX: updateLock
+            Mark an update as no longer held by a worker thread and wake up
+            the workers, since queued updates may have been waiting for it.
+        """
+        with self.updateCondition:
+            if self.running_updates.get(update.name) is update:
+                del self.running_updates[update.name]
+            self.updateCondition.notify_all()
+
+    def get_queued_changes(self):
+        """MUTEX: updateLock
+            Returns a list of queued updates in the order they will run.
+        """
+        with self.updateCondition:
+            return [x[2] for x in sorted(self.updateQueue)]
 
     def clear_update_list(self):
         """MUTEX: updateLock
             Clears all updates from list (new array).
         """
-        self.updateLock.acquire()
-        self.updateQueue = []
-        self.updateLock.release()
+        with self.updateCondition:
+            self.updateQueue = []
 
     def add_update(self, **update):
         """MUTEX: updateLock
@@ -92,10 +266,7 @@ class UpdateManager:
 
         # Convert to Update object before storing.
         updateObj = update_object.parse(update)
-
-        self.updateLock.acquire()
-        self.updateQueue.append(updateObj)
-        self.updateLock.release()
+        self._enqueue(updateObj, coalesce=settings.FC_UPDATE_COALESCE)
 
         return d
 
@@ -118,12 +289,81 @@ class UpdateManager:
         if change_id in self.active_changes:
             return self.active_changes[change_id]
 
-        for update in self.updateQueue:
+        pending = self.get_queued_changes() + list(self.active_changes.values())
+        for update in pending:
+            if update.change_id == change_id:
+                return update
+
+            # Changes combined into a pending change.
+            for other in update.superseded:
+                if other.change_id == change_id:
+                    return other
+
+        for update in self.recent_changes:
             if update.change_id == change_id:
                 return update
 
         return None
 
+    def get_timing_summary(self, limit=None):
+        """
+        Aggregate plan timing across recently completed changes.
+
+        Returns a list of dictionaries, one per plan function, ordered by
+        total wall time with the most expensive function first.
+        """
+        changes = list(self.recent_changes)
+        if limit is not None:
+            changes = changes[-limit:] if limit > 0 else []
+
+        functions = {}
+        for update in changes:
+            for entry in update.timeline:
+                key = (entry['module'], entry['function'])
+                if key not in functions:
+                    functions[key] = {
+                        'function': entry['function'],
+                        'module': entry['module'],
+                        'calls': 0,
+                        'failures': 0,
+                        'wall': 0.0,
+                        'max_wall': 0.0,
+                        'cpu': 0.0,
+                        'wait': 0.0
+                    }
+
+                summary = functions[key]
+                summary['calls'] += 1
+                if not entry['success']:
+                    summary['failures'] += 1
+                summary['wall'] += entry['wall']
+                summary['max_wall'] = max(summary['max_wall'], entry['wall'])
+                summary['cpu'] += entry['cpu']
+                summary['wait'] += entry.get('wait', 0.0)
+
+        return sorted(functions.values(), key=lambda x: x['wall'], reverse=True)
+
+    def get_latency_summary(self):
+        """
+        Summarize how long recently completed changes waited in the queue
+        before they started.
+
+        Returns a dictionary with the number of changes and the mean and
+        maximum latency in seconds.
+        """
+        latencies = [update.queueLatency for update in self.recent_changes
+                     if getattr(update, 'queueLatency', None) is not None]
+
+        summary = {
+            'count': len(latencies),
+            'mean': None,
+            'max': None
+        }
+        if len(latencies) > 0:
+            summary['mean'] = sum(latencies) / len(latencies)
+            summary['max'] = max(latencies)
+        return summary
+
     def _make_router_update(self, updateType):
         """
         Make a ROUTER class update object.
@@ -159,21 +399,38 @@ class UpdateManager:
         # add any chutes that should already be running to the front of the
         # update queue before processing any updates
         startQueue = reloadChutes()
-        self.updateLock.acquire()
-        self.updateQueue.append(self._make_router_update("prehostconfig"))
-        self.updateQueue.append(self._make_router_update("inithostconfig"))
-        self.updateQueue.extend(startQueue)
-        self.updateLock.release()
-
-        # Always perform this work
-        while self.reactor.running:
-            # Check for new updates
+        self._enqueue(self._make_router_update("prehostconfig"))
+        self._enqueue(self._make_router_update("inithostconfig"))
+        for update in startQueue:
+            self._enqueue(update)
+
+        for i in range(1, settings.FC_UPDATE_WORKERS):
+            self.workerPool.callInThread(self._run_worker)
+
+        self._run_worker()
+
+    def _run_worker(self):
+        """
+            Worker thread loop: take updates from the queue and perform them
+            until the manager is stopped.
+        """
+        while self.running and self.reactor.running:
             change = self._get_next_update()
             if change is None:
-                time.sleep(1)
-                continue
+                # No queued update can start, so reload the configuration for
+                # updates that are waiting for a batched reload.  They are
+                # queued again when the reload finishes.
+                configservice.flushReloads()
 
-            self._perform_update(change)
+                # Wait for new updates
+                change = self._get_next_update(block=True)
+                if change is None:
+                    continue
+
+            try:
+                self._perform_update(change)
+            finally:
+                self._release_update(change)
 
             # Apply a batch of updates and when the queue is empty, send a
             # state report.  We're not reacquiring the mutex here because the
@@ -191,9 +448,15 @@ class UpdateManager:
         # Add to the active set when processing starts. It is a dictionary, so
         # it does not matter if this is the first time we see this update or
         # if we are resuming it.
-        self.active_changes[update.change_id] = update
+        with self.updateLock:
+            self.active_changes[update.change_id] = update
 
         try:
+            if not update.execute_called:
+                queuedTime = getattr(update, 'queuedTime', None)
+                if queuedTime is not None:
+                    update.queueLatency = time.time() - queuedTime
+
             # Mark update as having been started.
             update.started()
             out.info('Performing update %s\n' % (update))
@@ -204,6 +467,7 @@ class UpdateManager:
                 out.testing('Bouncing update %s, result: %s\n' % (
                     update, settings.FC_BOUNCE_UPDATE))
                 update.complete(success=True, message=settings.FC_BOUNCE_UPDATE)
+                self._finish_change(update)
                 return
             # TESTING end
 
@@ -220,11 +484,23 @@ class UpdateManager:
                 # if the build was successful or throws an exception. That
                 # should work but is not very general.
                 def resume(result):
-                    self.updateQueue.append(update)
+                    self._enqueue(update, PRIORITY_RESUME)
                 result.addBoth(resume)
-            elif update.change_id in self.active_changes:
-                # Update is done, so remove it from the active list.
-                del self.active_changes[update.change_id]
+            else:
+                self._finish_change(update)
 
         except Exception as e:
             out.exception(e, True)
+
+            # Do not let a broken update block later updates to the chute.
+            self._finish_change(update)
+
+    def _finish_change(self, update):
+        """MUTEX: updateLock
+            Move a finished update from the active list to the recent list.
+        """
+        with self.updateLock:
+            if update.change_id in self.active_changes:
+                del self.active_changes[update.change_id]
+                self.recent_changes.append(update)
+                self.recent_changes.extend(update.superseded)
@@ -3,8 +3,9 @@ This holds onto the UpdateObject class.
 It allows us to easily abstract away different update types and provide a uniform
 way to interpret the results through a set of basic actionable functions.
 '''
+import shutil
 import time
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, threads
 from twisted.python.failure import Failure
 
 from paradrop.base import nexus, settings
@@ -78,6 +79,16 @@ class UpdateObject(object):
         # Save a timestamp from when the update object was created.
         self.createdTime = time.time()
 
+        # Set by the UpdateManager: when the update was queued, and how many
+        # seconds it waited in the queue before it started.
+        self.queuedTime = None
+        self.queueLatency = None
+
+        # Set by the UpdateManager when more updates are queued behind this
+        # one, so that they can share one configuration reload (see
+        # configservice.reloadAll).
+        self.batchReload = False
+
         # Set to True if this update is delegated to an external program (e.g.
         # pdinstall).  In that case, the external program will be responsible
         # for reporting on the completion status of the update.
@@ -98,6 +109,15 @@ class UpdateObject(object):
         # whether its new or has been resumed.
         self.execute_called = False
 
+        # Timing information for each plan function that was called, in
+        # order.  See record_timing.
+        self.timeline = []
+
+        # Queued updates whose work this update performs instead.  They
+        # complete with the same result as this update.  See supersede.
+        self.superseded = []
+        self.supersededBy = None
+
     def __repr__(self):
         return "<Update({}) :: {} - {} @ {}>".format(self.updateClass, self.name, self.updateType, self.tok)
 
@@ -110,7 +130,12 @@ class UpdateObject(object):
         execution is about to begin.
 
         Sends a notification to the pdserver if this is a tracked update.
+        Updates that were folded into this one start with it.
         """
+        if not self.execute_called:
+            for update in self.superseded:
+                update.started()
+
         # TODO Look into this.
         # This might happen during router initialization.  If nexus.core is
         # None, we do not know the router's identity, so we cannot publish any
@@ -196,8 +221,10 @@ class UpdateObject(object):
                 self.updateType, self.new.name,
                 "success" if kwargs['success'] else "failure")
             out.usage(message, chute=self.new.name, updateType=self.updateType,
-                      createdTime=self.createdTime, startTime=self.startTime,
-                      endTime=self.endTime, **kwargs)
+                      createdTime=self.createdTime,
+                      startTime=getattr(self, 'startTime', None),
+                      endTime=self.endTime, queueLatency=self.queueLatency,
+                      **kwargs)
         except Exception as e:
             out.exception(e, True)
             if d:
@@ -206,7 +233,8 @@ class UpdateObject(object):
         # Last message to send to observers.
         msg = {
             'time': self.endTime,
-            'message': message
+            'message': message,
+            'timeline': self.timeline
         }
         self.messages.append(msg)
 
@@ -223,6 +251,31 @@ class UpdateObject(object):
         if d:
             reactor.callFromThread(d.callback, self)
 
+        # Answer the updates that were folded into this one.
+        for update in self.superseded:
+            update.complete(**kwargs)
+
+    def supersede(self, other):
+        """
+        Take over the work of another queued update, which will not run.
+
+        The other update completes with the same result as this update.
+        """
+        other.supersededBy = self
+        other.progress("Superseded by change {}".format(self.change_id))
+
+        self.superseded.extend(other.superseded)
+        self.superseded.append(other)
+        other.superseded = []
+
+        # Clean up files that were uploaded for the other update.  This is
+        # called while holding the update manager's lock, so defer the
+        # removal until the lock is released and do it off the reactor thread.
+        workdir = getattr(other, 'workdir', None)
+        if workdir is not None and workdir != getattr(self, 'workdir', None):
+            reactor.callFromThread(threads.deferToThread, shutil.rmtree,
+                                   workdir, True)
+
     def execute(self):
         """
         The function that actually walks through the main process required to create the chute.
@@ -274,6 +327,46 @@ class UpdateObject(object):
         self.complete(success=True, message='Chute {} {} success'.format(
             self.name, self.updateType))
 
+    def record_timing(self, phase, func, start, wall, cpu, success=True,
+                      deferred=None):
+        """
+        Record how long a plan function took to run.
+
+        Args:
+            phase (str): "execute" or "abort".
+            func (callable): the plan function.
+            start (float): time when the function was called.
+            wall (float): elapsed seconds until the function returned.
+            cpu (float): CPU seconds used by the process during the call.
+            success (bool): False if the function raised an exception.
+            deferred: if the function returned a Deferred, the time until
+                it fires is recorded as "wait".
+
+        Returns the timeline entry as a dictionary.
+        """
+        entry = {
+            'function': getattr(func, '__name__', repr(func)),
+            'module': getattr(func, '__module__', None),
+            'phase': phase,
+            'priority': None,
+            'start': start,
+            'wall': wall,
+            'cpu': cpu,
+            'success': success
+        }
+
+        if phase == "execute":
+            entry['priority'] = self.plans.maxPriorityReturned
+
+        if isinstance(deferred, defer.Deferred):
+            def fired(result):
+                entry['wait'] = time.time() - start - wall
+                return result
+            deferred.addBoth(fired)
+
+        self.timeline.append(entry)
+        return entry
+
     def add_message_observer(self, observer):
         for msg in self.messages:
             observer.on_message(msg)
@@ -318,6 +411,31 @@ NEW_CHUTE_STATE = {
 }
 
 
+# When a chute update is added while an earlier update for the same chute is
+# still queued, the two can often be replaced by one.  Keys are (earlier,
+# later) update types, and values say which of the two does the work.  A later
+# update or delete determines the final state of the chute by itself, and a
+# later restart or stop overrides earlier restarts, starts and stops.  A later
+# restart that does not change the chute is covered by an earlier update,
+# which restarts the chute anyway.  Creates are never combined because later
+# updates are validated against the chute that existed when they were queued.
+COALESCE_RULES = {
+    ('update', 'update'): 'later',
+    ('restart', 'update'): 'later',
+    ('start', 'update'): 'later',
+    ('stop', 'update'): 'later',
+    ('update', 'delete'): 'later',
+    ('restart', 'delete'): 'later',
+    ('start', 'delete'): 'later',
+    ('stop', 'delete'): 'later',
+    ('restart', 'restart'): 'later',
+    ('start', 'restart'): 'later',
+    ('stop', 'restart'): 'later',
+    ('restart', 'stop'): 'later',
+    ('update', 'restart'): 'earlier'
+}
+
+
 class UpdateChute(UpdateObject):
     """
     Updates specifically tailored to chute actions like create, delete, etc...
@@ -366,6 +484,19 @@ class UpdateChute(UpdateObject):
         """
         return self.updateType in ["create", "update"]
 
+    def changes_chute(self):
+        """
+        Check whether this update changes the chute apart from its state.
+        """
+        if self.old is None or self.has_chute_build():
+            return True
+
+        new_spec = self.new.create_specification()
+        old_spec = self.old.create_specification()
+        new_spec.pop('state', None)
+        old_spec.pop('state', None)
+        return new_spec != old_spec
+
 
 class UpdateRouter(UpdateObject):
     """
@@ -406,6 +537,33 @@ UPDATE_CLASSES = {
 }
 
 
+def coalesce(earlier, later):
+    """
+    Decide whether two queued updates can be replaced by one.
+
+    Returns the update that should do the work of both, or None if both need
+    to run.  The caller should call supersede on the returned update.
+    """
+    if earlier.updateClass != 'CHUTE' or later.updateClass != 'CHUTE':
+        return None
+
+    if earlier.name != later.name:
+        return None
+
+    # The earlier update has already started, e.g. it is resuming after a
+    # build.
+    if earlier.execute_called:
+        return None
+
+    keep = COALESCE_RULES.get((earlier.updateType, later.updateType), None)
+    if keep == 'later':
+        return later
+    elif keep == 'earlier' and not later.changes_chute():
+        return earlier
+    else:
+        return None
+
+
 def parse(obj):
     """
     Determines the update type and returns the proper class.
@@ -3,8 +3,11 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import hashlib
 import os
 import pickle
+import struct
+import zlib
 from twisted.internet.task import LoopingCall
 
 from paradrop.base.output import out
@@ -12,6 +15,89 @@ from paradrop.lib.utils import pdos
 from paradrop.lib.utils.yaml import yaml
 
 
+class Journal(object):
+
+    """
+        Append-only file of pickled records.
+
+        Each record is preceded by a header containing its length and CRC32.
+        A record that was only partially written when the system went down
+        fails the check and is discarded on replay along with anything after
+        it.
+    """
+
+    HEADER = struct.Struct("!II")
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.output = None
+
+        # Number of records in the file.
+        self.count = 0
+
+    def append(self, record):
+        """Write a record to the end of the journal and flush it to disk."""
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        crc = zlib.crc32(data) & 0xffffffff
+
+        if self.output is None:
+            self.output = pdos.open(self.filename, 'ab')
+
+        self.output.write(self.HEADER.pack(len(data), crc) + data)
+        self.output.flush()
+        os.fsync(self.output.fileno())
+        self.count += 1
+
+    def replay(self):
+        """Yield the valid records in the journal, in order."""
+        self.close()
+        self.count = 0
+
+        if not pdos.exists(self.filename):
+            return
+
+        valid = 0
+        with pdos.open(self.filename, 'rb') as source:
+            while True:
+                header = source.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+
+                length, crc = self.HEADER.unpack(header)
+                data = source.read(length)
+                if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+                    break
+
+                try:
+                    record = pickle.loads(data)
+                except Exception as e:
+                    out.err('Error loading journal record: %s\n' % (str(e)))
+                    break
+
+                valid = source.tell()
+                self.count += 1
+                yield record
+
+            trailing = source.tell() != valid or len(source.read(1)) > 0
+
+        # Drop a damaged tail so that new records are not appended after it.
+        if trailing:
+            out.warn('Discarding damaged records at end of %s\n' % (self.filename))
+            with pdos.open(self.filename, 'r+b') as output:
+                output.truncate(valid)
+
+    def reset(self):
+        """Discard all records, e.g. after writing a full snapshot."""
+        self.close()
+        pdos.writeAtomic(self.filename, "")
+        self.count = 0
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+
+
 class PDStorage(object):
 
     """
@@ -26,12 +112,39 @@ class PDStorage(object):
             importAttr(): Takes a payload and returns the properly formatted data
             exportAttr(): Takes the data and returns a payload
             attrSaveable(): Returns True if we should save this attr
+            applyRecord(): Apply a journal record to the attr (journal mode)
+
+        In journal mode, the implementer calls recordChange() after each
+        modification instead of saveToDisk().  Records are appended to a
+        journal file next to the snapshot and folded into a new snapshot
+        whenever saveToDisk() runs or the journal grows past journalLimit
+        records.
     """
 
-    def __init__(self, filename, saveTimer):
+    # SHA-1 digest of the payload most recently written or loaded, by file
+    # name.  Implementers such as ChuteStorage share their data between
+    # instances, so this is shared as well.
+    savedDigests = dict()
+
+    # Open journals by file name, shared for the same reason.
+    journals = dict()
+
+    def __init__(self, filename, saveTimer, mirrorYaml=True, journal=False,
+                 journalLimit=100):
         self.filename = filename
         self.saveTimer = saveTimer
 
+        # Write a human-readable copy of the data next to the pickle file.
+        self.mirrorYaml = mirrorYaml
+
+        self.journal = None
+        self.journalLimit = journalLimit
+        if journal:
+            journalFile = filename + ".journal"
+            if journalFile not in PDStorage.journals:
+                PDStorage.journals[journalFile] = Journal(journalFile)
+            self.journal = PDStorage.journals[journalFile]
+
         # Setup looping call to keep chute list perisistant
         if (self.saveTimer > 0):
             self.repeater = LoopingCall(self.saveToDisk)
@@ -41,11 +154,28 @@ class PDStorage(object):
         """Attempts to load the data from disk.
             Returns True if success, False otherwise."""
 
+        loaded = self.loadSnapshot()
+
+        if self.journal is not None:
+            try:
+                for record in self.journal.replay():
+                    self.applyRecord(record)
+                    loaded = True
+            except Exception as e:
+                out.err('Error replaying journal: %s\n' % (str(e)))
+
+        return loaded
+
+    def loadSnapshot(self):
+        """Load the most recent full copy of the data from disk."""
         if(pdos.exists(self.filename)):
             deleteFile = False
             try:
-                pyld = pickle.load(pdos.open(self.filename, 'rb'))
+                with pdos.open(self.filename, 'rb') as source:
+                    data = source.read()
+                pyld = pickle.loads(data)
                 self.setAttr(self.importAttr(pyld))
+                PDStorage.savedDigests[self.filename] = hashlib.sha1(data).hexdigest()
                 return True
             except Exception as e:
                 out.err('Error loading from disk: %s\n' % (str(e)))
@@ -57,12 +187,32 @@ class PDStorage(object):
                     pdos.unlink(self.filename)
                 except Exception as e:
                     out.err('Error unlinking %s\n' % (self.filename))
+                PDStorage.savedDigests.pop(self.filename, None)
 
         return False
 
+    def recordChange(self, record):
+        """Persist a single modification.
+
+        Without a journal, this saves the full data to disk."""
+        if self.journal is None:
+            return self.saveToDisk()
+
+        try:
+            self.journal.append(record)
+        except Exception as e:
+            out.err('Error writing journal: %s\n' % (str(e)))
+            return self.saveToDisk()
+
+        if self.journal.count >= self.journalLimit:
+            self.saveToDisk()
+
     def saveToDisk(self):
-        """Saves the data to disk."""
-        out.info('Saving to disk (%s)\n' % (self.filename))
+        """Saves the data to disk.
+
+        Nothing is written if the data have not changed since the last
+        successful save.  The file is replaced atomically, so a crash
+        leaves either the old or the new version on disk."""
 
         # Make sure they want to save
         if(not self.attrSaveable()):
@@ -71,19 +221,37 @@ class PDStorage(object):
         # Get whatever the data is
         pyld = self.exportAttr(self.getAttr())
 
-        # Write the file to disk, truncate if it exists
+        # The stored objects are modified in place by their owners, so compare
+        # the serialized contents to decide whether anything changed.
         try:
-            with open(self.filename, 'wb') as output:
-                pickle.dump(pyld, output)
-                os.fsync(output.fileno())
+            data = pickle.dumps(pyld)
         except Exception as e:
-            out.err('Error writing to disk %s\n' % (str(e)))
+            out.err('Error serializing data %s\n' % (str(e)))
+            return
 
-        try:
-            with open(self.filename + ".yaml", "w") as output:
-                yaml.dump(pyld, output)
-        except Exception as error:
-            out.err("Error writing yaml file: {}".format(error))
+        digest = hashlib.sha1(data).hexdigest()
+        if digest != PDStorage.savedDigests.get(self.filename):
+            out.info('Saving to disk (%s)\n' % (self.filename))
+
+            try:
+                pdos.writeAtomic(self.filename, data)
+                PDStorage.savedDigests[self.filename] = digest
+            except Exception as e:
+                out.err('Error writing to disk %s\n' % (str(e)))
+                return
+
+            if self.mirrorYaml:
+                try:
+                    pdos.writeAtomic(self.filename + ".yaml", yaml.dump(pyld), "w")
+                except Exception as error:
+                    out.err("Error writing yaml file: {}".format(error))
+
+        # The snapshot now contains every journaled change.
+        if self.journal is not None and self.journal.count > 0:
+            try:
+                self.journal.reset()
+            except Exception as e:
+                out.err('Error resetting journal: %s\n' % (str(e)))
 
     def attrSaveable(self):
         """THIS SHOULD BE OVERRIDEN BY THE IMPLEMENTER."""
@@ -96,3 +264,7 @@ class PDStorage(object):
     def exportAttr(self, data):
         """By default do nothing, but expect that this function could be overwritten"""
         return data
+
+    def applyRecord(self, record):
+        """THIS SHOULD BE OVERRIDEN BY THE IMPLEMENTER IF IT USES A JOURNAL."""
+        raise NotImplementedError()
@@ -5,8 +5,10 @@
 
 import errno
 import os
+import stat
 import subprocess
 import shutil
+import tempfile
 from distutils import dir_util
 
 # We have to import this for the decorator
@@ -19,6 +21,11 @@ __open = open
 # Since we overwrite everything else, do the same to basename
 basename = lambda x: os.path.basename(x)
 
+# The umask can only be read by changing it, which is not safe once other
+# threads are creating files, so read it once at import.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
 def getMountCmd():
     return "mount"
 
@@ -131,6 +138,45 @@ def open(p, mode):
     return __open(p, mode)
 
 
+def writeAtomic(filename, data, mode="wb"):
+    """
+    Replace the contents of a file so that readers never see a partial write.
+
+    The data are written to a temporary file in the same directory, flushed
+    to disk, and renamed over the destination.  After a crash, the file
+    contains either the old or the new contents.  Raises an exception if the
+    write fails, in which case the original file is untouched.
+
+    The file keeps its permissions, or gets the usual permissions for a new
+    file if it does not exist.
+    """
+    directory = os.path.dirname(filename) or "."
+    try:
+        fileMode = stat.S_IMODE(os.stat(filename).st_mode)
+    except OSError:
+        fileMode = 0o666 & ~UMASK
+
+    fd, temp = tempfile.mkstemp(prefix=os.path.basename(filename) + ".",
+                                suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, mode) as output:
+            output.write(data)
+            output.flush()
+            os.fsync(output.fileno())
+        os.chmod(temp, fileMode)
+        os.rename(temp, filename)
+    except:
+        remove(temp, suppressNotFound=True)
+        raise
+
+    # Make sure the rename itself is durable.
+    dirfd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+
+
 def writeFile(filename, line, mode="a"):
     """Adds the following cfg (either str or list(str)) to this Chute's current
         config file (just stored locally, not written to file."""
@@ -3,7 +3,9 @@
 # Authors: The Paradrop Team
 ###################################################################
 
+import collections
 import os
+import re
 
 from paradrop.base.output import out
 from paradrop.base import settings
@@ -46,86 +48,256 @@ def stringify(a):
         return str(a)
 
 
+# Matches one word of a UCI line, skipping the spaces before it.  A quoted
+# word starts with a quotation mark and extends to the next matching quotation
+# mark that is followed by a space or the end of the line, so quotation marks
+# inside a word (e.g. 'don't') do not end it.  Inside a quoted word, a
+# backslash escapes the next character, so an escaped quotation mark never
+# ends the word.  If there is no closing quotation mark, the word extends to
+# the end of the line.
+LINE_PART_RE = re.compile(r"""
+    \ *(?:
+        '([^\\']*(?:(?:\\.|'(?!\ |$))[^\\']*)*)'(?=\ |$)
+      | "([^\\"]*(?:(?:\\.|"(?!\ |$))[^\\"]*)*)"(?=\ |$)
+      | '(.*)$
+      | "(.*)$
+      | ([^\ ]+)
+    )""", re.VERBOSE)
+
+# Escape sequences recognized in quoted words.  Any other backslash is kept as
+# it is, so values written before escaping was introduced read the same.
+SINGLE_ESCAPE_RE = re.compile(r"\\([\\'])")
+DOUBLE_ESCAPE_RE = re.compile(r'\\([\\"])')
+
+
+def escapeValue(value):
+    """
+    Escape a value for writing between single quotation marks.
+    """
+    if not isinstance(value, basestring):
+        value = str(value)
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
+
 def getLineParts(line):
     """
     Split the UCI line into its whitespace-separated parts.
 
-    Returns a list of strings, with apostrophes removed.
+    Returns a list of strings, with apostrophes and escapes removed.
     """
-    parts = line.split(" ")
-
     # Nothing to work with in this case. It is probably an erroneous line,
     # because they should usually have at least two parts.
-    if len(parts) <= 1:
-        return parts
+    if " " not in line:
+        return [line]
+
+    parts = []
+    for match in LINE_PART_RE.finditer(line):
+        index = match.lastindex
+        part = match.group(index)
+        if "\\" not in part:
+            parts.append(part)
+        elif index == 1:
+            parts.append(SINGLE_ESCAPE_RE.sub(r"\1", part))
+        elif index == 2:
+            parts.append(DOUBLE_ESCAPE_RE.sub(r"\1", part))
+        else:
+            parts.append(part)
+
+    return parts
 
-    groups = []
 
-    while len(parts) > 0:
-        word = parts.pop(0)
+def parseConfigLines(lines):
+    """
+    Parse UCI configuration lines (generator).
 
-        # Suppress empty words that are not enclosed in quotations.
-        if len(word) == 0:
+    Takes an iterable of lines, e.g. an open file, and yields a (config,
+    options) tuple for each section as soon as the section is complete.  See
+    UCIConfig for a description of the tuple format.
+    """
+    cfg = None
+    opt = None
+
+    for line in lines:
+        line = line.strip()
+
+        # If comment ignore
+        if line.startswith('#'):
             continue
 
-        opening_quote = None
-        if word.startswith("'") or word.startswith('"'):
-            opening_quote = word[0]
-            word = word[1:]
+        l = getLineParts(line)
+
+        #
+        # Config
+        #
+        if(l[0] == 'config'):
+            # Yield the last config we had
+            if(cfg and opt):
+                yield (cfg, opt)
+
+            # start a new config
+            cfg = {'type': l[1]}
+
+            # Third element can be comment or name
+            if(len(l) == 3):
+                if (l[2].startswith('#')):
+                    cfg['comment'] = l[2][1:]
+                else:
+                    cfg['name'] = l[2]
+            elif (len(l) == 4):
+                # Four elements, so third is name and 4th is comment
+                    cfg['name'] = l[2]
+                    cfg['comment'] = l[3][1:]
+            opt = {}
+
+        #
+        # Options
+        #
+        elif(l[0] == 'option'):
+            opt[l[1]] = l[2]
+
+        #
+        # List
+        #
+        elif(l[0] == 'list'):
+            # Make sure the key exists and is a list.
+            if l[1] not in opt:
+                opt[l[1]] = []
+            elif not isinstance(opt[l[1]], list):
+                # One line started with "option", another with "list".  If
+                # this is supposed to be a list, they should all start with
+                # "list".
+                raise Exception("Malformed UCI: mixed list/option lines")
+
+            opt[l[1]].append(l[2])
+
+    # Also at the end, yield the final config we were making
+    # Make sure cfg,opt aren't None
+    if(None not in (cfg, opt)):
+        yield (cfg, opt)
+
+
+def iterConfigFile(filepath):
+    """
+    Read a UCI configuration file one section at a time (generator).
+
+    Yields (config, options) tuples without loading the whole file into
+    memory first.
+    """
+    try:
+        fd = pdos.open(filepath, 'r')
+    except Exception as e:
+        out.err('Error reading file %s: %s\n' % (filepath, str(e)))
+        raise e
 
-        closing_quote = None
-        if opening_quote is not None and word.endswith(opening_quote):
-            closing_quote = word[-1]
-            word = word[:-1]
+    with fd:
+        for section in parseConfigLines(fd):
+            yield section
 
-        group = [word]
 
-        # Simple case: line part is a single word.
-        if opening_quote is None or opening_quote == closing_quote:
-            groups.append(group)
-            continue
+def freezeValue(value):
+    """
+    Convert a configuration data structure into a hashable equivalent.
+
+    Lists become tuples, and dictionaries become sorted tuples of their
+    items, so that equal structures always produce equal results.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freezeValue(v)) for k, v in value.iteritems()))
+    elif isinstance(value, (list, tuple)):
+        return tuple(freezeValue(v) for v in value)
+    else:
+        return value
 
-        # Build up a multi-word part until we find the closing quote.
-        # Example: config ssid 'Free WiFi' # <- Space inside quotation marks.
-        while len(parts) > 0:
-            word = parts.pop(0)
 
-            if word.endswith(opening_quote):
-                closing_quote = word[-1]
-                word = word[:-1]
+def getConfigKey(config):
+    """
+    Return a canonical, hashable key for a (config, options) tuple.
 
-            group.append(word)
+    Values are stringified first, so two sections have the same key exactly
+    when singleConfigMatches considers them equal.
+    """
+    c, o = config
+    return (freezeValue(stringify(c)), freezeValue(stringify(o)))
 
-            if opening_quote == closing_quote:
-                break
 
-        groups.append(group)
+class ConfigDiff(collections.namedtuple("ConfigDiff",
+                                        ["added", "removed", "changed"])):
+    """
+    Differences between two lists of (config, options) tuples.
 
-    return [" ".join(g) for g in groups]
+    added and removed are lists of sections, and changed is a list of (old,
+    new) pairs of sections.
+    """
+    def isEmpty(self):
+        return not (self.added or self.removed or self.changed)
 
+    def __str__(self):
+        return "{} added, {} removed, {} changed".format(len(self.added),
+                len(self.removed), len(self.changed))
 
-def chuteConfigsMatch(chutePre, chutePost):
-    """ Takes two lists of objects, and returns whether or not they are identical."""
-    # TODO - currently using a naive implementation by searching over the old configs and the new configs.
-    # Could improve if slow by keep track of matched configs on both sides, deleting from search space
-    # If any objects remain at the end
-    # loop through all old configs, check if they each have a match in the new configs
-    for c1 in chutePre:
-        for c2 in chutePost:
-            if (singleConfigMatches(c1, c2)):
-                break
-        else:
-            # We got through the loop without finding a match, so return false
-           return False
 
-    for c2 in chutePost:
-        for c1 in chutePre:
-            if (singleConfigMatches(c1, c2)):
-                break
+def diffConfigs(chutePre, chutePost):
+    """
+    Compare two lists of (config, options) tuples.
+
+    Returns a ConfigDiff with three lists: sections that were added, sections
+    that were removed, and (old, new) pairs of named sections whose options
+    changed.  Sections are compared as multisets, so order does not matter.
+    Anonymous sections cannot be paired up and appear as removed and added
+    instead of changed.
+    """
+    remaining = collections.Counter(getConfigKey(c) for c in chutePost)
+
+    removed = []
+    for config in chutePre:
+        key = getConfigKey(config)
+        if remaining[key] > 0:
+            remaining[key] -= 1
         else:
-            return False
+            removed.append(config)
+
+    added = []
+    for config in chutePost:
+        key = getConfigKey(config)
+        if remaining[key] > 0:
+            remaining[key] -= 1
+            added.append(config)
+
+    # Pair up removed and added sections that have the same type and name.
+    def header(config):
+        c = config[0]
+        if 'name' not in c:
+            return None
+        return (str(c['type']), str(c['name']))
+
+    removedByHeader = dict()
+    for config in removed:
+        key = header(config)
+        if key is not None:
+            removedByHeader.setdefault(key, []).append(config)
+
+    changed = []
+    stillAdded = []
+    for config in added:
+        candidates = removedByHeader.get(header(config), None)
+        if candidates:
+            changed.append((candidates.pop(0), config))
+        else:
+            stillAdded.append(config)
+
+    changedOld = set(id(old) for old, new in changed)
+    stillRemoved = [c for c in removed if id(c) not in changedOld]
+
+    return ConfigDiff(added=stillAdded, removed=stillRemoved, changed=changed)
 
-    return True
+
+def chuteConfigsMatch(chutePre, chutePost):
+    """ Takes two lists of objects, and returns whether or not they are identical."""
+    # Compare the two lists as multisets of canonical keys, which takes linear
+    # time regardless of the order of sections.
+    pre = collections.Counter(getConfigKey(c) for c in chutePre)
+    post = collections.Counter(getConfigKey(c) for c in chutePost)
+    return pre == post
 
 
 def isMatch(a, b):
@@ -233,49 +405,17 @@ class UCIConfig:
         if(len(self.config) != len(o.config)):
             return False
 
-        # Parse through config finding any differences
-        oc = o.config
-        for cfg in self.config:
-            c, o = cfg
-            # This is stupid slow, but easy, just look through all values for a match
-            for cfg1 in oc:
-                c1, o1 = cfg1
-                if(c1 == c and o1 == o):
-                    break
-            else:
-                # Found no match so we return None
-                return False
-
-        return True
+        # Compare the sections as multisets, ignoring their order.
+        mine = collections.Counter(freezeValue(cfg) for cfg in self.config)
+        other = collections.Counter(freezeValue(cfg) for cfg in o.config)
+        return mine == other
 
     def __ne__(self, o):
         """Override the not equals operator between 2 Config objects
             This is required because the config attribute contains a list of tuples which Python doesn't
             seem to like to do comparisons directly on, for instance cfg1.config != cfg2.config fails to
             say they are the same even though they are."""
-        if(self.filepath != o.filepath):
-            return True
-        if(self.myname != o.myname):
-            return True
-
-        # before parsing through each one, do simple check to make sure the number of configs is the same
-        if(len(self.config) != len(o.config)):
-            return True
-
-        # Parse through config finding any differences
-        oc = o.config
-        for cfg in self.config:
-            c, o = cfg
-            # This is stupid slow, but easy, just look through all values for a match
-            for cfg1 in oc:
-                c1, o1 = cfg1
-                if(c1 == c and o1 == o):
-                    break
-            else:
-                # Found no match so we return None
-                return True
-
-        return False
+        return not self.__eq__(o)
 
     def getConfig(self, config):
         """ Returns a list of call configs with the given title """
@@ -315,15 +455,30 @@ class UCIConfig:
 
     def addConfigs(self, configs):
         """ Adds a list of tuples to our config """
+        existing = set(getConfigKey(e) for e in self.config)
         for e in configs:
-            c, o = e
-            self.addConfig(c, o)
+            key = getConfigKey(e)
+            if key not in existing:
+                existing.add(key)
+                self.config.append(e)
 
     def delConfigs(self, configs):
-        """ Adds a list of tuples to our config """
-        for e in configs:
-            c, o = e
-            self.delConfig(c, o)
+        """ Removes a list of tuples from our config """
+        toDelete = collections.Counter(getConfigKey(e) for e in configs)
+
+        remaining = []
+        for e in self.config:
+            key = getConfigKey(e)
+            if toDelete[key] > 0:
+                toDelete[key] -= 1
+            else:
+                remaining.append(e)
+
+        for key, count in toDelete.iteritems():
+            if count > 0:
+                out.verbose('No match to delete, config: %r\n' % (key[0], ))
+
+        self.config[:] = remaining
 
     def addConfig(self, config, options):
         """Adds the tuple to our config."""
@@ -420,12 +575,12 @@ class UCIConfig:
                     # in the list.
                     for vals in v:
                         # Now append a list set to the config
-                        line = "\tlist %s '%s'\n" % (k, vals)
+                        line = "\tlist %s '%s'\n" % (k, escapeValue(vals))
                         output += line
 
                 # Skip options that are None rather than writing "None".
                 elif v is not None:
-                    sv = stringifyOptionValue(v)
+                    sv = escapeValue(stringifyOptionValue(v))
                     line = "\toption %s '%s'\n" % (k, sv)
                     output += line
 
@@ -449,82 +604,4 @@ class UCIConfig:
 
     def readConfig(self):
         """Reads in the config file."""
-        lines = []
-        try:
-            fd = pdos.open(self.filepath, 'r')
-
-            while(True):
-                line = fd.readline()
-                if(not line):
-                    break
-                lines.append(line)
-            fd.close()
-        except Exception as e:
-            out.err('Error reading file %s: %s\n' % (self.filepath, str(e)))
-            raise e
-
-        cfg = None
-        opt = None
-        data = []
-
-        # Now we have the data, deal with it
-        for line in lines:
-            line = line.strip()
-
-            # If comment ignore
-            if line.startswith('#'):
-                continue
-
-            l = getLineParts(line)
-
-            #
-            # Config
-            #
-            if(l[0] == 'config'):
-                # Save last config we had
-                if(cfg and opt):
-                    data.append((cfg, opt))
-
-                # start a new config
-                cfg = {'type': l[1]}
-
-                # Third element can be comment or name
-                if(len(l) == 3):
-                    if (l[2].startswith('#')):
-                        cfg['comment'] = l[2][1:]
-                    else:
-                        cfg['name'] = l[2]
-                elif (len(l) == 4):
-                    # Four elements, so third is name and 4th is comment
-                        cfg['name'] = l[2]
-                        cfg['comment'] = l[3][1:]
-                opt = {}
-
-            #
-            # Options
-            #
-            elif(l[0] == 'option'):
-                opt[l[1]] = l[2]
-
-            #
-            # List
-            #
-            elif(l[0] == 'list'):
-                # Make sure the key exists and is a list.
-                if l[1] not in opt:
-                    opt[l[1]] = []
-                elif not isinstance(opt[l[1]], list):
-                    # One line started with "option", another with "list".  If
-                    # this is supposed to be a list, they should all start with
-                    # "list".
-                    raise Exception("Malformed UCI: mixed list/option lines")
-
-                opt[l[1]].append(l[2])
-
-        else:
-            # Also at the end of the loop, save the final config we were making
-            # Make sure cfg,opt aren't None
-            if(None not in (cfg, opt)):
-                data.append((cfg, opt))
-
-        return data
+        return list(iterConfigFile(self.filepath))
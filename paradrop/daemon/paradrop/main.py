@@ -13,6 +13,7 @@ from paradrop.base import nexus, settings
 from paradrop.lib.misc.procmon import ProcessMonitor
 from paradrop.core.agent.reporting import sendStateReport
 from paradrop.core.agent.wamp_session import WampSession
+from paradrop.core.container.chutecontainer import startEventWatcher
 from paradrop.core.update.update_fetcher import UpdateFetcher
 from paradrop.core.update.update_manager import UpdateManager
 from paradrop.airshark.airshark import AirsharkManager
@@ -80,6 +81,9 @@ def main():
     # Start the configuration service as a thread
     confd.main.run_thread(execute=args.execute)
 
+    # Keep cached container information up to date with Docker events.
+    startEventWatcher()
+
     airshark_manager = AirsharkManager()
 
     # Globally assign the nexus object so anyone else can access it.
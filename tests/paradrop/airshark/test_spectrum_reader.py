@@ -0,0 +1,110 @@
+import io
+import struct
+
+from mock import MagicMock
+from nose.tools import assert_raises
+
+from paradrop.airshark.analyzer import AnalyzerProcessProtocol
+from paradrop.airshark.spectrum_reader import SampleRing, SpectrumReader, SpectrumFrames
+
+
+def make_packet(tsf, freq, samples):
+    data = struct.pack(">BHBHbbHBBQ", 1, SpectrumReader.pktsize, 2, freq,
+                       -40, -95, 100, 10, 5, tsf)
+    return data + str(bytearray(samples))
+
+
+def test_encode_frame():
+    data = make_packet(1000, 2412, range(56)) + \
+        make_packet(2000, 2437, [10] * 56) + "\x01\x00"
+
+    headers = list(SpectrumReader.decode_headers(data))
+    assert len(headers) == 2
+    assert headers[0][1:] == (2, 2412, -40, -95, 1000)
+    assert len(list(SpectrumReader.decode(data))) == 2
+
+    frame = SpectrumReader.encode_frame(data)
+    version, bins, count = SpectrumReader.frame_header.unpack_from(frame)
+    assert (version, bins, count) == (1, 56, 2)
+    size = SpectrumReader.frame_header.size + 2 * (SpectrumReader.frame_packet.size + 56)
+    assert len(frame) == size
+
+    frame = SpectrumReader.encode_frame(data, bins=14)
+    pos = SpectrumReader.frame_header.size
+    assert SpectrumReader.frame_packet.unpack_from(frame, pos) == (1000, 2412, -40, -95, 2)
+    pos += SpectrumReader.frame_packet.size
+    assert list(bytearray(frame[pos:pos + 14])) == [4 * i + 1 for i in range(14)]
+
+    assert_raises(ValueError, SpectrumReader.encode_frame, data, 10)
+
+    # A malformed header ends decoding.
+    assert SpectrumReader.encode_frame("\x02" + data[1:]) == \
+        SpectrumReader.frame_header.pack(1, 56, 0)
+
+
+def test_SpectrumFrames():
+    data = make_packet(1000, 2412, range(56))
+    frames = SpectrumFrames(data)
+    assert frames.raw is data
+    assert frames.encode(8) is frames.encode(8)
+
+
+def test_SampleRing():
+    ring = SampleRing(10, align=2)
+
+    source = io.BytesIO("abcdef")
+    assert ring.fill(source.readinto) == 6
+    assert ring.read(0) == ("abcdef", 6, 0)
+    assert ring.read(2, limit=2) == ("cd", 4, 0)
+
+    # Wrap around the end of the buffer.
+    source = io.BytesIO("ghijkl")
+    assert ring.fill(source.readinto) == 6
+    assert (ring.previous_end, ring.end) == (6, 12)
+    assert ring.read(ring.previous_end) == ("ghijkl", 12, 0)
+
+    # A consumer that fell behind skips to a packet boundary.
+    assert ring.start() == 2
+    assert ring.read(0) == ("cdefghijkl", 12, 2)
+
+    source = io.BytesIO("mno")
+    ring.fill(source.readinto)
+    assert ring.read(0) == ("ghijklmno", 15, 6)
+
+    # One call reads at most a ring's worth of data.
+    source = io.BytesIO("x" * 25)
+    assert ring.fill(source.readinto) == 10
+    assert ring.fill(source.readinto) == 10
+
+
+def test_AnalyzerProcessProtocol():
+    ring = SampleRing(8)
+    analyzer = AnalyzerProcessProtocol(MagicMock())
+    analyzer.makeConnection(MagicMock())
+    writeToChild = analyzer.transport.writeToChild
+    analyzer.transport.pipes[3].registerProducer.assert_called_once_with(analyzer, True)
+
+    ring.fill(io.BytesIO("abc").readinto)
+    analyzer.feedSpectrumData(ring)
+    writeToChild.assert_called_once_with(3, "abc")
+
+    # Nothing is written while the pipe is full.
+    analyzer.pauseProducing()
+    ring.fill(io.BytesIO("defgh").readinto)
+    analyzer.feedSpectrumData(ring)
+    ring.fill(io.BytesIO("ijk").readinto)
+    analyzer.feedSpectrumData(ring)
+    assert writeToChild.call_count == 1
+
+    analyzer.resumeProducing()
+    writeToChild.assert_called_with(3, "defghijk")
+    assert analyzer.dropped == 0
+
+    # Data overwritten while paused is counted.
+    analyzer.pauseProducing()
+    source = io.BytesIO("lmnopqrstu")
+    ring.fill(source.readinto)
+    ring.fill(source.readinto)
+    analyzer.resumeProducing()
+    writeToChild.assert_called_with(3, "nopqrstu")
+    assert analyzer.dropped == 2
@@ -118,3 +118,32 @@ def test_change_password(mExists, mWrite):
     passwordManager.reset()
     assert passwordManager.verify_password(passwordManager.DEFAULT_USER_NAME,
             passwordManager.DEFAULT_PASSWORD)
+
+@patch('paradrop.lib.utils.pdos.write')
+@patch('paradrop.lib.utils.pdos.exists')
+def test_verify_password_cache(mExists, mWrite):
+    import crypt
+    mExists.return_value = False
+    passwordManager = password_manager.PasswordManager()
+    assert passwordManager.add_user('hello', 'password!!')
+
+    with patch.object(password_manager.crypt, 'crypt', wraps=crypt.crypt) as mCrypt:
+        mCrypt.reset_mock()
+        assert passwordManager.verify_password('hello', 'password!!')
+        assert passwordManager.verify_password('hello', 'password!!')
+        assert mCrypt.call_count == 1
+
+        # Failed attempts are never cached.
+        assert not passwordManager.verify_password('hello', 'wrong')
+        assert not passwordManager.verify_password('hello', 'wrong')
+        assert mCrypt.call_count == 3
+
+        # Changing the password forgets cached credentials.
+        assert passwordManager.change_password('hello', 'heihei')
+        assert not passwordManager.verify_password('hello', 'password!!')
+
+        with patch.object(settings, 'LOCAL_AUTH_CACHE_TTL', 0):
+            mCrypt.reset_mock()
+            assert passwordManager.verify_password('hello', 'heihei')
+            assert passwordManager.verify_password('hello', 'heihei')
+            assert mCrypt.call_count == 2
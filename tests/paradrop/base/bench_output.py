@@ -0,0 +1,138 @@
+"""
+Benchmark for emitting log messages through paradrop.base.output.
+
+This is not collected as a unit test.  Run it from the top of the repository:
+
+    python -m tests.paradrop.base.bench_output [records]
+"""
+from __future__ import print_function
+
+import Queue
+import sys
+import time
+
+import smokesignal
+
+from paradrop.base import output
+
+
+def legacySilentLogPrefix(stepsUp):
+    """
+    Caller lookup from the previous output module (for comparison).
+    """
+    try:
+        trace = sys._getframe(stepsUp).f_code.co_filename
+        line = sys._getframe(stepsUp).f_lineno
+        module, package = output.parseLogPrefix(trace)
+    except:
+        return 'unknown', 'unknown', '??'
+
+    return package, module, line
+
+
+class LegacyBaseOutput(output.BaseOutput):
+    def __call__(self, args, logPrefixLevel=3, **extra):
+        package, module, line = legacySilentLogPrefix(3)
+
+        if args[-1] == '\n':
+            args = args.strip()
+
+        return {
+            'message': str(args),
+            'type': self.type['name'],
+            'extra': extra,
+            'package': package,
+            'module': module,
+            'timestamp': time.time(),
+            'pdid': 'UNSET',
+            'line': line
+        }
+
+
+class LegacyOutput(output.Output):
+    """
+    Output with the previous handlePrint, which always formatted the console
+    message and emitted each record synchronously.
+    """
+    def __setattr__(self, name, val):
+        def inner(*args, **kwargs):
+            result = val(*args, **kwargs)
+            self.handlePrint(result)
+            return result
+
+        self.__dict__[name] = inner
+        self.__dict__['outputMappings'][name] = val
+
+    def handlePrint(self, logDict):
+        if logDict is None:
+            return
+
+        if self.queue is not None:
+            self.queue.put(logDict)
+
+        res = self.messageToString(logDict)
+
+        if self.printLogs or logDict['type'] == 'ERR':
+            self.redirectOut.trueWrite(res)
+
+        smokesignal.emit('logs', logDict)
+
+
+def makeOutput(cls, baseCls):
+    log = cls(
+        info=baseCls(output.LOG_TYPES[output.Level.INFO]),
+        verbose=baseCls(output.LOG_TYPES[output.Level.VERBOSE])
+    )
+    log.logToConsole(False)
+    log.__dict__['queue'] = Queue.Queue()
+    return log
+
+
+def onLog(*args):
+    pass
+
+
+def run(log, count, stream, drain):
+    emit = getattr(log, stream)
+    start = time.time()
+    for i in range(count):
+        emit("Executing plan step {}".format(i))
+
+        # Stand in for the reactor and the file writer thread.
+        if i % 100 == 0:
+            drain()
+    drain()
+    return count / (time.time() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    smokesignal.on('logs', onLog)
+    smokesignal.on('log_batch', onLog)
+
+    legacy = makeOutput(LegacyOutput, LegacyBaseOutput)
+    current = makeOutput(output.Output, output.BaseOutput)
+    current.setEnabled('verbose', False)
+
+    # Keep calls to the reactor from piling up while it is not running.
+    output.reactor.callFromThread = lambda f, *args: None
+
+    def drainer(log):
+        def drain():
+            log.queue.queue.clear()
+            if isinstance(log, LegacyOutput):
+                return
+            log.deliverLogs()
+        return drain
+
+    for name, log in [("legacy", legacy), ("current", current)]:
+        for stream in ["info", "verbose"]:
+            rate = run(log, count, stream, drainer(log))
+            state = "disabled" if stream in log.disabled else "enabled"
+            print("{:8} {:8} ({:8}) {:10.0f} records/s".format(
+                name, stream, state, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -71,6 +71,154 @@ def test_returnType():
         assert type(x) is dict
 
 
+def test_limit():
+    logs = output.out.getLogsSince(0, limit=2)
+    assert len(logs) == 2
+
+
+def test_index():
+    import tempfile
+    from mock import patch
+
+    path = tempfile.mkdtemp()
+    store = output.LogStore(path)
+
+    count = output.INDEX_INTERVAL * 4
+    for i in range(count):
+        level = output.Level.WARN if i % 2 else output.Level.INFO
+        store.write({'message': str(i), 'timestamp': 1000 + i,
+                     'type': level.value})
+    store.flush()
+
+    entries = output.readIndex(store.path)
+    assert len(entries) == 3
+
+    # Reading recent records does not parse the whole file.
+    target = 1000 + count - 10
+    with patch.object(output.json, 'loads', wraps=json.loads) as loads:
+        logs = list(output.readLogFile(store.path, target))
+        assert loads.call_count <= output.INDEX_INTERVAL
+    assert [x['message'] for x in logs] == [str(i) for i in range(count - 9, count)]
+
+    logs = output.readLogFile(store.path, target,
+                              types=set([output.Level.WARN.value]))
+    assert [x['message'] for x in logs] == [str(i) for i in range(count - 9, count, 2)]
+
+    # A new indexer picks up where the last one left off.
+    store.close()
+    store = output.LogStore(path)
+    assert store.indexer.offset == os.path.getsize(store.path)
+    assert store.indexer.latest == 1000 + count - 1
+
+    store.close()
+    shutil.rmtree(path)
+
+
+def test_rotation():
+    import itertools
+    import tempfile
+    from mock import patch
+    from paradrop.base import settings
+
+    path = tempfile.mkdtemp()
+
+    # Give each rotation a distinct name.
+    now = time.time()
+    counter = itertools.count()
+    strftime = time.strftime
+    def fakeStrftime(fmt, t):
+        return strftime(fmt, time.localtime(now + next(counter)))
+
+    with patch.object(settings, 'LOG_ROTATE_SIZE', 1000), \
+            patch.object(settings, 'LOG_COMPRESS', True), \
+            patch.object(settings, 'LOG_MAX_TOTAL_SIZE', 4000), \
+            patch.object(output.time, 'strftime', side_effect=fakeStrftime):
+        store = output.LogStore(path)
+        for i in range(200):
+            store.write({'message': 'message %d' % i, 'timestamp': now - 300 + i,
+                         'type': output.Level.INFO.value})
+        store.flush()
+
+        segments = output.listSegments(path)
+        assert len(segments) > 1
+        for end, segment in segments:
+            assert os.path.exists(segment + '.gz')
+            assert not os.path.exists(segment)
+
+        # Old segments were deleted to stay within the size limit.
+        total = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        assert total <= 4000
+
+        log = output.Output()
+        log.__dict__['logpath'] = path
+        records = log.getLogsSince(0)
+        messages = [x['message'] for x in records]
+        assert messages[-1] == 'message 199'
+        assert messages == ['message %d' % i for i in range(200 - len(messages), 200)]
+
+        # Compressed segments are read with the index as well.
+        records = log.getLogsSince(now - 300 + 180)
+        assert [x['message'] for x in records] == \
+            ['message %d' % i for i in range(181, 200)]
+
+        store.close()
+
+    shutil.rmtree(path)
+
+
+def test_setEnabled():
+    from mock import patch
+
+    log = output.Output(info=output.BaseOutput(output.LOG_TYPES[output.Level.INFO]))
+    log.logToConsole(False)
+
+    with patch.object(output, 'silentLogPrefix') as silentLogPrefix:
+        silentLogPrefix.return_value = ('package', 'module', 1)
+        assert log.info('test')['message'] == 'test'
+
+        log.setEnabled('info', False)
+        silentLogPrefix.reset_mock()
+        assert log.info('test') is None
+        assert not silentLogPrefix.called
+
+        log.setEnabled('info', True)
+        assert log.info('test') is not None
+
+
+def test_deliverLogs():
+    import smokesignal
+    from mock import patch
+
+    log = output.Output(info=output.BaseOutput(output.LOG_TYPES[output.Level.INFO]))
+    log.logToConsole(False)
+
+    # Nothing is queued while nobody is listening.
+    with patch.object(output.reactor, 'callFromThread') as callFromThread:
+        log.info('A')
+        assert not callFromThread.called
+
+    batches = []
+    def onBatch(batch):
+        batches.append(batch)
+
+    smokesignal.on('log_batch', onBatch)
+    try:
+        with patch.object(output.reactor, 'callFromThread') as callFromThread:
+            log.info('B')
+            log.info('C')
+            callFromThread.assert_called_once_with(log.deliverLogs)
+
+        log.deliverLogs()
+        assert len(batches) == 1
+        assert [x['message'] for x in batches[0]] == ['B', 'C']
+
+        # Delivering an empty batch does nothing.
+        log.deliverLogs()
+        assert len(batches) == 1
+    finally:
+        smokesignal.disconnect(onBatch)
+
+
 ###############################################################################
 # Random inline testing
 ###############################################################################
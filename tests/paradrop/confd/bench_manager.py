@@ -0,0 +1,93 @@
+"""
+Benchmark for reloading a large confd configuration.
+
+This is not collected as a unit test.  Run it from the top of the repository:
+
+    python -m tests.paradrop.confd.bench_manager [sections]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from paradrop.confd.manager import ConfigManager
+
+
+RULE = """config rule
+    option src_ip '10.{}.{}.0/24'
+    option dest_port '{}'
+    option proto 'tcp'
+    option target 'ACCEPT'
+
+"""
+
+
+def linearFindMatchingConfig(self, config, byName=False):
+    """
+    Section lookup by scanning the current configuration (for comparison).
+    """
+    key = config.getTypeAndName()
+
+    if key in self.currentConfig:
+        oldConfig = self.currentConfig[key]
+        if byName:
+            return oldConfig
+        if config.optionsMatch(oldConfig):
+            return oldConfig
+
+    for oldConfig in self.currentConfig.values():
+        if config.optionsMatch(oldConfig):
+            return oldConfig
+
+    return None
+
+
+def writeRules(path, count):
+    with open(path, "w") as output:
+        for i in range(count):
+            output.write(RULE.format(i // 256, i % 256, 1024 + i))
+
+
+def timeReload(path, linear=False):
+    manager = ConfigManager(writeDir=os.path.dirname(path))
+    if linear:
+        manager.findMatchingConfig = \
+                linearFindMatchingConfig.__get__(manager, ConfigManager)
+
+    start = time.time()
+    manager.loadConfig(search=path, execute=False)
+    initial = time.time() - start
+
+    # Change the file so that it is parsed again.  Rules are anonymous
+    # sections, so every section has to be matched by its content.
+    with open(path, "a") as output:
+        output.write(RULE.format(255, 255, 1))
+
+    start = time.time()
+    manager.loadConfig(search=path, execute=False)
+    repeat = time.time() - start
+
+    return initial, repeat
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+    temp = tempfile.mkdtemp()
+    path = os.path.join(temp, "firewall")
+
+    try:
+        for name, linear in [("indexed", False), ("linear scan", True)]:
+            writeRules(path, count)
+            initial, repeat = timeReload(path, linear=linear)
+            print("{:12} {} sections: initial load {:.3f}s, reload {:.3f}s"
+                  .format(name, count, initial, repeat))
+    finally:
+        shutil.rmtree(temp)
+
+
+if __name__ == "__main__":
+    main()
@@ -82,3 +82,160 @@ def test_KillCommand(execute):
     
     command.execute()
     assert not execute.called
+
+
+def test_batchIptablesCommands():
+    """
+    Test grouping iptables commands into restore transactions
+    """
+    from paradrop.confd.command import (Command, CommandList,
+            IptablesRestoreCommand, batchIptablesCommands)
+
+    def iptables(binary, table, rule):
+        return Command([binary, "--wait", "5", "--table", table] + rule.split())
+
+    clist = CommandList()
+    clist.append(35, iptables("iptables", "filter", "--new chain1"))
+    clist.append(35, iptables("ip6tables", "filter", "--new chain1"))
+    clist.append(35, iptables("iptables", "filter", "--append INPUT --jump chain1"))
+    clist.append(35, iptables("iptables", "nat", "--new chain2"))
+    clist.append(37, iptables("iptables", "filter", "--append chain1 --jump ACCEPT"))
+    clist.append(37, Command(["ip", "link", "set", "dev", "eth0", "up"]))
+    clist.append(37, iptables("iptables", "filter", "--append chain1 --jump DROP"))
+    clist.append(37, iptables("iptables", "filter", "--append chain1 --jump REJECT"))
+
+    result = list(batchIptablesCommands(clist).prioritized())
+    assert len(result) == 6
+
+    prio, batch = result[0]
+    assert prio == 35
+    assert isinstance(batch, IptablesRestoreCommand)
+    assert batch.command == ["iptables-restore", "--noflush"]
+    assert batch.getInput() == ("*filter\n"
+                                "--new chain1\n"
+                                "--append INPUT --jump chain1\n"
+                                "COMMIT\n")
+
+    # Single commands are left alone.
+    assert result[1][1] is clist[1][1]
+    assert result[2][1] is clist[3][1]
+    assert result[3][1] is clist[4][1]
+    assert result[4][1] is clist[5][1]
+
+    prio, batch = result[5]
+    assert prio == 37
+    assert isinstance(batch, IptablesRestoreCommand)
+    assert "DROP" in batch and "REJECT" in batch
+
+
+@patch("paradrop.confd.command.out")
+@patch("subprocess.Popen")
+def test_IptablesRestoreCommand(Popen, out):
+    """
+    Test the IptablesRestoreCommand class
+    """
+    from paradrop.confd.command import Command, IptablesRestoreCommand
+
+    parent = MagicMock()
+    parent.executed = []
+
+    commands = [
+        Command(["iptables", "--wait", "5", "--table", "filter", "--append",
+                 "INPUT", "--match", "comment", "--comment", "a b"], parent),
+        Command(["iptables", "--wait", "5", "--table", "filter", "--append",
+                 "INPUT", "--jump", "ACCEPT"], parent)
+    ]
+    batch = IptablesRestoreCommand("iptables", "filter", commands)
+    assert '--comment "a b"' in batch.getInput()
+
+    proc = MagicMock()
+    proc.communicate.return_value = ("", "")
+    proc.returncode = 0
+    Popen.return_value = proc
+
+    assert batch.execute()
+    assert Popen.call_count == 1
+    assert batch.success()
+    assert all(cmd.success() for cmd in commands)
+    assert parent.executed == commands
+
+    # If the transaction fails, the commands run one at a time.
+    parent.executed = []
+    Popen.reset_mock()
+    proc.returncode = 1
+    batch.execute()
+    assert Popen.call_count == 3
+    assert not batch.success()
+    assert parent.executed == commands
+    assert all(cmd.duration is not None for cmd in commands)
+
+
+def test_getCommandLanes():
+    """
+    Test dividing commands into lanes
+    """
+    from paradrop.confd.command import (Command, IptablesRestoreCommand,
+            getCommandLanes)
+
+    parents = []
+    for name in ["a", "b", "c"]:
+        parent = MagicMock()
+        parent.getTypeAndName.return_value = ("firewall", "zone", name)
+        parents.append(parent)
+
+    a1 = Command(["ip", "link", "set", "a", "up"], parents[0])
+    b1 = Command(["ip", "link", "set", "b", "up"], parents[1])
+    a2 = Command(["iptables", "-A", "INPUT", "-i", "a"], parents[0])
+    c1 = Command(["ip6tables", "-A", "INPUT", "-i", "c"], parents[2])
+    batch = IptablesRestoreCommand("iptables", "filter", [
+        Command(["iptables", "-A", "INPUT", "-i", "b"], parents[1])
+    ])
+
+    # A section's commands stay in one lane, iptables commands for the same
+    # table are ordered, and independent commands run concurrently.
+    lanes = getCommandLanes([a1, b1, a2, c1, batch])
+    assert lanes == [[c1], [b1, a1, a2, batch]]
+
+
+def test_ParallelExecutor():
+    """
+    Test the ParallelExecutor class
+    """
+    import threading
+    from paradrop.confd.command import (CommandList, FunctionCommand,
+            ParallelExecutor)
+
+    parents = []
+    for name in ["wlan0", "wlan1"]:
+        parent = MagicMock()
+        parent.getTypeAndName.return_value = ("network", "interface", name)
+        parents.append(parent)
+
+    ready = threading.Event()
+    events = []
+
+    def first():
+        # This only succeeds if second runs concurrently with us.
+        events.append(("first", ready.wait(5)))
+
+    def second():
+        ready.set()
+        events.append(("second", True))
+
+    def last():
+        events.append(("last", len(events) == 3))
+
+    clist = CommandList()
+    clist.append(20, FunctionCommand(parents[0], first))
+    clist.append(20, FunctionCommand(parents[1], second))
+    clist.append(20, FunctionCommand(parents[1], second))
+    clist.append(30, FunctionCommand(parents[0], last))
+
+    executor = ParallelExecutor(2)
+    executor.execute(clist)
+
+    assert len(events) == 4
+    assert all(passed for name, passed in events)
+    assert events[-1][0] == "last"
+    for prio, cmd in clist:
+        assert cmd.duration is not None and cmd.duration >= 0
@@ -362,7 +362,8 @@ def test_config_manager():
     config = Mock()
     config.getTypeAndName = Mock(return_value=("interface", "wan"))
     config.optionsMatch = Mock(return_value=True)
-    
+    config.getContentKey = Mock(return_value=obj.getContentKey())
+
     assert manager.findMatchingConfig(config, byName=False) is not None
     assert manager.findMatchingConfig(config, byName=True) is not None
 
@@ -370,6 +371,7 @@ def test_config_manager():
     config = Mock()
     config.getTypeAndName = Mock(return_value=("interface", "wan"))
     config.optionsMatch = Mock(return_value=False)
+    config.getContentKey = Mock(return_value=("interface", "other"))
 
     assert manager.findMatchingConfig(config, byName=False) is None
     assert manager.findMatchingConfig(config, byName=True) is not None
@@ -378,7 +380,8 @@ def test_config_manager():
     config = Mock()
     config.getTypeAndName = Mock(return_value=("interface", "wan2"))
     config.optionsMatch = Mock(return_value=True)
-    
+    config.getContentKey = Mock(return_value=obj.getContentKey())
+
     assert manager.findMatchingConfig(config, byName=False) is not None
     assert manager.findMatchingConfig(config, byName=True) is not None
 
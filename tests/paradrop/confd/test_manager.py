@@ -165,3 +165,102 @@ def test_manager_execute(execute):
             iwDev = i
         i += 1
     assert kill < addrDel and addrDel < iwDev
+
+
+def test_content_index():
+    """
+    Test that reloads match anonymous sections through the content index
+    """
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    confFile = os.path.join(temp, "firewall")
+
+    rule = "config rule\n\toption dest_port '{}'\n\toption proto 'tcp'\n" \
+           "\toption target 'ACCEPT'\n\n"
+
+    with open(confFile, "w") as output:
+        for port in range(10):
+            output.write(rule.format(8000 + port))
+
+    manager = ConfigManager(writeDir="/tmp")
+    manager.loadConfig(search=confFile, execute=False)
+    assert len(manager.currentConfig) == 10
+    assert len(manager.contentIndex) == 10
+
+    # Reloading identical content should not generate any commands.
+    manager.loadConfig(search=confFile, execute=False)
+    assert len(list(manager.previousCommands.commands())) == 0
+    assert len(manager.currentConfig) == 10
+
+    # Change one rule and remove another.
+    with open(confFile, "w") as output:
+        for port in range(8):
+            output.write(rule.format(9000 if port == 0 else 8000 + port))
+
+    manager.loadConfig(search=confFile, execute=False)
+    assert len(manager.currentConfig) == 8
+    assert len(manager.contentIndex) == 8
+    assert len(manager.contentKeys) == 8
+    for config in manager.currentConfig.values():
+        matches = manager.contentIndex[config.getContentKey()]
+        assert config in matches
+
+    manager.unload(execute=False)
+    assert len(manager.contentIndex) == 0
+
+    shutil.rmtree(temp)
+
+
+def test_dirty_files():
+    """
+    Test that reloads only parse configuration files that changed
+    """
+    from paradrop.confd.manager import ConfigManager
+
+    temp = tempfile.mkdtemp()
+    firewall = os.path.join(temp, "firewall")
+    network = os.path.join(temp, "network")
+
+    with open(firewall, "w") as output:
+        output.write("config rule\n\toption target 'ACCEPT'\n")
+    with open(network, "w") as output:
+        output.write("config interface lan\n\toption proto 'dhcp'\n"
+                     "\tlist ifname 'eth1'\n")
+
+    # Make the files look old so that the stat fields are trusted.
+    for path in [firewall, network]:
+        os.utime(path, (1000000000, 1000000000))
+
+    manager = ConfigManager(writeDir="/tmp")
+    manager.loadConfig(search=temp, execute=False)
+    assert len(manager.currentConfig) == 2
+
+    with patch.object(manager, "readConfig", wraps=manager.readConfig) as readConfig:
+        manager.loadConfig(search=temp, execute=False)
+        readConfig.assert_called_once_with([])
+        assert len(manager.currentConfig) == 2
+
+        # Rewriting a file with the same content changes its stat fields, but
+        # the content digest still matches.
+        with open(firewall, "w") as output:
+            output.write("config rule\n\toption target 'ACCEPT'\n")
+        readConfig.reset_mock()
+        manager.loadConfig(search=temp, execute=False)
+        readConfig.assert_called_once_with([])
+
+        with open(firewall, "w") as output:
+            output.write("config rule\n\toption target 'DROP'\n")
+        readConfig.reset_mock()
+        manager.loadConfig(search=temp, execute=False)
+        readConfig.assert_called_once_with([firewall])
+
+    # The unchanged section from the network file is still present.
+    assert len(manager.currentConfig) == 2
+    assert "DROP" in manager.previousCommands
+    assert "lan" not in manager.previousCommands
+
+    manager.unload(execute=False)
+    assert len(manager.fileFingerprints) == 0
+
+    shutil.rmtree(temp)
@@ -0,0 +1,88 @@
+"""
+Benchmark for persisting chute storage in snapshot and journal modes.
+
+This is not collected as a unit test.  Run it from the top of the repository:
+
+    python -m tests.paradrop.core.chute.bench_chutestorage [chutes] [changes]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from paradrop.base import settings
+from paradrop.core.chute.chute import Chute
+from paradrop.core.chute.chute_storage import ChuteStorage
+from paradrop.lib.utils.pd_storage import PDStorage
+
+
+def makeChute(i, version=1):
+    chute = Chute(name="chute{}".format(i), version=version,
+                  description="Benchmark chute number {}".format(i))
+    chute.config = {
+        "net": {
+            "wifi": {
+                "type": "wifi",
+                "intfName": "wlan0",
+                "ssid": "Chute {}".format(i),
+                "key": "password{}".format(i)
+            }
+        }
+    }
+    chute.environment = {"VAR{}".format(j): str(j) for j in range(10)}
+    chute.setCache("networkInterfaces", [{"name": "wifi", "ipaddr":
+        "10.{}.{}.1".format(i // 256, i % 256)}])
+    return chute
+
+
+def openStorage(filename, journal):
+    settings.FC_CHUTESTORAGE_JOURNAL = journal
+    settings.FC_CHUTESTORAGE_JOURNAL_LIMIT = sys.maxsize
+    settings.FC_CHUTESTORAGE_YAML_MIRROR = False
+    ChuteStorage.chuteList = {}
+    PDStorage.savedDigests.clear()
+    PDStorage.journals.clear()
+    return ChuteStorage(filename=filename, save_timer=0)
+
+
+def run(filename, count, changes, journal):
+    storage = openStorage(filename, journal)
+    for i in range(count):
+        ChuteStorage.chuteList[makeChute(i).name] = makeChute(i)
+    storage.saveToDisk()
+
+    start = time.time()
+    for i in range(changes):
+        storage.saveChute(makeChute(i % count, version=2))
+    updates = time.time() - start
+
+    storage = openStorage(filename, journal)
+    start = time.time()
+    storage.loadFromDisk()
+    startup = time.time() - start
+
+    assert len(ChuteStorage.chuteList) == count
+    return updates, startup
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    changes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    temp = tempfile.mkdtemp()
+    try:
+        print("{} chutes, {} changes".format(count, changes))
+        for name, journal in [("snapshot", False), ("journal", True)]:
+            filename = os.path.join(temp, name)
+            updates, startup = run(filename, count, changes, journal)
+            print("{:9} updates {:.3f}s ({:.2f} ms each), startup {:.3f}s"
+                  .format(name, updates, 1000 * updates / changes, startup))
+    finally:
+        shutil.rmtree(temp)
+
+
+if __name__ == "__main__":
+    main()
@@ -59,3 +59,68 @@ def test_chute_storage(mSave):
     
 
     #TODO: Finish Tests
+
+
+def test_chute_storage_journal():
+    import os
+    import tempfile
+    from paradrop.lib.utils import pdos
+
+    temp = tempfile.mkdtemp()
+    filename = os.path.join(temp, "chutes")
+
+    with patch.object(settings, "FC_CHUTESTORAGE_JOURNAL", True), \
+            patch.object(settings, "FC_CHUTESTORAGE_JOURNAL_LIMIT", 3), \
+            patch.object(chute_storage.ChuteStorage, "chuteList", {}):
+        s = chute_storage.ChuteStorage(filename=filename)
+
+        # Changes go to the journal instead of the snapshot.
+        for name in ["a", "b"]:
+            ch = Chute({})
+            ch.name = name
+            s.saveChute(ch)
+        assert not os.path.exists(filename)
+        assert s.journal.count == 2
+
+        # Reaching the limit folds the journal into a snapshot.
+        s.deleteChute("a")
+        assert os.path.exists(filename)
+        assert s.journal.count == 0
+
+        ch = Chute({})
+        ch.name = "c"
+        s.saveChute(ch)
+
+        # Reload from the snapshot plus journal.
+        chute_storage.ChuteStorage.chuteList = {}
+        s.loadFromDisk()
+        assert sorted(s.chuteList.keys()) == ["b", "c"]
+
+    pdos.remove(temp)
+    chute_storage.PDStorage.journals.clear()
+
+
+def test_chute_storage_tokens():
+    with patch.object(chute_storage.ChuteStorage, "chuteList", {}), \
+            patch.object(chute_storage.ChuteStorage, "chuteTokens", None), \
+            patch.object(chute_storage.ChuteStorage, "recordChange"):
+        s = chute_storage.ChuteStorage(filename="/tmp/unused")
+
+        ch = Chute({})
+        ch.name = "a"
+        ch.setCache("apiToken", "token-a")
+        s.saveChute(ch)
+
+        assert s.lookupToken("token-a") == "a"
+        assert s.lookupToken("token-b") is None
+
+        # The index is maintained as chutes change.
+        ch = Chute({})
+        ch.name = "a"
+        ch.setCache("apiToken", "token-b")
+        s.saveChute(ch)
+        assert s.lookupToken("token-a") is None
+        assert s.lookupToken("token-b") == "a"
+
+        s.deleteChute("a")
+        assert s.lookupToken("token-b") is None
@@ -152,6 +152,57 @@ def test_configservice():
     assert_raises(Exception, configservice.reloadAll, update)
 
 
+@patch("paradrop.confd.client.reloadAll")
+def test_configservice_batch(reloadAll):
+    """
+    Test that concurrent updates share one configuration reload
+    """
+    import threading
+    import time
+    from paradrop.core.config import configservice
+    from paradrop.core.plan import executionplan
+
+    status = json.loads(mockStatusStringBad())
+    for section in status:
+        section['age'] = 0
+    reloadAll.return_value = json.dumps(status)
+
+    lock = executionplan.sharedStateLock
+    errors = {}
+
+    def run(name, holding):
+        update = UpdateObject({'name': name})
+        lock.acquire()
+        holding.set()
+
+        # Wait until the other update is waiting for the lock.
+        while lock.nextTicket - lock.serving < 2:
+            time.sleep(0.001)
+
+        try:
+            configservice.reloadAll(update)
+        except Exception as error:
+            errors[name] = error
+        finally:
+            lock.release()
+
+    holding = threading.Event()
+    bad = threading.Thread(target=run, args=("BadChute", holding))
+    bad.start()
+    holding.wait(1)
+
+    # The second update writes its configuration while the first one waits,
+    # and its reload serves both of them.
+    good = threading.Thread(target=run, args=("GoodChute", threading.Event()))
+    good.start()
+    bad.join(1)
+    good.join(1)
+
+    assert reloadAll.call_count == 1
+    assert list(errors) == ["BadChute"]
+    assert not lock.locked()
+
+
 @patch("paradrop.lib.utils.pdos.readFile", new=mockReadFile)
 @patch("paradrop.lib.utils.pdos.exists", new=mockExists)
 @patch("paradrop.lib.utils.pdos.listdir", new=mockListDir)
@@ -579,3 +630,62 @@ def test_config_wifi():
     pdos.remove(settings.UCI_CONFIG_DIR)
     pdos.remove(settings.UCI_BACKUP_DIR)
 
+
+
+@patch("paradrop.confd.client.reloadAll")
+def test_configservice_queue_batch(reloadAll):
+    """
+    Test that queued updates wait for one configuration reload
+    """
+    from twisted.internet.defer import Deferred
+    from paradrop.core.config import configservice
+
+    status = json.loads(mockStatusStringBad())
+    for section in status:
+        section['age'] = 0
+    reloadAll.return_value = json.dumps(status)
+
+    updates = []
+    for name in ["GoodChute", "BadChute"]:
+        update = UpdateObject({'name': name})
+        update.batchReload = True
+        assert isinstance(configservice.reloadAll(update), Deferred)
+        updates.append(update)
+    assert reloadAll.call_count == 0
+
+    # One reload resumes both updates, and each one checks its own status.
+    configservice.flushReloads()
+    assert reloadAll.call_count == 1
+    assert configservice.reloadWaiters == []
+
+    func, args = updates[0].plans.getNextTodo()
+    assert func is configservice.checkBatchReload
+    func(updates[0])
+    assert_raises(Exception, configservice.checkBatchReload, updates[1])
+
+    # Nothing to do when no updates are waiting.
+    configservice.flushReloads()
+    assert reloadAll.call_count == 1
+
+    # A failed reload resumes the waiting update, which then fails.
+    reloadAll.side_effect = Exception("reload failed")
+    update = UpdateObject({'name': "GoodChute"})
+    update.batchReload = True
+    configservice.reloadAll(update)
+    configservice.flushReloads()
+    assert configservice.reloadWaiters == []
+    assert_raises(Exception, configservice.checkBatchReload, update)
+
+
+@patch("paradrop.confd.client.reloadAll", mockStatusStringGood)
+def test_configservice_abort():
+    """
+    Test that the abort reload does not wait for other updates
+    """
+    from paradrop.core.config import configservice
+
+    update = UpdateObject({'name': 'test'})
+    with patch("paradrop.core.plan.executionplan.sharedStateLock") as lock:
+        configservice.reloadAllAbort(update)
+        assert not lock.yieldToWaiters.called
+    assert configservice.reloadStatus == mockStatusStringGood()
@@ -319,3 +319,34 @@ def test_getOSNetworkConfig(settings):
     settings.ALLOW_MONITOR_MODE = True
     network.getOSNetworkConfig(update)
     assert update.cache_set.called_once
+
+
+def test_chooseSubnet():
+    from paradrop.core.config.reservations import SubnetReservationSet
+
+    update = UpdateObject({'name': 'test'})
+    update.cache_set('hostConfig', {
+        'system': {
+            'chuteSubnetPool': '10.128.0.0/9',
+            'chutePrefixSize': 24
+        }
+    })
+
+    reservations = SubnetReservationSet()
+    reservations.add(ipaddress.ip_network(u'10.128.0.0/23'))
+    update.cache_set('subnetReservations', reservations)
+
+    subnet = network.chooseSubnet(update, {}, {})
+    assert subnet == ipaddress.ip_network(u'10.128.2.0/24')
+    assert subnet in reservations
+
+    subnet = network.chooseSubnet(update, {}, {})
+    assert subnet == ipaddress.ip_network(u'10.128.3.0/24')
+
+    # Requested networks must not overlap a reservation.
+    cfg = {'ipv4_network': '10.128.3.128/25'}
+    assert_raises(Exception, network.chooseSubnet, update, cfg, {})
+
+    cfg = {'ipv4_network': '192.168.1.0/24'}
+    subnet = network.chooseSubnet(update, cfg, {})
+    assert subnet in reservations
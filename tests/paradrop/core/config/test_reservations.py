@@ -19,6 +19,7 @@ def test_getDeviceReservations(ChuteStorage, prepareHostConfig, getWirelessPhyNa
     ChuteStorage.chuteList = {
         'chute1': chute1
     }
+    reservations.index.reset()
 
     # First test with no hostconfig interfaces.
     prepareHostConfig.return_value = {}
@@ -65,6 +66,7 @@ def test_getInterfaceReservations(ChuteStorage, prepareHostConfig, getWirelessPh
     ChuteStorage.chuteList = {
         'chute1': chute1
     }
+    reservations.index.reset()
 
     # First test with no hostconfig interfaces.
     prepareHostConfig.return_value = {}
@@ -106,6 +108,35 @@ def test_SubnetReservationSet():
     netB = ipaddress.ip_network(u'192.168.0.0/16')
     assert netB not in resv
 
+    # Adjacent and overlapping reservations are merged into one interval.
+    resv.add(ipaddress.ip_network(u'11.0.0.0/8'))
+    resv.add(ipaddress.ip_network(u'10.1.0.0/16'))
+    assert len(resv) == 3
+    assert resv.intervals[4][0] == [int(net.network_address)]
+
+    # IPv6 reservations are tracked separately.
+    assert ipaddress.ip_network(u'::a00:0/120') not in resv
+    resv.add(ipaddress.ip_network(u'fd00::/64'))
+    assert ipaddress.ip_network(u'fd00::1/128') in resv
+
+
+def test_SubnetReservationSet_findFree():
+    resv = reservations.SubnetReservationSet()
+    pool = ipaddress.ip_network(u'10.128.0.0/9')
+
+    assert resv.findFree(pool, 24) == ipaddress.ip_network(u'10.128.0.0/24')
+
+    resv.add(ipaddress.ip_network(u'10.128.0.0/24'))
+    resv.add(ipaddress.ip_network(u'10.128.1.0/25'))
+    resv.add(ipaddress.ip_network(u'10.128.3.0/24'))
+    assert resv.findFree(pool, 24) == ipaddress.ip_network(u'10.128.2.0/24')
+    assert resv.findFree(pool, 25) == ipaddress.ip_network(u'10.128.1.128/25')
+    assert resv.findFree(pool, 23) == ipaddress.ip_network(u'10.128.4.0/23')
+
+    # A reservation covering the whole pool leaves nothing free.
+    resv.add(ipaddress.ip_network(u'10.0.0.0/8'))
+    assert resv.findFree(pool, 24) is None
+
 
 @patch("paradrop.core.config.reservations.getWirelessPhyName")
 @patch("paradrop.core.config.reservations.prepareHostConfig")
@@ -123,9 +154,69 @@ def test_getSubnetReservations(ChuteStorage, prepareHostConfig, getWirelessPhyNa
     ChuteStorage.chuteList = {
         'chute1': chute1
     }
+    reservations.index.reset()
 
     # First test with no hostconfig interfaces.
     prepareHostConfig.return_value = {}
 
     resv = reservations.getSubnetReservations()
     assert len(resv) == 1
+
+
+@patch("paradrop.core.config.reservations.getWirelessPhyName")
+@patch("paradrop.core.config.reservations.prepareHostConfig")
+@patch("paradrop.core.config.reservations.ChuteStorage")
+def test_ReservationIndex(ChuteStorage, prepareHostConfig, getWirelessPhyName):
+    chute1 = MagicMock()
+    chute1.name = 'chute1'
+    chute1.getCache.return_value = [{
+        'device': 'wlan0',
+        'type': 'wifi',
+        'mode': 'ap',
+        'externalIntf': 'vwlan0.0000',
+        'subnet': ipaddress.ip_network(u'10.128.0.0/24')
+    }]
+
+    ChuteStorage.chuteList = {
+        'chute1': chute1
+    }
+    prepareHostConfig.return_value = {}
+
+    index = reservations.ReservationIndex()
+    subnet = ipaddress.ip_network(u'10.128.1.0/24')
+
+    # Resources allocated by an update that has not finished are visible to
+    # other updates.
+    subnets = reservations.getSubnetReservations('chute2', index=index)
+    assert len(subnets) == 1
+    subnets.add(subnet)
+    reservations.getInterfaceReservations('chute2', index=index).add('vwlan0.0001')
+    reservations.getDeviceReservations('chute2', index=index)['wlan0'].add(
+            'chute2', 'wifi', 'ap')
+
+    assert subnet in reservations.getSubnetReservations('chute3', index=index)
+    assert 'vwlan0.0001' in reservations.getInterfaceReservations('chute3', index=index)
+    assert reservations.getDeviceReservations('chute3', index=index)['wlan0'].count() == 2
+
+    # The update does not see its own resources.
+    assert subnet not in reservations.getSubnetReservations('chute2', index=index)
+
+    # Releasing the update drops its resources.
+    index.release('chute2')
+    assert subnet not in reservations.getSubnetReservations('chute3', index=index)
+    assert reservations.getDeviceReservations('chute3', index=index)['wlan0'].count() == 1
+
+    # Saving a chute replaces its resources with the saved ones.
+    reservations.getSubnetReservations('chute1', index=index).add(subnet)
+    chute1.getCache.return_value = []
+    index.chuteChanged('chute1')
+    assert len(reservations.getSubnetReservations('chute3', index=index)) == 0
+    assert 'vwlan0.0000' not in reservations.getInterfaceReservations('chute3', index=index)
+
+    # Deleting a chute removes it from the index.
+    chute1.getCache.return_value = [{'subnet': subnet, 'type': 'lan'}]
+    index.chuteChanged('chute1')
+    assert subnet in reservations.getSubnetReservations('chute3', index=index)
+    ChuteStorage.chuteList = {}
+    index.chuteChanged('chute1')
+    assert subnet not in reservations.getSubnetReservations('chute3', index=index)
@@ -38,3 +38,128 @@ def test_getters(inspect):
     assert_raises(Exception, container.getIP)
     assert_raises(Exception, container.getPID)
     assert container.isRunning() is False
+
+
+@patch("docker.APIClient")
+def test_inspect_cache(APIClient):
+    client = MagicMock()
+    client.inspect_container.return_value = {'State': {'Running': True}}
+    APIClient.return_value = client
+
+    chutecontainer.stateCaches.clear()
+
+    container = chutecontainer.ChuteContainer("test")
+    assert container.isRunning()
+    assert container.isRunning()
+
+    # The client is shared, and the second call used the cached result.
+    assert APIClient.call_count == 1
+    assert client.inspect_container.call_count == 1
+
+    chutecontainer.invalidateInspectCache("test")
+    assert container.isRunning()
+    assert client.inspect_container.call_count == 2
+
+    chutecontainer.stateCaches.clear()
+
+
+@patch("docker.APIClient")
+def test_ContainerStateCache(APIClient):
+    import docker
+
+    containers = {
+        'a': {'Id': '1', 'State': {'Running': True, 'Status': 'running'}},
+        'b': {'Id': '2', 'State': {'Running': True, 'Status': 'running'}}
+    }
+
+    def inspect_container(name):
+        if name in containers:
+            return containers[name]
+        raise docker.errors.NotFound("not found")
+
+    client = MagicMock()
+    client.containers.return_value = [{'Names': ['/a']}, {'Names': ['/b']}]
+    client.inspect_container.side_effect = inspect_container
+    APIClient.return_value = client
+
+    events = [
+        {'Type': 'container', 'Action': 'die',
+         'Actor': {'Attributes': {'name': 'a'}}},
+        {'Type': 'network', 'Action': 'connect',
+         'Actor': {'Attributes': {'container': '2'}}}
+    ]
+    client.events.return_value = events
+
+    cache = chutecontainer.ContainerStateCache()
+
+    listener = MagicMock()
+    cache.addListener(listener)
+
+    containers['a'] = {'Id': '1', 'State': {'Running': False, 'Status': 'exited'}}
+
+    # Stop after processing the event stream once.
+    with patch("paradrop.core.container.chutecontainer.time.sleep",
+               side_effect=KeyboardInterrupt()):
+        cache.live = True
+        assert_raises(KeyboardInterrupt, cache.run)
+
+    # Seeded containers plus one refresh per event.
+    assert client.inspect_container.call_args_list == \
+        [call('a'), call('b'), call('a'), call('b')]
+
+    # Listeners see each event with the container name.
+    assert listener.call_args_list == [call('a', events[0]), call('b', events[1])]
+    cache.removeListener(listener)
+
+    # While connected to the event stream, lookups do not call Docker.
+    cache.live = True
+    client.inspect_container.reset_mock()
+    assert cache.get('a')['State']['Status'] == 'exited'
+    assert client.inspect_container.call_count == 0
+
+    # Containers that are not in the table are looked up, e.g. one that was
+    # just created.
+    assert_raises(chutecontainer.ChuteNotFound, cache.get, 'c')
+    assert client.inspect_container.call_count == 1
+    containers['c'] = {'Id': '3', 'State': {'Running': True, 'Status': 'running'}}
+    assert cache.get('c')['State']['Status'] == 'running'
+    assert client.inspect_container.call_count == 2
+    client.inspect_container.reset_mock()
+
+    # Invalidated containers are inspected again.
+    del containers['b']
+    cache.invalidate('b')
+    assert_raises(chutecontainer.ChuteNotFound, cache.get, 'b')
+    assert client.inspect_container.call_count == 1
+    assert 'b' not in cache.containers
+
+
+@patch("paradrop.core.container.chutecontainer.out")
+@patch("paradrop.core.container.chutecontainer.resetClients")
+@patch("paradrop.core.container.chutecontainer.getAPIClient")
+def test_ContainerStateCache_reconnect(getAPIClient, resetClients, out):
+    import requests
+
+    client = MagicMock()
+    client.containers.return_value = []
+    client.events.side_effect = [
+        requests.exceptions.ConnectionError(),
+        requests.exceptions.ConnectionError(),
+        []
+    ]
+    getAPIClient.return_value = client
+
+    cache = chutecontainer.ContainerStateCache()
+    with patch("paradrop.core.container.chutecontainer.time.sleep",
+               side_effect=[None, None, KeyboardInterrupt()]) as sleep:
+        assert_raises(KeyboardInterrupt, cache.run)
+
+    # Losing the connection to Docker discards the shared clients.
+    assert resetClients.call_count == 2
+    assert not cache.live
+
+    # The delay backs off during the outage and resets after reconnecting,
+    # and the outage and recovery are each reported once.
+    assert sleep.call_args_list == [call(5), call(10), call(5)]
+    assert out.warn.call_count == 1
+    assert out.info.call_count == 1
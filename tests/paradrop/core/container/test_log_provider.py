@@ -4,28 +4,142 @@ from nose.tools import assert_raises
 from paradrop.core.container import log_provider
 
 
-@patch("paradrop.core.container.log_provider.docker.DockerClient")
-def test_monitor_logs(DockerClient):
-    client = MagicMock()
-    DockerClient.return_value = client
-
-    container = MagicMock()
-    client.containers.get.return_value = container
-
-    logs = [
+def test_iter_logs():
+    lines = [
         "0 MessageA",
         "MessageB",
         {"message": "MessageC"}
     ]
-    container.logs.return_value = logs
-
-    output = []
-    queue = MagicMock()
-    queue.put = output.append
-
-    log_provider.monitor_logs("main", "chute-main", queue)
 
+    output = list(log_provider.iter_logs("main", lines))
     assert len(output) == 3
     assert output[0]['message'] == "MessageA"
+    assert output[0]['timestamp'] == "0"
     assert output[1]['message'] == "MessageB"
     assert output[2]['message'] == "MessageC"
+    assert all(msg['service'] == "main" for msg in output)
+
+
+@patch("paradrop.core.container.log_provider.getAPIClient")
+def test_LogStream(getAPIClient):
+    client = MagicMock()
+    client._get_result.return_value = iter(["0 MessageA"])
+    getAPIClient.return_value = client
+
+    stream = log_provider.LogStream("chute-main", tail=10, since=5)
+    params = client._get.call_args[1]['params']
+    assert params['follow'] == 1
+    assert params['tail'] == 10
+    assert params['since'] == 5
+    assert list(stream) == ["0 MessageA"]
+
+    # Closing shuts down the socket to wake up a blocked reader.
+    stream.close()
+    stream.close()
+    assert stream.socket.shutdown.call_count == 1
+    assert stream.response.close.call_count == 1
+
+
+def test_LogBroker():
+    broker = log_provider.LogBroker("test", capacity=3)
+
+    first = []
+    consumer = MagicMock()
+    consumer.write = first.append
+    sub1 = broker.subscribe(consumer)
+    sub1.resumeProducing()
+
+    broker.publish({"message": "A"})
+    broker.publish({"message": "B"})
+    assert first == ['{"message": "A"}', '{"message": "B"}']
+
+    # A new subscriber receives history from the buffer.
+    second = []
+    consumer = MagicMock()
+    consumer.write = second.append
+    sub2 = broker.subscribe(consumer)
+    assert second == []
+    sub2.resumeProducing()
+    assert second == first
+
+    # A paused subscriber that falls behind skips the oldest messages.
+    sub2.pauseProducing()
+    for msg in ["C", "D", "E", "F"]:
+        broker.publish({"message": msg})
+    assert len(first) == 6
+    assert len(second) == 2
+
+    sub2.resumeProducing()
+    assert second[2:] == first[3:]
+    assert sub2.dropped == 1
+
+    # The broker stops when the last subscriber leaves.
+    log_provider.brokers["test"] = broker
+    sub1.stopProducing()
+    assert not broker.stopped
+    sub2.stopProducing()
+    assert broker.stopped
+    assert "test" not in log_provider.brokers
+
+    broker.publish({"message": "G"})
+    assert len(first) == 6
+
+
+@patch("paradrop.core.container.log_provider.reactor")
+@patch("paradrop.core.container.log_provider.getStateCache")
+@patch("paradrop.core.container.log_provider.LogStream")
+def test_LogBroker_follow(LogStream, getStateCache, reactor):
+    cache = MagicMock()
+    getStateCache.return_value = cache
+
+    service = MagicMock()
+    service.name = "main"
+    service.get_container_name.return_value = "test-main"
+
+    broker = log_provider.LogBroker("test")
+    with patch.object(broker, "startFollower") as startFollower:
+        broker.start([service], tail=10)
+        startFollower.assert_called_once_with("main", "test-main", 10)
+        cache.addListener.assert_called_once_with(broker.containerChanged)
+
+        # A new container for the service is followed from when it started.
+        broker.containerChanged("test-main", {'Action': 'start', 'time': 5})
+        startFollower.assert_called_with("main", "test-main", "all", since=5)
+
+        # Other containers and events are ignored.
+        startFollower.reset_mock()
+        broker.containerChanged("other", {'Action': 'start'})
+        broker.containerChanged("test-main", {'Action': 'die'})
+        assert startFollower.call_count == 0
+
+    first = MagicMock()
+    first.__iter__.return_value = iter(["0 MessageA"])
+    first.closed = False
+    LogStream.return_value = first
+
+    broker.follow("main", "test-main", 10)
+    assert reactor.callFromThread.call_count == 1
+    assert first.close.called
+
+    # Stopping the broker closes open streams.
+    second = MagicMock()
+    broker.streams["test-main"] = second
+    broker.stop()
+    assert second.close.called
+    assert broker.streams == {}
+    cache.removeListener.assert_called_once_with(broker.containerChanged)
+
+
+@patch("paradrop.core.container.log_provider.LogBroker.start")
+def test_subscribe(start):
+    chute = MagicMock()
+    chute.name = "test"
+
+    sub1 = log_provider.subscribe(chute, MagicMock())
+    sub2 = log_provider.subscribe(chute, MagicMock())
+    assert sub1.broker is sub2.broker
+    assert start.call_count == 1
+
+    sub1.stopProducing()
+    sub2.stopProducing()
+    assert "test" not in log_provider.brokers
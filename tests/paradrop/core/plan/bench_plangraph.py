@@ -0,0 +1,130 @@
+"""
+Benchmark for generating and executing large plan maps.
+
+This is not collected as a unit test.  Run it from the top of the repository:
+
+    python -m tests.paradrop.core.plan.bench_plangraph [plans]
+"""
+from __future__ import print_function
+
+import heapq
+import sys
+import time
+
+from paradrop.core.plan.plangraph import Plan, PlanMap
+
+
+class LegacyPlanMap(PlanMap):
+    """
+    Skip and abort handling from the previous PlanMap (for comparison).
+    """
+    def __init__(self, name):
+        PlanMap.__init__(self, name)
+        self.workingAbortPlans = []
+        self.skipFunctions = []
+
+    def addPlans(self, priority, todoPlan, abortPlan=[]):
+        abortP = [Plan(*a) for a in abortPlan] or None
+        todoP = Plan(*todoPlan)
+        self.plans.append((priority, todoP, abortP))
+        heapq.heappush(self.workingPlans, (priority, todoP, abortP))
+
+    def registerSkip(self, func):
+        self.skipFunctions.append(func)
+
+    def getNextTodo(self):
+        if len(self.workingPlans) == 0:
+            return None
+        else:
+            prio, todo, abt = heapq.heappop(self.workingPlans)
+            self.maxPriorityReturned = prio
+            if todo.func in self.skipFunctions:
+                return self.getNextTodo()
+            else:
+                self.abortPlans.append(abt)
+                return (todo.func, todo.args)
+
+    def getNextAbort(self):
+        if not self.startedAbort:
+            for stage in reversed(self.abortPlans[:-1]):
+                if not stage:
+                    continue
+                for a in stage:
+                    if a not in self.workingAbortPlans:
+                        self.workingAbortPlans.append(a)
+            self.startedAbort = True
+
+        if len(self.workingAbortPlans) == 0:
+            return None
+        else:
+            abt = self.workingAbortPlans.pop(0)
+            return (abt.func, abt.args)
+
+
+def makeFunction(name):
+    def function(update, *args):
+        pass
+    function.__name__ = name
+    return function
+
+
+def generate(cls, count):
+    """
+    Build a plan map resembling a router-wide update with many services.
+
+    Each plan has a set function with its own revert function, and the
+    reload functions that follow are shared and mostly skipped.
+    """
+    reloads = [makeFunction("reload{}".format(i)) for i in range(count // 10)]
+
+    plans = cls("bench")
+    for i in range(count):
+        setter = makeFunction("set{}".format(i))
+        revert = makeFunction("revert{}".format(i))
+        plans.addPlans(50 + i % 10, (setter, i),
+                       [(revert, i), (reloads[i % len(reloads)], )])
+        plans.addPlans(80 + i % 10, (reloads[i % len(reloads)], ))
+
+    for reload in reloads[:-1]:
+        plans.registerSkip(reload)
+
+    return plans
+
+
+def execute(plans):
+    executed = 0
+    while plans.getNextTodo() is not None:
+        executed += 1
+
+    aborted = 0
+    while plans.getNextAbort() is not None:
+        aborted += 1
+
+    return executed, aborted
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    results = []
+    for name, cls in [("legacy", LegacyPlanMap), ("current", PlanMap)]:
+        start = time.time()
+        plans = generate(cls, count)
+        generation = time.time() - start
+
+        # The todo loop recurses once per skipped plan in the legacy code.
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 4 * count))
+
+        start = time.time()
+        result = execute(plans)
+        execution = time.time() - start
+        results.append(result)
+
+        print("{:8} {} plans: generate {:.3f}s, execute and abort {:.3f}s"
+              .format(name, count * 2, generation, execution))
+
+    assert results[0] == results[1]
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,82 @@ def test_docstrings():
         if func.func.__doc__ is None:
             raise Exception("{}.{} has no docstring.".format(
                 func.func.__module__, func.func.__name__))
+
+
+def test_shared_state_lock():
+    from mock import MagicMock
+    from twisted.internet.defer import Deferred
+    from paradrop.core.plan import plangraph
+
+    locked = []
+    def func(update):
+        locked.append(executionplan.sharedStateLock.locked())
+
+    def build(update):
+        locked.append(executionplan.sharedStateLock.locked())
+        return Deferred()
+
+    def fail(update):
+        raise Exception("failed")
+
+    update = MagicMock()
+    update.plans = plangraph.PlanMap("test")
+    update.plans.addPlans(plangraph.STRUCT_GET_SYSTEM_DEVICES, (func, ))
+    update.plans.addPlans(plangraph.STATE_BUILD_IMAGE, (build, ))
+    update.plans.addPlans(plangraph.STRUCT_SET_OS_NETWORK, (func, ), (func, ))
+    update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG, (func, ))
+    update.plans.addPlans(plangraph.STATE_CALL_START, (func, ))
+    update.plans.addPlans(plangraph.STATE_SAVE_CHUTE, (fail, ), (func, ))
+
+    # Shared stages hold the lock, and it is released when execution yields
+    # or fails.
+    result = executionplan.executePlans(update)
+    assert isinstance(result, Deferred)
+    assert locked == [True, False]
+    assert not executionplan.sharedStateLock.locked()
+
+    assert executionplan.executePlans(update) is True
+    assert locked == [True, False, True, True, False]
+    assert not executionplan.sharedStateLock.locked()
+
+    # Abort plans run under the lock.
+    assert executionplan.abortPlans(update) is False
+    assert locked[-1] is True
+    assert not executionplan.sharedStateLock.locked()
+
+
+def test_SharedStateLock():
+    import threading
+    import time
+
+    lock = executionplan.SharedStateLock()
+
+    # Without waiters, or without holding the lock, there is nothing to
+    # yield to.
+    assert lock.yieldToWaiters() is False
+    with lock:
+        assert lock.heldByCurrentThread()
+        assert lock.yieldToWaiters() is False
+    assert not lock.locked()
+
+    order = []
+    def waiter(name):
+        with lock:
+            order.append(name)
+
+    lock.acquire()
+    threads = [threading.Thread(target=waiter, args=(x, )) for x in "ab"]
+    for thread in threads:
+        thread.start()
+        while lock.nextTicket - lock.serving < 2 + threads.index(thread):
+            time.sleep(0.001)
+
+    # Waiting threads run first, in the order they arrived.
+    assert lock.yieldToWaiters() is True
+    assert lock.heldByCurrentThread()
+    order.append("main")
+    lock.release()
+
+    for thread in threads:
+        thread.join(1)
+    assert order == ["a", "b", "main"]
@@ -204,6 +204,47 @@ def test_plangraph():
     pm.addMap(pm)
     assert repr(pm) == "<PlanMap 'test': 20 Plans>"
 
+
+def test_plangraph_skip_and_abort():
+    from paradrop.core.plan.plangraph import PlanMap
+
+    def work(x):
+        pass
+    def skipped(x):
+        pass
+    def revert(x):
+        pass
+
+    pm = PlanMap('test')
+    for i in range(5):
+        pm.addPlans(10, (work, i), [(revert, 'shared'), (revert, {'i': i})])
+    for i in range(5):
+        pm.addPlans(20, (skipped, i))
+    pm.addPlans(30, (work, 'last'))
+
+    pm.registerSkip(skipped)
+
+    # Plans with equal priority are returned in the order they were added,
+    # and skipped functions are not returned at all.
+    todo = []
+    while True:
+        p = pm.getNextTodo()
+        if p is None:
+            break
+        todo.append(p[1])
+    assert todo == [(i, ) for i in range(5)] + [('last', )]
+
+    # Duplicate abort plans are only returned once, including plans with
+    # unhashable arguments.
+    abort = []
+    while True:
+        p = pm.getNextAbort()
+        if p is None:
+            break
+        abort.append(p[1])
+    assert abort == [('shared', ), ({'i': 4}, ), ({'i': 3}, ), ({'i': 2}, ),
+                     ({'i': 1}, ), ({'i': 0}, )]
+
 def test_state():
     """
     Test plan generation for state module
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import tempfile
+
+from mock import MagicMock, patch
+
+from paradrop.core.system import dhcp_leases
+
+
+@patch('__builtin__.open')
+def test_read_leases(open):
+    file_object = MagicMock()
+    file_object.__enter__.return_value = [
+        "1480650200 00:11:22:33:44:55 192.168.128.130 android-ffeeddccbbaa9988 *",
+        "1480640500 00:22:44:66:88:aa 192.168.128.170 someones-iPod 01:00:22:44:66:88:aa"
+    ]
+    open.return_value = file_object
+
+    leases = dhcp_leases.read_leases("/")
+    assert len(leases) == 2
+    assert leases[0]['ip_addr'] == "192.168.128.130"
+
+
+def test_update_lease():
+    leases = {
+        '00:11:22:33:44:55': {
+            'as_of': 100,
+            'mac_addr': '00:11:22:33:44:55'
+        },
+        '00:22:44:66:88:aa': {
+            'as_of': 100,
+            'mac_addr': '00:22:44:66:88:aa'
+        }
+    }
+
+    # An old entry should not replace a newer one.
+    old_entry = {
+        'as_of': 50,
+        'mac_addr': '00:11:22:33:44:55'
+    }
+    result = dhcp_leases.update_lease(leases, old_entry)
+    assert result['as_of'] == 100
+    assert leases['00:11:22:33:44:55']['as_of'] == 100
+
+    # A newer entry should take the place of an older one.
+    old_entry = {
+        'as_of': 200,
+        'mac_addr': '00:11:22:33:44:55'
+    }
+    result = dhcp_leases.update_lease(leases, old_entry)
+    assert result['as_of'] == 200
+    assert leases['00:11:22:33:44:55']['as_of'] == 200
+
+    # A previously-unseen address should be added.
+    old_entry = {
+        'as_of': 0,
+        'mac_addr': '00:33:66:99:cc:ff'
+    }
+    result = dhcp_leases.update_lease(leases, old_entry)
+    assert result['as_of'] == 0
+    assert len(leases) == 3
+
+
+@patch('paradrop.core.system.dhcp_leases.client')
+def test_LeaseIndex(client):
+    temp = tempfile.mkdtemp()
+    try:
+        path1 = os.path.join(temp, "dnsmasq-wifi.leases")
+        path2 = os.path.join(temp, "dnsmasq-lan.leases")
+        client.getLeaseFiles.return_value = [("chute1", path1),
+                                             ("chute2", path2)]
+
+        with open(path1, "w") as output:
+            output.write("1480650200 00:11:22:33:44:55 192.168.128.130 phone *\n")
+        os.utime(path1, (100, 100))
+
+        index = dhcp_leases.LeaseIndex()
+
+        # Missing files are skipped.
+        etag, body = index.getDevices()
+        leases = json.loads(body)
+        assert len(leases) == 1
+        assert leases[0]['expires'] == 1480650200
+        assert leases[0]['as_of'] == 100
+
+        # Nothing changed, so nothing is read again.
+        with patch('paradrop.core.system.dhcp_leases.read_lease_records') as read:
+            assert index.getDevices() == (etag, body)
+            records = json.loads(index.getFile(path1).body)
+            assert records[0]['expires'] == "1480650200"
+            assert read.call_count == 0
+
+        # A device that moved to another network is reported once, with the
+        # most recent lease.
+        with open(path2, "w") as output:
+            output.write("1480650300 00:11:22:33:44:55 10.0.0.10 phone *\n")
+            output.write("1480650300 00:22:44:66:88:aa 10.0.0.11 tablet *\n")
+        os.utime(path2, (200, 200))
+
+        etag2, body = index.getDevices()
+        assert etag2 != etag
+        leases = {x['mac_addr']: x for x in json.loads(body)}
+        assert len(leases) == 2
+        assert leases['00:11:22:33:44:55']['ip_addr'] == "10.0.0.10"
+
+        # Removed files are forgotten.
+        os.remove(path2)
+        assert index.getDevices()[0] == etag
+        assert path2 not in index.files
+    finally:
+        shutil.rmtree(temp)
@@ -7,7 +7,7 @@ from mock import patch, MagicMock
 def test_update_manager(mReload, mUpdObj, mOut):
     reactor = MagicMock()
     c = update_manager.UpdateManager(reactor)
-    reactor.callInThread.assert_called_once_with(c._perform_updates)
+    reactor.callWhenRunning.assert_called_once_with(c._start_workers)
 
     #Test getNextUpdate & updateList & clearUpdateList
     assert c.updateQueue == []
@@ -37,3 +37,422 @@ def test_update_manager(mReload, mUpdObj, mOut):
     #assert mUpdObj.parse.call_count == 3
     #assert update.execute.call_count == 2
 
+
+
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_get_timing_summary(mReload):
+    reactor = MagicMock()
+    manager = update_manager.UpdateManager(reactor)
+
+    def entry(function, wall, success=True):
+        return {'function': function, 'module': 'test', 'wall': wall,
+                'cpu': wall / 2, 'success': success}
+
+    for timeline in [[entry('a', 1.0), entry('b', 5.0)],
+                     [entry('a', 2.0), entry('b', 1.0, False)]]:
+        update = MagicMock()
+        update.timeline = timeline
+        manager.recent_changes.append(update)
+
+    summary = manager.get_timing_summary()
+    assert [x['function'] for x in summary] == ['b', 'a']
+    assert summary[0]['calls'] == 2
+    assert summary[0]['failures'] == 1
+    assert summary[0]['wall'] == 6.0
+    assert summary[0]['max_wall'] == 5.0
+
+    # Only consider the most recent change.
+    summary = manager.get_timing_summary(1)
+    assert [x['function'] for x in summary] == ['a', 'b']
+    assert summary[0]['wall'] == 2.0
+
+
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_update_queue(mReload):
+    import threading
+    import time
+
+    reactor = MagicMock()
+    manager = update_manager.UpdateManager(reactor)
+    reactor.addSystemEventTrigger.assert_any_call('before', 'shutdown',
+            manager.stop)
+    reactor.addSystemEventTrigger.assert_any_call('during', 'shutdown',
+            manager.workerPool.stop)
+
+    def make_update(name, updateClass='CHUTE'):
+        update = MagicMock()
+        update.name = name
+        update.updateClass = updateClass
+        update.queuedTime = None
+        return update
+
+    # Router updates run before chute updates, and resumed updates run
+    # before both.  Otherwise updates run in the order they were queued.
+    manager._enqueue(make_update('chute1'))
+    manager._enqueue(make_update('router', 'ROUTER'))
+    manager._enqueue(make_update('chute2'))
+    manager._enqueue(make_update('resumed'), update_manager.PRIORITY_RESUME)
+
+    names = [x.name for x in manager.get_queued_changes()]
+    assert names == ['resumed', 'router', 'chute1', 'chute2']
+    for name in names:
+        update = manager._get_next_update(block=True)
+        assert update.name == name
+        manager._release_update(update)
+
+    # A blocked worker wakes up as soon as an update is added.
+    result = []
+    def worker():
+        result.append(manager._get_next_update(block=True))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.05)
+    assert result == []
+    update = make_update('chute3')
+    manager._enqueue(update)
+    thread.join(1)
+    assert result == [update]
+    assert update.queuedTime is not None
+    manager._release_update(update)
+
+    # Stopping the manager releases the worker.
+    thread = threading.Thread(target=worker)
+    thread.start()
+    manager.stop()
+    thread.join(1)
+    assert not thread.is_alive()
+    assert result[-1] is None
+
+
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_concurrent_updates(mReload):
+    manager = update_manager.UpdateManager(MagicMock())
+
+    def make_update(name, updateClass='CHUTE'):
+        update = MagicMock()
+        update.name = name
+        update.updateClass = updateClass
+        update.queuedTime = None
+        return update
+
+    a1 = make_update('a')
+    a2 = make_update('a')
+    a3 = make_update('a')
+    b = make_update('b')
+    router = make_update('router', 'ROUTER')
+
+    # The second update to chute a waits for the first one.
+    manager._enqueue(a1)
+    manager._enqueue(a2)
+    assert manager._get_next_update() is a1
+    assert manager._get_next_update() is None
+
+    # The router update waits for running updates, and chute b waits
+    # behind the router update.
+    manager._enqueue(router)
+    manager._enqueue(b)
+    assert manager._get_next_update() is None
+    manager._release_update(a1)
+
+    # The router update runs alone.
+    assert manager._get_next_update() is router
+    assert manager._get_next_update() is None
+    manager._release_update(router)
+
+    # Updates to different chutes run at the same time.
+    assert manager._get_next_update() is a2
+    assert manager._get_next_update() is b
+
+    # A suspended update (still active, but not held by a worker) also
+    # blocks later updates to the same chute.
+    manager.active_changes[2] = a2
+    manager._release_update(a2)
+    manager._enqueue(a3)
+    assert manager._get_next_update() is None
+    del manager.active_changes[2]
+    assert manager._get_next_update() is a3
+
+
+@patch('paradrop.core.update.update_manager.settings')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_perform_updates(mReload, mSettings):
+    mReload.return_value = []
+    mSettings.FC_UPDATE_WORKERS = 3
+
+    reactor = MagicMock()
+    reactor.running = False
+    manager = update_manager.UpdateManager(reactor)
+    manager.workerPool = MagicMock()
+    manager._start_workers()
+    manager.workerPool.callInThread.assert_called_once_with(manager._perform_updates)
+
+    # The first worker starts the others in the same thread pool.
+    manager._perform_updates(checkDocker=False)
+    assert manager.workerPool.callInThread.call_count == 3
+    manager.workerPool.callInThread.assert_called_with(manager._run_worker)
+    assert reactor.callInThread.call_count == 0
+
+    # A failed update does not stay active.
+    update = MagicMock()
+    update.change_id = 1
+    update.execute.side_effect = Exception("failed")
+    manager._perform_update(update)
+    assert 1 not in manager.active_changes
+    assert update in manager.recent_changes
+
+
+@patch('paradrop.core.update.update_manager.nexus')
+@patch('paradrop.core.config.reservations.prepareHostConfig')
+@patch('paradrop.core.config.state.ChuteStorage')
+@patch('paradrop.core.config.reservations.ChuteStorage')
+@patch('paradrop.core.update.update_manager.settings')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_overlapping_update_reservations(mReload, mSettings, ChuteStorage,
+        StateStorage, prepareHostConfig, nexus):
+    import ipaddress
+    import threading
+    import time
+    from paradrop.core.chute.chute import Chute
+    from paradrop.core.config import network, reservations, state
+    from paradrop.core.plan import executionplan, plangraph
+
+    mSettings.FC_UPDATE_WORKERS = 2
+    mSettings.FC_UPDATE_HISTORY = 10
+    mSettings.FC_BOUNCE_UPDATE = None
+    nexus.core.provisioned.return_value = False
+    prepareHostConfig.return_value = {}
+
+    # Saving a chute puts it in the chute list that reservations are read
+    # from.
+    ChuteStorage.chuteList = {}
+    def saveChute(chute):
+        ChuteStorage.chuteList[chute.name] = chute
+    StateStorage.return_value.saveChute.side_effect = saveChute
+    reservations.index.reset()
+
+    hostConfig = {'system': {'chuteSubnetPool': '10.128.0.0/9'}}
+    allocated = {}
+    building = {}
+
+    def allocate(update):
+        subnet = network.chooseSubnet(update, {}, {})
+        allocated[update.name] = subnet
+        update.new.setCache('networkInterfaces', [{
+            'type': 'wifi',
+            'subnet': subnet
+        }])
+
+    def build(update):
+        # Each update waits in a concurrent stage until the other one has
+        # allocated its subnet, so neither chute is saved before both
+        # allocations have happened.
+        building[update.name].set()
+        for event in building.values():
+            event.wait(5)
+
+    def make_update(name):
+        update = MagicMock()
+        update.name = name
+        update.updateClass = 'CHUTE'
+        update.updateType = 'create'
+        update.queuedTime = None
+        update.superseded = []
+        update.new = Chute(name=name)
+
+        cache = {'hostConfig': hostConfig}
+        update.cache_get.side_effect = cache.get
+        update.cache_set.side_effect = cache.__setitem__
+
+        update.plans = plangraph.PlanMap(name)
+        update.plans.addPlans(plangraph.STRUCT_GET_RESERVATIONS,
+                              (reservations.getReservations, ),
+                              (reservations.releaseReservations, ))
+        update.plans.addPlans(plangraph.STRUCT_GET_INT_NETWORK, (allocate, ))
+        update.plans.addPlans(plangraph.STATE_BUILD_IMAGE, (build, ))
+        update.plans.addPlans(plangraph.STATE_SAVE_CHUTE, (state.saveChute, ),
+                              (state.revertChute, ))
+        update.execute.side_effect = lambda: executionplan.executePlans(update)
+
+        building[name] = threading.Event()
+        return update
+
+    def make_router_update(updateType):
+        update = MagicMock()
+        update.name = updateType
+        update.updateClass = 'ROUTER'
+        update.queuedTime = None
+        update.superseded = []
+        update.execute.return_value = None
+        return update
+
+    a = make_update('a')
+    b = make_update('b')
+    mReload.return_value = [a, b]
+
+    reactor = MagicMock()
+    reactor.running = True
+    manager = update_manager.UpdateManager(reactor)
+    manager._make_router_update = make_router_update
+    manager.workerPool.start()
+
+    worker = threading.Thread(target=manager._perform_updates,
+            kwargs={'checkDocker': False})
+    worker.start()
+
+    try:
+        deadline = time.time() + 10
+        while len(manager.recent_changes) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        manager.stop()
+        worker.join(5)
+        manager.workerPool.stop()
+        reservations.index.reset()
+
+    # Both updates were building at the same time, and they were given
+    # different subnets.
+    assert all(event.is_set() for event in building.values())
+    assert set(allocated.keys()) == set(['a', 'b'])
+    assert allocated['a'] != allocated['b']
+    assert set(ChuteStorage.chuteList.keys()) == set(['a', 'b'])
+
+    # Nothing is left claimed after both chutes were saved.
+    assert reservations.index.pending == {}
+
+
+@patch('paradrop.core.update.update_manager.nexus')
+@patch('paradrop.confd.client.reloadAll')
+@patch('paradrop.core.update.update_manager.settings')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_queued_updates_share_reload(mReload, mSettings, reloadAll, nexus):
+    import json
+    import threading
+    import time
+    from paradrop.core.config import configservice
+    from paradrop.core.plan import executionplan, plangraph
+
+    mSettings.FC_UPDATE_WORKERS = 1
+    mSettings.FC_UPDATE_HISTORY = 10
+    mSettings.FC_BOUNCE_UPDATE = None
+    nexus.core.provisioned.return_value = False
+    reloadAll.return_value = json.dumps([])
+
+    finished = []
+
+    def finish(update):
+        finished.append(update.name)
+
+    def make_update(name, updateClass='CHUTE'):
+        update = MagicMock()
+        update.name = name
+        update.updateClass = updateClass
+        update.queuedTime = None
+        update.superseded = []
+
+        cache = {}
+        update.cache_get.side_effect = cache.get
+        update.cache_set.side_effect = cache.__setitem__
+
+        update.plans = plangraph.PlanMap(name)
+        update.plans.addPlans(plangraph.RUNTIME_RELOAD_CONFIG,
+                              (configservice.reloadAll, ))
+        update.plans.addPlans(plangraph.STATE_SAVE_CHUTE, (finish, ))
+        update.execute.side_effect = lambda: executionplan.executePlans(update)
+        return update
+
+    # The boot queue runs the router updates and then reloads the chutes.
+    mReload.return_value = [make_update(name) for name in ['a', 'b', 'c']]
+
+    reactor = MagicMock()
+    reactor.running = True
+    manager = update_manager.UpdateManager(reactor)
+    manager._make_router_update = lambda updateType: make_update(updateType,
+            'ROUTER')
+
+    worker = threading.Thread(target=manager._perform_updates,
+            kwargs={'checkDocker': False})
+    worker.start()
+
+    try:
+        deadline = time.time() + 10
+        while len(finished) < 5 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        manager.stop()
+        worker.join(5)
+
+    # Each router update reloads by itself, and the chute updates share one
+    # reload even though there is only one worker.
+    assert sorted(finished) == ['a', 'b', 'c', 'inithostconfig', 'prehostconfig']
+    assert reloadAll.call_count == 3
+    assert configservice.reloadWaiters == []
+
+
+@patch('paradrop.core.update.update_object.ChuteStorage')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_add_update_no_coalesce(mReload, ChuteStorage):
+    manager = update_manager.UpdateManager(MagicMock())
+
+    # Updates are not combined unless coalescing is enabled.
+    for i in range(2):
+        manager.add_update(updateClass='CHUTE', updateType='restart',
+                name='test', tok=111111)
+    assert len(manager.get_queued_changes()) == 2
+
+
+@patch('paradrop.core.update.update_manager.settings.FC_UPDATE_COALESCE', True)
+@patch('paradrop.core.update.update_object.reactor')
+@patch('paradrop.core.update.update_object.ChuteStorage')
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_add_update_coalesce(mReload, ChuteStorage, reactor):
+    from paradrop.core.chute.chute import Chute
+
+    reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+    storage = MagicMock()
+    ChuteStorage.return_value = storage
+    storage.getChute.return_value = Chute(name='test', version=1)
+
+    manager = update_manager.UpdateManager(MagicMock())
+
+    results = []
+    def add_update(updateType, name='test', **kwargs):
+        d = manager.add_update(updateClass='CHUTE', updateType=updateType,
+                name=name, tok=111111, **kwargs)
+        d.addCallback(results.append)
+
+    # A burst of changes to one chute runs one update.
+    add_update('restart')
+    add_update('restart')
+    add_update('update', version=2)
+    add_update('restart')
+    add_update('restart', name='other')
+
+    queued = manager.get_queued_changes()
+    assert [(x.name, x.updateType) for x in queued] == [
+            ('test', 'update'), ('other', 'restart')]
+    assert [x.change_id for x in queued[0].superseded] == [1, 2, 4]
+    assert queued[0].queueLatency is None
+    assert manager.find_change(2).supersededBy is queued[0]
+
+    update = manager._get_next_update()
+    manager.active_changes[update.change_id] = update
+    update.complete(success=True, message="Done")
+    manager._finish_change(update)
+    assert sorted(x.change_id for x in results) == [1, 2, 3, 4]
+    assert all(x.result['success'] for x in results)
+    assert manager.find_change(4).completed
+
+
+@patch('paradrop.core.update.update_manager.reloadChutes')
+def test_get_latency_summary(mReload):
+    manager = update_manager.UpdateManager(MagicMock())
+    assert manager.get_latency_summary()['count'] == 0
+
+    for latency in [0.5, 1.5, None]:
+        update = MagicMock()
+        update.queueLatency = latency
+        manager.recent_changes.append(update)
+
+    summary = manager.get_latency_summary()
+    assert summary == {'count': 2, 'mean': 1.0, 'max': 1.5}
@@ -63,3 +63,113 @@ def test_UpdateChute(ChuteStorage):
 
     # Update should have picked up version number from the old chute.
     assert update.new.version == old_chute_data['version']
+
+
+@patch('paradrop.core.update.update_object.ChuteStorage')
+def test_update_timeline(ChuteStorage):
+    from paradrop.core.plan import executionplan
+
+    def slow(update):
+        pass
+
+    def broken(update):
+        raise Exception("Boom!")
+
+    def revert(update):
+        pass
+
+    update = dict(updateClass='CHUTE', updateType='create', name='test',
+            tok=111111)
+    update = update_object.parse(update)
+    update.plans.addPlans(10, (slow, ), [(revert, )])
+    update.plans.addPlans(20, (broken, ))
+
+    assert executionplan.executePlans(update)
+    assert executionplan.abortPlans(update) is False
+
+    timeline = update.timeline
+    assert [x['function'] for x in timeline] == ["slow", "broken", "revert"]
+    assert [x['phase'] for x in timeline] == ["execute", "execute", "abort"]
+    assert [x['priority'] for x in timeline] == [10, 20, None]
+    assert [x['success'] for x in timeline] == [True, False, True]
+    assert all(x['wall'] >= 0 and x['cpu'] >= 0 for x in timeline)
+
+
+@patch('paradrop.core.update.update_object.ChuteStorage')
+def test_coalesce(ChuteStorage):
+    storage = MagicMock()
+    ChuteStorage.return_value = storage
+    storage.getChute.return_value = Chute(name='test', version=1)
+
+    def make_update(updateType, **kwargs):
+        update = dict(updateClass='CHUTE', updateType=updateType,
+                name='test', tok=111111, **kwargs)
+        return update_object.parse(update)
+
+    restart = make_update('restart')
+    update = make_update('update', version=2)
+    assert update_object.coalesce(restart, update) is update
+    assert update_object.coalesce(update, restart) is update
+    assert update_object.coalesce(update, make_update('stop')) is None
+
+    # A restart that changes the chute is not covered by an earlier update.
+    changed = make_update('restart', environment={'DEBUG': '1'})
+    assert changed.changes_chute()
+    assert update_object.coalesce(update, changed) is None
+    assert update_object.coalesce(changed, make_update('restart')) is not None
+
+    # Updates that have started, or are for other chutes, are not combined.
+    other = make_update('restart')
+    other.name = 'other'
+    assert update_object.coalesce(restart, other) is None
+    restart.execute_called = True
+    assert update_object.coalesce(restart, update) is None
+
+
+@patch('paradrop.core.update.update_object.threads')
+@patch('paradrop.core.update.update_object.reactor')
+@patch('paradrop.core.update.update_object.ChuteStorage')
+def test_supersede_workdir(ChuteStorage, reactor, threads):
+    first = update_object.parse(dict(updateClass='CHUTE', updateType='update',
+            name='test', tok=111111, change_id=1, workdir='/tmp/upload-1'))
+    second = update_object.parse(dict(updateClass='CHUTE', updateType='update',
+            name='test', tok=111112, change_id=2, workdir='/tmp/upload-2'))
+
+    # Uploaded files of the superseded update are removed later, off the
+    # reactor thread.
+    second.supersede(first)
+    reactor.callFromThread.assert_called_once_with(threads.deferToThread,
+            update_object.shutil.rmtree, '/tmp/upload-1', True)
+
+
+@patch('paradrop.core.update.update_object.reactor')
+@patch('paradrop.core.update.update_object.ChuteStorage')
+def test_supersede(ChuteStorage, reactor):
+    reactor.callFromThread.side_effect = lambda f, *args: f(*args)
+
+    first = update_object.parse(dict(updateClass='CHUTE', updateType='restart',
+            name='test', tok=111111, change_id=1, deferred=MagicMock()))
+    second = update_object.parse(dict(updateClass='CHUTE', updateType='restart',
+            name='test', tok=111112, change_id=2, deferred=MagicMock()))
+    third = update_object.parse(dict(updateClass='CHUTE', updateType='restart',
+            name='test', tok=111113, change_id=3, deferred=MagicMock()))
+
+    second.supersede(first)
+    third.supersede(second)
+    assert third.superseded == [first, second]
+    assert first.supersededBy is second
+
+    # Superseded updates are reported as started with the update that runs.
+    for update in [first, second]:
+        update.started = MagicMock()
+    third.started()
+    assert first.started.called
+    assert second.started.called
+
+    # All waiters are answered with the result of the update that ran.
+    deferreds = [x.deferred for x in [first, second, third]]
+    third.complete(success=True, message="Done")
+    for update, d in zip([first, second, third], deferreds):
+        assert update.completed
+        assert update.result['success']
+        d.callback.assert_called_once_with(update)
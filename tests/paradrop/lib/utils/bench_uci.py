@@ -0,0 +1,164 @@
+"""
+Benchmark for parsing large UCI configuration files.
+
+This is not collected as a unit test.  Run it from the top of the repository:
+
+    python -m tests.paradrop.lib.utils.bench_uci [megabytes]
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import time
+
+from paradrop.lib.utils import uci
+
+
+SECTION = """config interface chute{0}
+    option proto 'static'
+    option ipaddr '10.{1}.{2}.1'
+    option netmask '255.255.255.0'
+    option description 'Interface for chute number {0}'
+    list ifname 'eth{0}'
+    list ifname 'wlan{0}'
+
+"""
+
+
+def legacyGetLineParts(line):
+    """
+    Line splitting from the previous parser (for comparison).
+    """
+    parts = line.split(" ")
+
+    if len(parts) <= 1:
+        return parts
+
+    groups = []
+
+    while len(parts) > 0:
+        word = parts.pop(0)
+
+        if len(word) == 0:
+            continue
+
+        opening_quote = None
+        if word.startswith("'") or word.startswith('"'):
+            opening_quote = word[0]
+            word = word[1:]
+
+        closing_quote = None
+        if opening_quote is not None and word.endswith(opening_quote):
+            closing_quote = word[-1]
+            word = word[:-1]
+
+        group = [word]
+
+        if opening_quote is None or opening_quote == closing_quote:
+            groups.append(group)
+            continue
+
+        while len(parts) > 0:
+            word = parts.pop(0)
+
+            if word.endswith(opening_quote):
+                closing_quote = word[-1]
+                word = word[:-1]
+
+            group.append(word)
+
+            if opening_quote == closing_quote:
+                break
+
+        groups.append(group)
+
+    return [" ".join(g) for g in groups]
+
+
+def legacyReadConfig(path):
+    """
+    File parsing from the previous parser (for comparison).
+    """
+    with open(path, "r") as source:
+        lines = source.readlines()
+
+    cfg = None
+    opt = None
+    data = []
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith('#'):
+            continue
+
+        l = legacyGetLineParts(line)
+
+        if l[0] == 'config':
+            if cfg and opt:
+                data.append((cfg, opt))
+            cfg = {'type': l[1]}
+            if len(l) == 3:
+                if l[2].startswith('#'):
+                    cfg['comment'] = l[2][1:]
+                else:
+                    cfg['name'] = l[2]
+            elif len(l) == 4:
+                cfg['name'] = l[2]
+                cfg['comment'] = l[3][1:]
+            opt = {}
+        elif l[0] == 'option':
+            opt[l[1]] = l[2]
+        elif l[0] == 'list':
+            if l[1] not in opt:
+                opt[l[1]] = []
+            opt[l[1]].append(l[2])
+
+    if None not in (cfg, opt):
+        data.append((cfg, opt))
+
+    return data
+
+
+def writeConfig(path, megabytes):
+    size = 0
+    i = 0
+    with open(path, "w") as output:
+        while size < megabytes * 1000000:
+            section = SECTION.format(i, (i // 256) % 256, i % 256)
+            output.write(section)
+            size += len(section)
+            i += 1
+    return i
+
+
+def timeParse(function, path):
+    start = time.time()
+    result = function(path)
+    return time.time() - start, result
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    try:
+        sections = writeConfig(path, megabytes)
+        print("{} MB, {} sections".format(megabytes, sections))
+
+        elapsed, expected = timeParse(legacyReadConfig, path)
+        print("legacy parser:    {:.3f}s".format(elapsed))
+
+        elapsed, result = timeParse(lambda p: list(uci.iterConfigFile(p)),
+                                    path)
+        print("streaming parser: {:.3f}s".format(elapsed))
+
+        assert result == expected
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -58,3 +58,108 @@ def test_getLineParts():
     parts = uci.getLineParts(line)
     assert len(parts) == 3
     assert parts[2] == ''
+
+    # Test quotation marks inside a quoted word.
+    line = "option key 'don't stop'"
+    parts = uci.getLineParts(line)
+    assert parts[2] == "don't stop"
+
+    # Test escaped quotation marks and backslashes.
+    line = "option key 'it\\'s a \\\\'"
+    parts = uci.getLineParts(line)
+    assert parts[2:] == ["it's a \\"]
+
+    line = 'option key "say \\"hi\\" "'
+    parts = uci.getLineParts(line)
+    assert parts[2:] == ['say "hi" ']
+
+    # Other backslashes are kept as they are.
+    line = "option key 'a\\b'"
+    parts = uci.getLineParts(line)
+    assert parts[2] == "a\\b"
+
+    # Test unterminated quotation marks.
+    line = "option key 'correct horse"
+    parts = uci.getLineParts(line)
+    assert parts[2] == "correct horse"
+
+
+def test_parseConfigLines():
+    lines = [
+        "config interface lan #chute",
+        "\toption proto 'static'",
+        "\tlist ifname 'eth0'",
+        "\tlist ifname 'eth1'",
+        "",
+        "# comment",
+        "config wifi-iface",
+        "\toption ssid 'Free WiFi'"
+    ]
+
+    sections = uci.parseConfigLines(iter(lines))
+
+    # Sections are produced one at a time.
+    config, options = next(sections)
+    assert config == {'type': 'interface', 'name': 'lan', 'comment': 'chute'}
+    assert options == {'proto': 'static', 'ifname': ['eth0', 'eth1']}
+
+    config, options = next(sections)
+    assert config == {'type': 'wifi-iface'}
+    assert options == {'ssid': 'Free WiFi'}
+
+    assert list(sections) == []
+
+
+def test_UCIConfig_save():
+    import os
+    import tempfile
+    from mock import patch
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+
+    config = [
+        ({'type': 'interface', 'name': 'lan', 'comment': 'chute'},
+         {'proto': 'static', 'ifname': ['eth0', 'eth1'], 'enabled': True}),
+        ({'type': 'wifi-iface'}, {'ssid': "Bob's  WiFi"}),
+
+        # Backslashes and quotation marks survive a save and reload.
+        ({'type': 'wifi-iface'}, {'key': "pass\\", 'ssid': "a\\'b"}),
+        ({'type': 'wifi-iface'}, {'key': "x' 'y\\\\", 'ssid': "'x' \\'"}),
+        ({'type': 'rule'}, {'match': ["'", "\\", "a b' "]})
+    ]
+
+    cfgFile = uci.UCIConfig(path)
+    cfgFile.addConfigs(config)
+    with patch("paradrop.lib.utils.uci.UCIConfig.backup"):
+        cfgFile.save()
+
+    cfgFile = uci.UCIConfig(path)
+    config[0][1]['enabled'] = '1'
+    assert cfgFile.readConfig() == config
+    assert list(uci.iterConfigFile(path)) == cfgFile.config
+
+    os.remove(path)
+
+
+def test_diffConfigs():
+    lan = ({'type': 'interface', 'name': 'lan'}, {'proto': 'dhcp'})
+    lan2 = ({'type': 'interface', 'name': 'lan'}, {'proto': 'static'})
+    wan = ({'type': 'interface', 'name': 'wan'}, {'proto': 'dhcp'})
+    rule = ({'type': 'rule'}, {'target': 'ACCEPT', 'dest_port': 80})
+    rule2 = ({'type': 'rule'}, {'target': 'ACCEPT', 'dest_port': '80'})
+    other = ({'type': 'rule'}, {'target': 'DROP'})
+
+    # Order does not matter, and values are compared as strings.
+    assert uci.chuteConfigsMatch([lan, rule], [rule2, lan])
+    assert uci.diffConfigs([lan, rule], [rule2, lan]).isEmpty()
+
+    # Duplicates are counted.
+    assert not uci.chuteConfigsMatch([rule, rule], [rule])
+
+    diff = uci.diffConfigs([lan, wan, rule], [lan2, other, rule])
+    assert diff.added == [other]
+    assert diff.removed == [wan]
+    assert diff.changed == [(lan, lan2)]
+    assert not diff.isEmpty()
+    assert str(diff) == "1 added, 1 removed, 1 changed"
@@ -21,8 +21,8 @@ config interface wan #__PARADROP__
 
 
 class TestStorage(PDStorage):
-    def __init__(self, filename):
-        super(TestStorage, self).__init__(filename, 0)
+    def __init__(self, filename, mirrorYaml=True):
+        super(TestStorage, self).__init__(filename, 0, mirrorYaml=mirrorYaml)
         self.data = None
 
     def setAttr(self, data):
@@ -229,8 +229,9 @@ def test_storage():
     storage.setAttr(data)
 
     # Cause the save to fail on the first try, then let it succeed.
-    with patch("paradrop.lib.utils.pdos.open", side_effect=Exception("Boom!")):
+    with patch("paradrop.lib.utils.pdos.writeAtomic", side_effect=Exception("Boom!")):
         storage.saveToDisk()
+    assert not os.path.exists(filename)
     storage.saveToDisk()
     assert os.path.exists(filename)
 
@@ -242,6 +243,101 @@ def test_storage():
     pdos.remove(temp)
 
 
+def test_storage_unchanged():
+    """
+    Test that PDStorage only rewrites the file when the data change
+    """
+    temp = tempfile.mkdtemp()
+    filename = os.path.join(temp, "storage")
+
+    storage = TestStorage(filename, mirrorYaml=False)
+    storage.setAttr({"key": "value"})
+
+    with patch("paradrop.lib.utils.pdos.writeAtomic",
+               wraps=pdos.writeAtomic) as writeAtomic:
+        storage.saveToDisk()
+        assert writeAtomic.call_count == 1
+
+        # Nothing changed, so nothing should be written.
+        storage.saveToDisk()
+        assert writeAtomic.call_count == 1
+
+        # Modifying the data in place is detected.
+        storage.getAttr()["key"] = "other"
+        storage.saveToDisk()
+        assert writeAtomic.call_count == 2
+
+        # Loading the file does not make it look dirty.
+        storage = TestStorage(filename, mirrorYaml=False)
+        assert storage.loadFromDisk()
+        storage.saveToDisk()
+        assert writeAtomic.call_count == 2
+
+    # The YAML mirror was disabled, and no temporary files are left behind.
+    assert os.listdir(temp) == ["storage"]
+
+    pdos.remove(temp)
+
+
+def test_journal():
+    """
+    Test the append-only journal used by PDStorage
+    """
+    from paradrop.lib.utils.pd_storage import Journal
+
+    temp = tempfile.mkdtemp()
+    filename = os.path.join(temp, "journal")
+
+    journal = Journal(filename)
+    journal.append(("save", "a", 1))
+    journal.append(("delete", "a"))
+    assert journal.count == 2
+    assert list(journal.replay()) == [("save", "a", 1), ("delete", "a")]
+
+    # Simulate a crash in the middle of writing a record.
+    with open(filename, "ab") as output:
+        output.write(Journal.HEADER.pack(100, 0) + "partial")
+    assert list(journal.replay()) == [("save", "a", 1), ("delete", "a")]
+
+    # The damaged record was removed, so new records can be replayed.
+    journal.append(("clear", ))
+    assert len(list(journal.replay())) == 3
+
+    journal.reset()
+    assert list(journal.replay()) == []
+
+    pdos.remove(temp)
+
+
+def test_writeAtomic():
+    """
+    Test atomically replacing a file
+    """
+    temp = tempfile.mkdtemp()
+    filename = os.path.join(temp, "file")
+
+    pdos.writeAtomic(filename, "first")
+    pdos.writeAtomic(filename, "second")
+    with open(filename, "r") as source:
+        assert source.read() == "second"
+
+    # A failed write leaves the original contents in place.
+    with patch("os.rename", side_effect=OSError("Boom!")):
+        assert_raises(OSError, pdos.writeAtomic, filename, "third")
+    with open(filename, "r") as source:
+        assert source.read() == "second"
+    assert os.listdir(temp) == ["file"]
+
+    # A new file gets the default permissions, and an existing file keeps
+    # its permissions.
+    assert os.stat(filename).st_mode & 0o777 == 0o666 & ~pdos.UMASK
+    os.chmod(filename, 0o640)
+    pdos.writeAtomic(filename, "fourth")
+    assert os.stat(filename).st_mode & 0o777 == 0o640
+
+    pdos.remove(temp)
+
+
 def test_uci():
     """
     Test UCI file utility module